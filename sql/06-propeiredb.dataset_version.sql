@@ -0,0 +1,10 @@
+\c property_register;
+/* Version of the loaded data, bumped at the end of every pipeline run so caches can key on it */
+CREATE TABLE IF NOT EXISTS "propeiredb".dataset_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO "propeiredb".dataset_version (id, version)
+VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
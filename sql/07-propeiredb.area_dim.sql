@@ -0,0 +1,12 @@
+\c property_register;
+/* Areas of every map type with their sale counts, refreshed by the pipeline and the geocoder for the areas they touch */
+CREATE TABLE IF NOT EXISTS "propeiredb".area_dim (
+    level TEXT NOT NULL,
+    area TEXT NOT NULL,
+    label TEXT NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    first_sale_date DATE,
+    last_sale_date DATE,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (level, area)
+);
@@ -0,0 +1,27 @@
+\c property_register;
+/* County and province of every geocoded address from its coordinates, filled by the geocoder and cli.py reassign-regions */
+ALTER TABLE "propeiredb".geo_encoding_lookup
+    ADD COLUMN IF NOT EXISTS geo_county TEXT,
+    ADD COLUMN IF NOT EXISTS geo_province TEXT;
+
+CREATE INDEX IF NOT EXISTS geo_encoding_lookup_region_idx ON propeiredb.geo_encoding_lookup (region);
+CREATE INDEX IF NOT EXISTS geo_encoding_lookup_geo_county_idx ON propeiredb.geo_encoding_lookup (geo_county);
+
+/* Sales whose PPR county disagrees with the county their geocoded location falls in, a location in no county is not a mismatch */
+CREATE OR REPLACE VIEW propeiredb.geo_county_mismatch AS
+SELECT
+    rr.address_hash,
+    rr.address,
+    rr.sale_date,
+    rr.county,
+    lookup.geo_county,
+    rr.province,
+    lookup.geo_province,
+    lookup.output_address,
+    lookup.lat,
+    lookup.lon
+FROM propeiredb.residential_register as rr
+INNER JOIN propeiredb.geo_encoding_lookup as lookup
+    ON rr.address_hash = lookup.address_hash
+WHERE lookup.lat is not null
+    and lookup.geo_county <> rr.county;
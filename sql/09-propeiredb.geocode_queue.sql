@@ -0,0 +1,21 @@
+\c property_register;
+/* Addresses waiting to be geocoded, filled by the pipeline as sales land and claimed in batches by the geocoders */
+CREATE TABLE IF NOT EXISTS "propeiredb".geocode_queue (
+    address_hash TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    county TEXT,
+    postal_code TEXT,
+    enqueued_at TIMESTAMP NOT NULL DEFAULT now(),
+    leased_by TEXT,
+    leased_until TIMESTAMP,
+    attempts INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS geocode_queue_enqueued_at_idx ON propeiredb.geocode_queue (enqueued_at);
+
+/* Backlog of the register at the time of the migration, the pipeline queues new sales from then on */
+INSERT INTO propeiredb.geocode_queue (address_hash, address, county, postal_code)
+SELECT DISTINCT ON (address_hash) address_hash, address, county, postal_code
+FROM propeiredb.missing_geo_encoded_addresses
+ORDER BY address_hash, sale_date
+ON CONFLICT (address_hash) DO NOTHING;
@@ -0,0 +1,5 @@
+\c property_register;
+/* Geocoder that placed each address, the API or the offline gazetteer, and how closely the gazetteer placed it */
+ALTER TABLE "propeiredb".geo_encoding_lookup
+    ADD COLUMN IF NOT EXISTS geocoder TEXT NOT NULL DEFAULT 'google',
+    ADD COLUMN IF NOT EXISTS confidence TEXT;
@@ -0,0 +1,36 @@
+/*
+ * Clientside callbacks for the pure UI toggles, these never need the server
+ * NOTE: https://dash.plotly.com/clientside-callbacks
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+        // Shows the grouping radio items under a chart only for bar charts
+        checkbox_display: function (chart) {
+            if (chart && chart.indexOf("Bar") !== -1) {
+                return { display: "inline-block" };
+            }
+            return { display: "none" };
+        },
+
+        // Resets the area choice whenever the options change
+        reset_area_choice: function (available_options) {
+            return "All";
+        },
+
+        // Remembers if the alert has been shown once
+        track_annoying_alert: function (state_of_alert, has_it_been_opened) {
+            if (has_it_been_opened === null || has_it_been_opened === undefined) {
+                has_it_been_opened = false;
+            }
+            if (state_of_alert === true && has_it_been_opened === false) {
+                has_it_been_opened = true;
+            }
+            return has_it_been_opened;
+        },
+
+        // Opens the alert the first time a dublin map is picked
+        alert_pop_up: function (region, dismissed_already) {
+            return Boolean(region && region.toLowerCase().indexOf("dublin") !== -1 && dismissed_already === false);
+        },
+    },
+});
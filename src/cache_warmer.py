@@ -0,0 +1,157 @@
+"""
+Warms the data and figure caches of the dashboard for the common selections, run after a data refresh or deploy
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import typing
+
+from dateutil.relativedelta import relativedelta
+
+import callbacks
+from server_config import CACHE
+from utils.date_range import DATA_START_DATE, default_end_date
+
+log = logging.getLogger(__name__)
+
+# Map types of the region dropdown and whether each of their single area selections is warmed
+MAP_TYPES = {"Province": True, "County": True, "Dublin Area": True, "Dublin Clustering": False}
+
+# Default chart and grouping of the series, left and right chart dropdowns as set in layout.py
+DEFAULT_CHARTS = [
+    ("Line Chart - Total Value", "area"),
+    ("Bar Chart - Total Value", "area"),
+    ("Bar Chart - Volume of Sales", "area"),
+]
+
+def date_presets(today: date = None) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """
+    Common date ranges picked on the dashboard, 'all' is the default range of the date picker
+
+    Args:
+        today (date, optional): end of the ranges. Defaults to default_end_date(), the end of the date picker.
+
+    Returns:
+        typing.Dict[str, typing.Tuple[str, str]]: preset name to start and end date
+    """
+    today = today or default_end_date()
+    return {
+        "all": (DATA_START_DATE.isoformat(), today.isoformat()),
+        "last_5_years": ((today - relativedelta(years=5)).isoformat(), today.isoformat()),
+        "last_12_months": ((today - relativedelta(years=1)).isoformat(), today.isoformat()),
+    }
+
+
+def enumerate_selections(presets: typing.List[str] = None) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Default selection of every map type plus every single area selection for each date preset
+
+    Args:
+        presets (typing.List[str], optional): names of the date presets to warm. Defaults to all presets.
+
+    Returns:
+        typing.List[typing.Tuple[str, str]]: map type and json dumped inputs as the cached-inputs div holds them
+    """
+    all_presets = date_presets()
+    presets = presets or list(all_presets)
+
+    selections = []
+    for preset in presets:
+        start_date, end_date = all_presets[preset]
+        for region, single_areas in MAP_TYPES.items():
+            areas = ["All"]
+            if single_areas:
+                options = callbacks.set_region_dropdown_options(region)
+                areas += [[i["value"]] for i in options if i["value"] != "All" and not i.get("disabled")]
+
+            for area in areas:
+                selections.append((region, callbacks.selection_inputs(region, area, None, start_date, end_date)))
+
+    return selections
+
+
+def selection_jobs(region: str, cache: str) -> typing.List[typing.Tuple[typing.Callable, typing.Tuple]]:
+    """
+    Memoized functions and their arguments the callbacks run for a selection with the default charts
+    """
+    if region == "Dublin Clustering":
+        jobs = [(callbacks.map_figure, (cache, region, callbacks.DEFAULT_MAP_ZOOM))]
+    else:
+        jobs = [(callbacks.map_figure, (cache, region, None)), (callbacks.map_arrays, (cache, region))]
+
+    jobs += [(callbacks.chart_figure, (chart, agg, cache)) for chart, agg in DEFAULT_CHARTS]
+    jobs += [
+        (callbacks.total_value, (cache,)),
+        (callbacks.volume_value, (cache,)),
+        (callbacks.avg_value, (cache,)),
+        (callbacks.pie_chart, (cache,)),
+    ]
+    return jobs
+
+
+def is_cached(func: typing.Callable, args: typing.Tuple) -> bool:
+    """
+    Checks if a memoized function already holds a value for the arguments
+    """
+    return CACHE.cache.has(func.make_cache_key(func.uncached, *args))
+
+
+def _warm_selection(region: str, cache: str) -> typing.Tuple[int, int, int]:
+    """
+    Runs the jobs of a selection in order, the first one fills the selection plan for the rest
+
+    Returns:
+        typing.Tuple[int, int, int]: jobs already cached, jobs computed, jobs failed
+    """
+    already_cached, computed, failed = 0, 0, 0
+    for func, args in selection_jobs(region, cache):
+        if is_cached(func, args):
+            already_cached += 1
+            continue
+        try:
+            func(*args)
+            computed += 1
+        except Exception as e:  # pylint: disable=broad-except
+            failed += 1
+            log.warning(f"could not warm {func.__name__} for {cache}: {e}")
+
+    return already_cached, computed, failed
+
+
+def warm_cache(parallelism: int = 4, presets: typing.List[str] = None) -> typing.Dict[str, float]:
+    """
+    Pre-populates the data and figure caches through the memoized functions of the callbacks
+
+    Args:
+        parallelism (int, optional): selections warmed at the same time. Defaults to 4.
+        presets (typing.List[str], optional): date presets to warm. Defaults to all presets.
+
+    Returns:
+        typing.Dict[str, float]: counts of the run and the hit rate of the warmed jobs afterwards
+    """
+    selections = enumerate_selections(presets)
+    log.info(f"warming {len(selections)} selections with {parallelism} threads")
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        results = list(executor.map(lambda x: _warm_selection(*x), selections))
+
+    jobs = [job for region, cache in selections for job in selection_jobs(region, cache)]
+    hits = sum(1 for func, args in jobs if is_cached(func, args))
+
+    stats = {
+        "selections": len(selections),
+        "jobs": len(jobs),
+        "already_cached": sum(i[0] for i in results),
+        "computed": sum(i[1] for i in results),
+        "failed": sum(i[2] for i in results),
+        "hit_rate": hits / len(jobs) if jobs else 1.0,
+    }
+    log.info(
+        "cache warmed: {computed} computed, {already_cached} already cached, {failed} failed, "
+        "hit rate of the warmed jobs {hit_rate:.1%}".format(**stats)
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    pass
@@ -3,18 +3,36 @@ main logic of dashboard
 """
 import json
 from datetime import datetime
-from dash.dependencies import Input, Output, State
-import pandas as pd
+from dash import ctx, no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.express as px
 import plotly.graph_objs as go
-from sqlalchemy import text
 
 
-from layout import layout  # noqa
+from layout import layout, PROGRESS_HIDDEN, PROGRESS_SHOWN, PROGRESS_STEPS  # noqa
+from models.area_options import AreaOptions
 from models.data_model import DataModel
-from models.graph_model import GraphModel
+from models.graph_model import RAW_POINTS_ZOOM, GraphModel, bounds_contain, points_bounds, view_bounds
 from models.input_model import InputModel
-from server_config import application, PG_ALCHEMY_CONNECTION, REDIS_TIMEOUT, CACHE
+from models.query_planner import QueryPlanner
+from server_config import (
+    application,
+    PG_ALCHEMY_CONNECTION,
+    REDIS_TIMEOUT,
+    STALE_CACHE,
+    PATCH_FIGURES,
+    DATASET_VERSION,
+    QUERY_CONTROL,
+)
+from utils.query_control import session_id, use_session
+
+# Starting zoom of the maps per map type
+DEFAULT_MAP_ZOOM = 9
+
+# Graphs that can take many seconds to draw, when not cached they are drawn by background callbacks
+HEAVY_MAPS = ("Dublin Clustering",)
+HEAVY_CHARTS = ("Violin Chart",)
 
 # -----------------------------------------------------------------------------
 # Model Creation for Startup
@@ -29,36 +47,80 @@ inputs = {
 }
 
 
-# Connects to database PG_CONNECTION for pulling column values
-input_model = InputModel(PG_ALCHEMY_CONNECTION)
+# Areas of every map type, loaded on first use from the snapshot of the current dataset version
+area_options = AreaOptions(PG_ALCHEMY_CONNECTION, DATASET_VERSION)
 
-# Imports the PG_CONNECTION for conneting to db NOTE: PG_CONNECTION is defined in keys.py
-data_model = DataModel(input_model, PG_ALCHEMY_CONNECTION)
-# data_model.import_json(inputs)
+# Cleanses the user inputs against the area options
+input_model = InputModel(PG_ALCHEMY_CONNECTION, area_options)
 
-# model used to generate the graphs
-graph_model = GraphModel()
+# Plans the data of all the charts of a selection into one or two statements
+query_planner = QueryPlanner(PG_ALCHEMY_CONNECTION, QUERY_CONTROL)
 
-# Pulls in all the choices options
-choices = dict()
-for i in ["county", "province", "dublin_region"]:
-    if i != "dublin_region":
-        query = f"SELECT distinct({i}) from propeiredb.residential_register"
-        column_assigned = i
-    else:
-        query = "SELECT distinct(region) from propeiredb.residential_register_dublin_mapped"
-        column_assigned = "region"
 
-    groups = pd.read_sql(text(query), con=PG_ALCHEMY_CONNECTION.connect())
-    listing = list(groups[column_assigned])
-    listings_cleansed = ["All"]
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
+def selection_plan(selection):
+    """
+    Runs the planned statements once per selection, every chart callback of the selection reads the cached plan
+
+    Args:
+        selection (tuple): as given by DataModel.selection
+
+    Returns:
+        SelectionPlan: the planned data
+    """
+    return query_planner.plan(selection)
+
+
+def selection_models(cache):
+    """
+    Data and graph models for the selection in the cached inputs, created per call so callbacks
+    can run in parallel threads without sharing the state of a selection
+
+    Args:
+        cache (str): json dumped inputs
+
+    Returns:
+        tuple: DataModel, GraphModel
+    """
+    # Imports the PG_CONNECTION for conneting to db NOTE: PG_CONNECTION is defined in keys.py
+    data_model = DataModel(input_model, PG_ALCHEMY_CONNECTION, plan_loader=selection_plan, query_control=QUERY_CONTROL)
+    data_model.import_json(json.loads(cache))
+
+    # model used to generate the graphs
+    graph_model = GraphModel()
+    graph_model.import_data_model(data_model)
+    return data_model, graph_model
 
-    for j in listing:
-        j = str(j).title()
-        if "None" not in j:
-            listings_cleansed.append(j)
 
-    choices[i] = [{"label": x, "value": x} for x in listings_cleansed]
+def background_job_started():
+    """
+    Called first in every background callback, the job runs in a process forked from a web worker
+    and must not reuse the pooled connections of its parent
+    """
+    PG_ALCHEMY_CONNECTION.dispose(close=False)
+
+
+def selection_inputs(region, area, invert, start_date, end_date):
+    """
+    Canonical json of a selection, the same selection always gives the same string so cache keys
+    match between users, workers and the cache warmer
+
+    Returns:
+        str: json dumped inputs
+    """
+    if isinstance(area, list):
+        area = sorted(area)
+    invert = True in invert if isinstance(invert, list) else bool(invert)
+
+    inputs = {
+        "region": region,
+        "area": area,
+        "start_date": str(start_date).split("T")[0],
+        "end_date": str(end_date).split("T")[0],
+        "invert": invert,
+    }
+
+    return json.dumps(inputs)
 
 
 # -----------------------------------------------------------------------------
@@ -68,7 +130,7 @@ for i in ["county", "province", "dublin_region"]:
 
 # Drives the second dropdown by the available options from the first province one
 @application.callback(Output("region-choice-dropdown", "options"), [Input("region-dropdown", "value")])
-@CACHE.memoize(timeout=6000)
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
 def set_region_dropdown_options(selected_region):
     """
     _summary_
@@ -81,25 +143,16 @@ def set_region_dropdown_options(selected_region):
     """
     # Adding in all feature
     if "Dublin" in selected_region:
-        area = choices["dublin_region"]
-    else:
-        area = choices[selected_region.lower()]
-    return area
+        return area_options.dropdown_options("dublin_region")
+    return area_options.dropdown_options(selected_region.lower())
 
 
-# sets the value of the second dropdown
-@application.callback(Output("region-choice-dropdown", "value"), [Input("region-choice-dropdown", "options")])
-def set_region_value(available_options):
-    """
-    _summary_
-
-    Args:
-        available_options (_type_): _description_
-
-    Returns:
-        _type_: _description_
-    """
-    return "All"
+# sets the value of the second dropdown, NOTE: pure ui callbacks run clientside from assets/clientside.js
+application.clientside_callback(
+    ClientsideFunction(namespace="ui", function_name="reset_area_choice"),
+    Output("region-choice-dropdown", "value"),
+    [Input("region-choice-dropdown", "options")],
+)
 
 
 @application.callback(
@@ -119,36 +172,31 @@ def cached_inputs(region, area, invert, start_date, end_date):
     Converts all the base inputs into json dumped into the webpage. This is done to create a chained callback for all graphs to update on change
     and reduce the amount of code and lines in the file
     NOTE: https://dash.plot.ly/sharing-data-between-callbacks
-    """
 
-    inputs = {"region": region, "area": area, "start_date": start_date, "end_date": end_date, "invert": invert}
+    The selection becomes the latest of the session, queries still running for its older selections are cancelled
+    """
+    cache = selection_inputs(region, area, invert, start_date, end_date)
+    data_model = DataModel(input_model, PG_ALCHEMY_CONNECTION)
+    data_model.import_json(json.loads(cache))
+    QUERY_CONTROL.start_selection(data_model.selection)
 
-    return json.dumps(inputs)
+    return cache
 
 
-@application.callback(
-    Output("track-annoying-alert", "data"), Input("warning-alert", "is_open"), State("track-annoying-alert", "data")
+application.clientside_callback(
+    ClientsideFunction(namespace="ui", function_name="track_annoying_alert"),
+    Output("track-annoying-alert", "data"),
+    Input("warning-alert", "is_open"),
+    State("track-annoying-alert", "data"),
 )
-def track_annoying_alert(state_of_alert: bool, has_it_been_opened: bool):
-    if has_it_been_opened is None:
-        has_it_been_opened = False
-    if state_of_alert is True and has_it_been_opened is False:
-        has_it_been_opened = True
 
-    return has_it_been_opened
 
-
-@application.callback(
+application.clientside_callback(
+    ClientsideFunction(namespace="ui", function_name="alert_pop_up"),
     Output("warning-alert", "is_open"),
     Input("region-dropdown", "value"),
     State("track-annoying-alert", "data"),
 )
-def alert_pop_up(region, dismissed_already):
-    state = False
-    if "dublin" in region.lower() and dismissed_already is False:
-        state = True
-
-    return state
 
 
 # -----------------------------------------------------------------------------
@@ -157,108 +205,180 @@ def alert_pop_up(region, dismissed_already):
 
 
 @application.callback(
-    Output("mapbox", "figure"), [Input("cached-inputs", "children"), Input("region-dropdown", "value")]
+    [Output("mapbox", "figure"), Output("map-state", "data"), Output("mapbox-job", "data")],
+    [Input("cached-inputs", "children"), Input("region-dropdown", "value"), Input("mapbox", "relayoutData")],
+    State("map-state", "data"),
 )
-@CACHE.memoize(timeout=600)
-def update_map(cache, region):
+def update_map(cache, region, relayout, map_state):
     """
-    _summary_
+    Redraws the map on input changes, the scatter map is also redrawn when the user zooms into
+    a new zoom level as the clustering follows the zoom. A heavy map that is not cached yet is
+    handed over to draw_map through the mapbox-job store
 
     Args:
-        button_press (_type_): _description_
-        cache (_type_): _description_
-        region (_type_): _description_
+        cache (str): json dumped inputs
+        region (str): map type
+        relayout (dict): relayoutData of the map, holds the zoom and the view set by the user
+        map_state (dict): region, zoom level and bounds of the raw points of the map currently shown
 
     Returns:
-        _type_: _description_
+        tuple: figure, the new map state and the job of draw_map
     """
-    # Graph Cache
-    loads = json.loads(cache)  # Loads in local stored cache
-    # key = "{}:{}".format("update_map", loads["key"])  # Generates key for func
+    map_state = map_state or {}
+    zoom = DEFAULT_MAP_ZOOM
+    bounds = None
+    if map_state.get("region") == region:
+        zoom = map_state.get("zoom", DEFAULT_MAP_ZOOM)
+        if relayout and "mapbox.zoom" in relayout:
+            zoom = int(relayout["mapbox.zoom"])
+
+        # the raw points are only drawn around the view, panning out of them draws the new area
+        if region == "Dublin Clustering" and zoom >= RAW_POINTS_ZOOM:
+            view = view_bounds(relayout, zoom)
+            bounds = map_state.get("bounds") if zoom == map_state.get("zoom") else None
+            if view is not None and (bounds is None or not bounds_contain(bounds, view)):
+                bounds = points_bounds(view, zoom)
+
+    if ctx.triggered_id == "mapbox" and (
+        region != "Dublin Clustering" or (zoom == map_state.get("zoom") and bounds == map_state.get("bounds"))
+    ):
+        raise PreventUpdate
+
+    new_state = {"region": region, "zoom": zoom, "bounds": bounds, "base": region}
+    if region in HEAVY_MAPS:
+        graph = map_figure.peek(cache, region, zoom, bounds)
+        if graph is None:
+            job = {"cache": cache, "region": region, "zoom": zoom, "bounds": bounds, "session": session_id()}
+            return no_update, new_state, job
+        return graph, new_state, no_update
+
+    # Choropleth already on the client only needs its data arrays and colour range swapped
+    if PATCH_FIGURES and map_state.get("base") == region:
+        graph = GraphModel.choropleth_patch(map_arrays(cache, region))
+    else:
+        graph = map_figure(cache, region, None)
 
-    data_model.import_json(loads)
-    graph_model.import_data_model(data_model)
+    return graph, new_state, no_update
 
-    if region == "Dublin Clustering":
-        # return scatter_map(region, choice, year, period, invert=invert)
-        graph = graph_model.scatter_map(zoom=9)
-    else:
-        graph = graph_model.choropleth_map()
 
+@application.callback(
+    Output("mapbox", "figure", allow_duplicate=True),
+    Input("mapbox-job", "data"),
+    background=True,
+    progress=[Output("mapbox-progress", "value"), Output("mapbox-progress", "label")],
+    progress_default=[0, ""],
+    running=[(Output("mapbox-progress", "style"), PROGRESS_SHOWN, PROGRESS_HIDDEN)],
+    cancel=[Input("cached-inputs", "children"), Input("region-dropdown", "value")],
+    prevent_initial_call=True,
+)
+def draw_map(set_progress, job):
+    """
+    Draws a heavy map in a background process, the job is dropped when the inputs change
+    and replaced when the user zooms to another level or pans away before it finishes
+
+    Args:
+        set_progress (typing.Callable): reports the step the job is at
+        job (dict): cache, region, zoom and bounds handed over by update_map
+
+    Returns:
+        go.Figure: the map
+    """
+    background_job_started()
+    with use_session(job.get("session")):
+        set_progress((1, "Loading sales"))
+        data_model, _ = selection_models(job["cache"])
+        data_model.selection_plan()
+        set_progress((2, "Drawing the map"))
+        graph = map_figure(job["cache"], job["region"], job["zoom"], job.get("bounds"))
+    set_progress((PROGRESS_STEPS, ""))
     return graph
 
 
-# Shows the bars under the graph choices
-@application.callback(Output("left-checkbox", "style"), [Input("left-chart-dropdown", "value")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def update_left_group(chart):
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
+def map_figure(cache, region, zoom, bounds=None):
     """
-    _summary_
+    Builds the map figure, zoom and bounds are only used by the scatter map
 
     Args:
-        chart (_type_): _description_
+        cache (str): json dumped inputs
+        region (str): map type
+        zoom (int | None): zoom level for the scatter map
+        bounds (list | None): min lon, min lat, max lon and max lat of the raw points of the scatter map
 
     Returns:
-        _type_: _description_
+        go.Figure: the map
     """
-    if "Bar" in chart:
-        return {"display": "inline-block"}
-    return {"display": "none"}
+    _, graph_model = selection_models(cache)
 
+    if region == "Dublin Clustering":
+        graph = graph_model.scatter_map(zoom=zoom, bounds=bounds)
+    else:
+        graph = graph_model.choropleth_map()
 
-@application.callback(Output("series-checkbox", "style"), [Input("chart-dropdown", "value")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def update_series_group(chart):
+    return graph
+
+
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
+def map_arrays(cache, region):
     """
-    _summary_
+    Data arrays of the choropleth map for patching the figure on the client
 
     Args:
-        chart (_type_): _description_
+        cache (str): json dumped inputs
+        region (str): map type
 
     Returns:
-        _type_: _description_
+        dict: locations, z, customdata and the colour range
     """
-    if "Bar" in chart:
-        return {"display": "inline-block"}
-    return {"display": "none"}
+    _, graph_model = selection_models(cache)
 
+    return graph_model.choropleth_arrays()
 
-@application.callback(Output("right-checkbox", "style"), [Input("right-chart-dropdown", "value")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def update_right_group(chart):
+
+def patch_or_figure(graph, chart_state):
     """
-    _summary_
+    Sends a patch of only the data arrays when the client already holds a figure with the same traces
 
     Args:
-        chart (_type_): _description_
+        graph (go.Figure): the newly built figure
+        chart_state (list): signature of the figure on the client
 
     Returns:
-        _type_: _description_
+        tuple: figure or patch, signature of the figure on the client
     """
-    if "Bar" in chart:
-        return {"display": "inline-block"}
-    return {"display": "none"}
+    signature = GraphModel.figure_signature(graph)
+    if PATCH_FIGURES and chart_state == signature:
+        return GraphModel.data_patch(graph), signature
+    return graph, signature
 
 
-@application.callback(
-    Output("series-chart", "figure"),
-    [Input("chart-dropdown", "value"), Input("series-checkbox", "value"), Input("cached-inputs", "children")],
-)
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def series_chart(chart, agg, cache):
-    """
-    Takes in the normal values and as well as a chart value which will allow it to change chart in return
+# Shows the bars under the graph choices
+for dropdown_id, checkbox_id in (
+    ("left-chart-dropdown", "left-checkbox"),
+    ("chart-dropdown", "series-checkbox"),
+    ("right-chart-dropdown", "right-checkbox"),
+):
+    application.clientside_callback(
+        ClientsideFunction(namespace="ui", function_name="checkbox_display"),
+        Output(checkbox_id, "style"),
+        [Input(dropdown_id, "value")],
+    )
+
+
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
+def chart_figure(chart, agg, cache):
     """
+    Builds the chart picked in one of the chart dropdowns, shared by the series, left and right charts
 
-    # Graph Cache
-    loads = json.loads(cache)  # Loads in local stored cache
-    # if agg == None:
-    #     key = "{}:{}".format(chart, loads["key"])
-    # else:
-    #     key = "{}:{}:{}".format(chart, agg, loads["key"])  # Generates key for func
+    Args:
+        chart (str): chart type from the dropdown
+        agg (str): grouping from the radio items under bar charts
+        cache (str): json dumped inputs
 
-    data_model.import_json(loads)
-    graph_model.import_data_model(data_model)
+    Returns:
+        go.Figure: the chart
+    """
+    _, graph_model = selection_models(cache)
 
     if "Line Chart" in chart:
         graph = graph_model.line_chart(chart)
@@ -270,104 +390,144 @@ def series_chart(chart, agg, cache):
     return graph
 
 
+def update_chart(graph_id, chart, agg, cache, chart_state):
+    """
+    Chart of one of the chart dropdowns, a heavy chart that is not cached yet is handed over to
+    draw_chart through the job store of the graph
+
+    Returns:
+        tuple: figure or patch, signature of the figure on the client and the job of draw_chart
+    """
+    if any(i in chart for i in HEAVY_CHARTS):
+        graph = chart_figure.peek(chart, agg, cache)
+        if graph is None:
+            job = {"graph": graph_id, "chart": chart, "agg": agg, "cache": cache, "session": session_id()}
+            return no_update, no_update, job
+    else:
+        graph = chart_figure(chart, agg, cache)
+
+    return *patch_or_figure(graph, chart_state), no_update
+
+
 @application.callback(
-    Output("left-chart", "figure"),
-    [Input("left-chart-dropdown", "value"), Input("left-checkbox", "value"), Input("cached-inputs", "children")],
+    [Output("series-chart", "figure"), Output("series-chart-state", "data"), Output("series-chart-job", "data")],
+    [Input("chart-dropdown", "value"), Input("series-checkbox", "value"), Input("cached-inputs", "children")],
+    State("series-chart-state", "data"),
 )
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def left_chart(chart, agg, cache):
+def series_chart(chart, agg, cache, chart_state):
     """
     Takes in the normal values and as well as a chart value which will allow it to change chart in return
     """
-    # Graph Cache
-    loads = json.loads(cache)  # Loads in local stored cache
-    # if agg == None:
-    #     key = "{}:{}".format(chart, loads["key"])
-    # else:
-    #     key = "{}:{}:{}".format(chart, agg, loads["key"])  # Generates key for func
-
-    data_model.import_json(loads)
-    graph_model.import_data_model(data_model)
+    return update_chart("series-chart", chart, agg, cache, chart_state)
 
-    if "Line Chart" in chart:
-        graph = graph_model.line_chart(chart)
-    elif "Violin Chart" in chart:
-        graph = graph_model.violin_chart(chart)
-    elif "Bar Chart" in chart:
-        graph = graph_model.bar_chart(chart, grouping=agg)
 
-    return graph
+@application.callback(
+    [Output("left-chart", "figure"), Output("left-chart-state", "data"), Output("left-chart-job", "data")],
+    [Input("left-chart-dropdown", "value"), Input("left-checkbox", "value"), Input("cached-inputs", "children")],
+    State("left-chart-state", "data"),
+)
+def left_chart(chart, agg, cache, chart_state):
+    """
+    Takes in the normal values and as well as a chart value which will allow it to change chart in return
+    """
+    return update_chart("left-chart", chart, agg, cache, chart_state)
 
 
 @application.callback(
-    Output("right-chart", "figure"),
+    [Output("right-chart", "figure"), Output("right-chart-state", "data"), Output("right-chart-job", "data")],
     [Input("right-chart-dropdown", "value"), Input("right-checkbox", "value"), Input("cached-inputs", "children")],
+    State("right-chart-state", "data"),
 )
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
-def right_chart(chart, agg, cache):
+def right_chart(chart, agg, cache, chart_state):
     """
     Takes in the normal values and as well as a chart value which will allow it to change chart in return
     """
-    # Graph Cache
-    loads = json.loads(cache)  # Loads in local stored cache
+    return update_chart("right-chart", chart, agg, cache, chart_state)
 
-    data_model.import_json(loads)
-    graph_model.import_data_model(data_model)
 
-    if "Line Chart" in chart:
-        graph = graph_model.line_chart(chart)
-    elif "Violin Chart" in chart:
-        graph = graph_model.violin_chart(chart)
-    elif "Bar Chart" in chart:
-        graph = graph_model.bar_chart(chart, grouping=agg)
+def draw_chart(set_progress, job, chart_state):
+    """
+    Draws a heavy chart in a background process, the job is dropped when the chart, grouping or inputs change
 
-    return graph
+    Args:
+        set_progress (typing.Callable): reports the step the job is at
+        job (dict): graph, chart, grouping and cache handed over by update_chart
+        chart_state (list): signature of the figure on the client
+
+    Returns:
+        tuple: figure or patch, signature of the figure on the client
+    """
+    background_job_started()
+    with use_session(job.get("session")):
+        set_progress((1, "Loading sales"))
+        data_model, _ = selection_models(job["cache"])
+        data_model.selection_plan()
+        set_progress((2, "Drawing the chart"))
+        graph = chart_figure(job["chart"], job["agg"], job["cache"])
+    set_progress((PROGRESS_STEPS, ""))
+    return patch_or_figure(graph, chart_state)
+
+
+# The job holds the graph id, so the same selection on two graphs runs as two jobs
+for graph_id, dropdown_id, checkbox_id in (
+    ("series-chart", "chart-dropdown", "series-checkbox"),
+    ("left-chart", "left-chart-dropdown", "left-checkbox"),
+    ("right-chart", "right-chart-dropdown", "right-checkbox"),
+):
+    application.callback(
+        [Output(graph_id, "figure", allow_duplicate=True), Output(f"{graph_id}-state", "data", allow_duplicate=True)],
+        Input(f"{graph_id}-job", "data"),
+        State(f"{graph_id}-state", "data"),
+        background=True,
+        progress=[Output(f"{graph_id}-progress", "value"), Output(f"{graph_id}-progress", "label")],
+        progress_default=[0, ""],
+        running=[(Output(f"{graph_id}-progress", "style"), PROGRESS_SHOWN, PROGRESS_HIDDEN)],
+        cancel=[Input(dropdown_id, "value"), Input(checkbox_id, "value"), Input("cached-inputs", "children")],
+        prevent_initial_call=True,
+    )(draw_chart)
 
 
 @application.callback(Output("total-value", "children"), [Input("cached-inputs", "children")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
 def total_value(cache):
     """
     total value by region and choices and period selection
     """
-    data_model.import_json(json.loads(cache))
+    data_model, _ = selection_models(cache)
     value = data_model.total_query("sum")
-    return graph_model.human_format(value)
+    return GraphModel.human_format(value)
 
 
 @application.callback(Output("volume-value", "children"), [Input("cached-inputs", "children")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
 def volume_value(cache):
     """
     total value by region and choices and period selection
     """
-    data_model.import_json(json.loads(cache))
+    data_model, _ = selection_models(cache)
     value = data_model.total_query("count")
-    return graph_model.human_format(value)
+    return GraphModel.human_format(value)
 
 
 @application.callback(Output("avg-value", "children"), [Input("cached-inputs", "children")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
 def avg_value(cache):
     """
     total value by region and choices and period selection
     """
-    data_model.import_json(json.loads(cache))
+    data_model, _ = selection_models(cache)
     value = data_model.total_query("avg")
-    return graph_model.human_format(value)
+    return GraphModel.human_format(value)
 
 
 @application.callback(Output("pie-chart", "figure"), [Input("cached-inputs", "children")])
-@CACHE.memoize(timeout=REDIS_TIMEOUT)
+@STALE_CACHE.memoize(timeout=REDIS_TIMEOUT, make_name=DATASET_VERSION.make_name)
 def pie_chart(cache):
     """
     Pie chart of two colours, one of the selected regions and one for all regions both reprented in a given period
     """
 
-    # Graph Cache
-    loads = json.loads(cache)  # Loads in local stored cache
-
-    data_model.import_json(loads)
+    data_model, _ = selection_models(cache)
     data = data_model.market_share_selected()
     fig = px.pie(
         data,
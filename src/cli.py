@@ -9,8 +9,19 @@ from dotenv import load_dotenv
 import googlemaps
 
 from utils import db_connections as db_con
+from utils.area_dim import refresh_area_dim
+from utils.dataset_version import bump_dataset_version
 from utils.ppr_data_pipeline import download_property_data, process_downloaded_data, upload_ppr_df
-from utils.geo_encode_data import encode_and_upload_missing_addresses
+from utils.geo_encode_data import (
+    count_address_clusters,
+    count_county_mismatches,
+    encode_and_upload_missing_addresses,
+    reassign_regions,
+)
+from utils.gazetteer import CONFIDENCE_LEVELS, GAZETTEER_PATH, Gazetteer
+from utils.geocode_cache import GEOCODE_CACHE_PATH, GeocodeCache
+from utils.geocode_queue import enqueue_addresses, enqueue_missing_addresses
+from utils.geojson_map_cleanse import GEOJSON_SOURCES, build_geojson_artifacts, compile_boundary_geometries
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +32,7 @@ logging.basicConfig(
 
 load_dotenv()
 POSTGRES_DSN = os.getenv("POSTGRES_DSN")
+REDIS_DSN = os.getenv("REDIS_DSN")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_KEY")
 
 # -----------------------------------------------------------------------------
@@ -36,6 +48,33 @@ def propeiredb_cli():
     pass
 
 
+def publish_new_dataset_version(db_connection) -> None:
+    """
+    Bumps the dataset version after a load so the web app caches move on to the new data
+    """
+    redis_connection = db_con.create_redis_connection(REDIS_DSN) if REDIS_DSN else None
+    bump_dataset_version(db_connection, redis_connection)
+
+
+def refresh_loaded_areas(db_connection, df) -> None:
+    """
+    Recounts the counties and provinces of the loaded rows in area_dim, the dublin regions follow any load touching Dublin
+    """
+    refresh_area_dim(db_connection, "county", df["county"].unique())
+    refresh_area_dim(db_connection, "province", df["province"].unique())
+    if (df["county"] == "Dublin").any():
+        refresh_area_dim(db_connection, "dublin_region")
+
+
+def run_cache_warm(parallelism: int) -> None:
+    """
+    Warms the dashboard caches, the dash app is only imported here as the other commands do not need it
+    """
+    from cache_warmer import warm_cache  # pylint: disable=import-outside-toplevel
+
+    warm_cache(parallelism=parallelism)
+
+
 # -----------------------------------------------------------------------------
 # Extract data from PPR
 # -----------------------------------------------------------------------------
@@ -45,13 +84,17 @@ def propeiredb_cli():
 @click.option("--property-type", default="residential")
 @click.option("--period", default="ALL")
 @click.option("--force-build", default=False)
-def run_pipeline(property_type: str, period: str, force_build: bool = False) -> None:
+@click.option("--warm/--no-warm", default=True, help="Warm the dashboard caches after the load")
+@click.option("--parallelism", default=4)
+def run_pipeline(property_type: str, period: str, force_build: bool = False, warm: bool = True, parallelism: int = 4) -> None:
     """
     Upserts data into postgres database
 
     Args:
         property_type (str): _description_
         period (str): _description_
+        warm (bool): warms the dashboard caches after the load
+        parallelism (int): selections warmed at the same time
     """
     this_folder_path = os.path.dirname(os.path.abspath(__file__))
     root_folder_path = "/".join(this_folder_path.split("/")[:-1])  # pylint: disable=invalid-name
@@ -75,6 +118,12 @@ def run_pipeline(property_type: str, period: str, force_build: bool = False) ->
     db_connection = db_con.create_postgres_sql_connection(os.getenv("POSTGRES_DSN"))
 
     upload_ppr_df(df, "residential_register", db_connection)
+    enqueue_addresses(db_connection, df)
+    refresh_loaded_areas(db_connection, df)
+    publish_new_dataset_version(db_connection)
+
+    if warm:
+        run_cache_warm(parallelism)
 
 
 # -----------------------------------------------------------------------------
@@ -84,14 +133,220 @@ def run_pipeline(property_type: str, period: str, force_build: bool = False) ->
 
 @propeiredb_cli.command()
 @click.option("--batch-size", default=100)
-def geoencode_missing_addresses(batch_size: int) -> None:
+@click.option("--queries-per-second", default=50, help="Geocoding API quota")
+@click.option("--workers", default=8, help="Threads waiting on the geocoding API")
+@click.option("--cache-path", default=GEOCODE_CACHE_PATH, help="SQLite cache of the geocoder responses")
+@click.option("--cache/--no-cache", default=True, help="Consult the geocode cache before the API")
+@click.option("--lease-seconds", default=3600, help="Seconds before a batch left unfinished is claimed again")
+@click.option("--page-size", default=500, help="Addresses claimed from the queue at a time")
+@click.option("--flush-size", default=100, help="Geocoded addresses written to the lookup at a time")
+@click.option("--gazetteer-path", default=GAZETTEER_PATH, help="csv of localities and Eircode routing keys")
+@click.option("--gazetteer/--no-gazetteer", default=True, help="Place addresses offline before the API")
+@click.option(
+    "--min-confidence",
+    default="high",
+    type=click.Choice(list(CONFIDENCE_LEVELS)),
+    help="Least confidence of a gazetteer match kept instead of calling the API",
+)
+def geoencode_missing_addresses(
+    batch_size: int,
+    queries_per_second: int,
+    workers: int,
+    cache_path: str,
+    cache: bool,
+    lease_seconds: int,
+    page_size: int,
+    flush_size: int,
+    gazetteer_path: str,
+    gazetteer: bool,
+    min_confidence: str,
+) -> None:
+    """
+    Backfills the geo_encode_lookup table with previously mapped data, the batch is claimed from the geocode
+    queue so several of these can run at once
+    """
+    db_connection = db_con.create_postgres_sql_connection(POSTGRES_DSN)
+    geocode_cache = GeocodeCache(cache_path) if cache else None
+    offline_gazetteer = Gazetteer.from_files(gazetteer_path) if gazetteer else None
+    # quota errors are retried with backoff by the geocoder rather than inside the client
+    gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY, queries_per_second=queries_per_second, retry_over_query_limit=False)
+
+    encoded = encode_and_upload_missing_addresses(
+        db_connection,
+        gmaps,
+        batch_size=batch_size,
+        queries_per_second=queries_per_second,
+        max_workers=workers,
+        cache=geocode_cache,
+        lease_seconds=lease_seconds,
+        page_size=page_size,
+        flush_size=flush_size,
+        gazetteer=offline_gazetteer,
+        min_confidence=CONFIDENCE_LEVELS[min_confidence],
+    )
+    if geocode_cache is not None:
+        logging.info("geocode cache: {hits} hits, {negative_hits} negative hits, {misses} misses".format(**geocode_cache.stats))
+        geocode_cache.close()
+    if len(encoded) > 0:
+        refresh_area_dim(db_connection, "dublin_region", encoded["region"].dropna().unique())
+    publish_new_dataset_version(db_connection)
+
+
+@propeiredb_cli.command()
+def fill_geocode_queue() -> None:
+    """
+    Queues every address of the register missing from geo_encoding_lookup, the pipeline keeps the queue filled after
+    """
+    db_connection = db_con.create_postgres_sql_connection(POSTGRES_DSN)
+    enqueue_missing_addresses(db_connection)
+
+
+@propeiredb_cli.command()
+@click.option("--missing-only/--all", default=True, help="Only the addresses not geocoded yet")
+def address_clusters(missing_only: bool) -> None:
+    """
+    Reports the geocoding calls saved by clustering the spelling variants of the register addresses
+    """
+    db_connection = db_con.create_postgres_sql_connection(POSTGRES_DSN)
+    count_address_clusters(db_connection, missing_only)
+
+
+@propeiredb_cli.command()
+def refresh_areas() -> None:
+    """
+    Rebuilds every level of area_dim from the registers, run once after creating the table
+    """
+    db_connection = db_con.create_postgres_sql_connection(POSTGRES_DSN)
+    for level in ("province", "county", "dublin_region"):
+        refresh_area_dim(db_connection, level)
+    publish_new_dataset_version(db_connection)
+
+
+# -----------------------------------------------------------------------------
+# Regions
+# -----------------------------------------------------------------------------
+
+
+@propeiredb_cli.command("reassign-regions")
+@click.option("--chunk-size", default=50_000, help="Rows of geo_encoding_lookup read per query")
+def reassign_regions_cmd(chunk_size: int) -> None:
     """
-    Backfills the geo_encode_lookup table with previously mapped data
+    Re-assigns the Dublin region, county and province of every geocoded address from the current boundaries
+    without geocoding again
     """
     db_connection = db_con.create_postgres_sql_connection(POSTGRES_DSN)
-    gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+    counts = reassign_regions(db_connection, chunk_size=chunk_size)
+    logging.info(f"{count_county_mismatches(db_connection)} sales are geocoded outside of their PPR county")
+    if counts["region"] > 0:
+        refresh_area_dim(db_connection, "dublin_region")
+        publish_new_dataset_version(db_connection)
 
-    encode_and_upload_missing_addresses(db_connection, gmaps, batch_size=batch_size)
+
+@propeiredb_cli.command()
+@click.option("--points", default=1_000_000, help="Random points over the bounds of the Dublin regions")
+def benchmark_regions(points: int) -> None:
+    """
+    Times the polygon loop of assign_region against the STRtree and contains_xy paths of RegionIndex
+    """
+    # pylint: disable=import-outside-toplevel
+    from utils.geojson_map_cleanse import boundary_geometries
+    from utils.region_index import benchmark_region_assignment
+
+    benchmark_region_assignment(boundary_geometries("dublin"), points=points)
+
+
+# -----------------------------------------------------------------------------
+# Warm the dashboard caches
+# -----------------------------------------------------------------------------
+
+
+@propeiredb_cli.command()
+@click.option("--parallelism", default=4, help="Selections warmed at the same time")
+def warm_cache(parallelism: int) -> None:
+    """
+    Pre-populates the data and figure caches for the default, single area and common date range selections
+    """
+    run_cache_warm(parallelism)
+
+
+@propeiredb_cli.command()
+@click.option("--repeat", default=20, help="Cache reads per figure")
+def benchmark_cache(repeat: int) -> None:
+    """
+    Stored bytes and hit latency of the choropleth and scatter map figures with the pickle and compact serializers
+    """
+    # pylint: disable=import-outside-toplevel
+    from cachelib.serializers import RedisSerializer
+
+    import callbacks
+    from cache_warmer import date_presets
+    from models.graph_model import RAW_POINTS_ZOOM, points_bounds, view_bounds
+    from utils.cache_serializer import CompactSerializer, benchmark_serializers, lz4
+
+    start_date, end_date = date_presets()["all"]
+    # raw points of a view of Dublin city centre
+    city_centre = view_bounds({"mapbox.center": {"lon": -6.26, "lat": 53.35}}, RAW_POINTS_ZOOM)
+    figures = {
+        "choropleth": ("County", None, None),
+        "scatter_clustered": ("Dublin Clustering", callbacks.DEFAULT_MAP_ZOOM, None),
+        "scatter_points": ("Dublin Clustering", RAW_POINTS_ZOOM, points_bounds(city_centre, RAW_POINTS_ZOOM)),
+    }
+    values = {
+        name: callbacks.map_figure.uncached(
+            callbacks.selection_inputs(region, "All", None, start_date, end_date), region, zoom, bounds
+        )
+        for name, (region, zoom, bounds) in figures.items()
+    }
+
+    serializers = {"pickle": RedisSerializer(), "json+zlib": CompactSerializer(codec="zlib")}
+    if lz4 is not None:
+        serializers["json+lz4"] = CompactSerializer(codec="lz4")
+
+    rows = benchmark_serializers(values, serializers, db_con.create_redis_connection(REDIS_DSN), repeat=repeat)
+    for row in rows:
+        logging.info(
+            "{value:<18} {serializer:<10} {stored_bytes:>9} bytes  dumps {dumps_ms:>7.2f} ms  hit {hit_ms:>7.2f} ms".format(**row)
+        )
+
+
+@propeiredb_cli.command()
+@click.option("--duration", default=60, help="Seconds the load runs")
+@click.option("--concurrency", default=1, help="Threads calling the memoized callbacks")
+def load_test(duration: int, concurrency: int) -> None:
+    """
+    Latency percentiles of the memoized callbacks under load, set REDIS_TIMEOUT low so entries expire during the run
+    """
+    from load_test import load_test as run_load_test  # pylint: disable=import-outside-toplevel
+
+    run_load_test(duration=duration, concurrency=concurrency)
+
+
+@propeiredb_cli.command()
+@click.option("--workers", default=2, help="Gunicorn workers to start")
+def profile_startup(workers: int) -> None:
+    """
+    Import time of the web app and boot time and memory of the gunicorn workers without and with preload_app
+    """
+    from startup_profile import profile_startup as run_profile_startup  # pylint: disable=import-outside-toplevel
+
+    run_profile_startup(workers=workers)
+
+
+# -----------------------------------------------------------------------------
+# Build simplified geojson for the maps
+# -----------------------------------------------------------------------------
+
+
+@propeiredb_cli.command()
+def build_geojson() -> None:
+    """
+    Writes the simplified and quantized boundary files used by the choropleth maps and the compiled geometries
+    used by the spatial joins
+    """
+    sizes = build_geojson_artifacts()
+    logging.info(f"Built {len(sizes)} geojson artifacts, {sum(sizes.values()) / 1024:.0f} KiB in total")
+    for name in GEOJSON_SOURCES:
+        compile_boundary_geometries(name)
 
 
 if __name__ == "__main__":
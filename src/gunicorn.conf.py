@@ -1,4 +1,8 @@
+import gc
 import multiprocessing  # noqa
+import os
+import sys
+import time
 
 #
 # Server socket
@@ -74,6 +78,19 @@ worker_connections = 1000
 timeout = 30
 keepalive = 2
 
+#
+#   preload_app - Load the application in the master before forking the workers.
+#
+#       The workers share the modules, the dash layout, the area options and the geojson
+#       of the master copy on write and boot without importing the app again. Off by default
+#       as make start runs with --reload, whose workers would keep the modules of the master
+#       and miss every code change, the production command sets GUNICORN_PRELOAD=true.
+#
+#       True or False
+#
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true" and "--reload" not in sys.argv
+
 #
 #   spew - Install a trace function that spews every line of Python
 #       that is executed when running the server. This is the
@@ -189,6 +206,19 @@ proc_name = None
 
 def post_fork(server, worker):
     server.log.info("Worker spawned (pid: %s)", worker.pid)
+    worker.forked_at = time.perf_counter()
+
+    if preload_app:
+        # connections the master opened while preloading must not be shared with the workers
+        from server_config import BACKGROUND_MANAGER, PG_ALCHEMY_CONNECTION
+
+        PG_ALCHEMY_CONNECTION.dispose(close=False)
+        # the sqlite connection of the background callback cache is opened again on first use
+        BACKGROUND_MANAGER.handle.close()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker ready (pid: %s) in %.2fs", worker.pid, time.perf_counter() - worker.forked_at)
 
 
 def pre_fork(server, worker):
@@ -201,6 +231,12 @@ def pre_exec(server):
 
 def when_ready(server):
     server.log.info("Server is ready. Spawning workers")
+    if preload_app:
+        from wsgi import preload_shared_state
+
+        preload_shared_state()
+        # keeps the garbage collector from touching, and so copying, the objects loaded in the master
+        gc.freeze()
 
 
 def worker_int(worker):
@@ -1,4 +1,3 @@
-from datetime import datetime
 import os
 import base64
 
@@ -7,6 +6,7 @@ from dash import dcc
 from dash import html
 
 from server_config import application
+from utils.date_range import DATA_START_DATE, default_end_date
 
 # -----------------------------------------------------------------------------
 # CSS Theme Variables
@@ -38,6 +38,20 @@ for i in chart:
     else:
         charts.append("Violin Chart - Price")
 
+# Graphs drawn by background callbacks, each gets a progress bar shown while its job runs
+PROGRESS_STEPS = 3
+PROGRESS_HIDDEN = {"display": "none"}
+PROGRESS_SHOWN = {"height": "18px", "margin": "4px 25px"}
+
+
+def graph_progress(graph_id):
+    """
+    Progress bar of a graph, hidden until a background callback draws the graph
+    """
+    return dbc.Progress(
+        id=f"{graph_id}-progress", value=0, max=PROGRESS_STEPS, striped=True, animated=True, style=PROGRESS_HIDDEN
+    )
+
 
 navbar_simple = dbc.NavbarSimple(
     children=[
@@ -190,17 +204,18 @@ period_slider = html.Div(
 )
 
 
-date_picker = dcc.DatePickerRange(
+# end_date is set by serve_layout on every page load
+date_range = dcc.DatePickerRange(
     id="date-range",
     start_date_placeholder_text="Start Period",
     end_date_placeholder_text="End Period",
     calendar_orientation="vertical",
-    start_date=datetime(2010, 1, 1),
-    end_date=datetime.today(),
+    start_date=DATA_START_DATE,
+    end_date=default_end_date(),
 )
 
 date_picker = html.Div(
-    [html.H6("Date Range"), date_picker], style={"margin-left": "50px", "margin-right": "50px", "margin-bottom": "50px"}
+    [html.H6("Date Range"), date_range], style={"margin-left": "50px", "margin-right": "50px", "margin-bottom": "50px"}
 )
 
 update_button = html.Div(
@@ -231,6 +246,7 @@ new_map_column = dbc.Col(
     # Loading component to show user map is loading in long wait times
     html.Div(
         [
+            graph_progress("mapbox"),
             dcc.Graph(id="mapbox", style={"width": "100%", "height": "800px", "display": "inline-block"}),
         ],
         style={"margin-left": "30px"},
@@ -321,6 +337,7 @@ first_graph = dbc.Col(
             inputStyle={"margin-right": "1px", "margin-left": "5px"},
         ),
         # Graph layout object
+        graph_progress("left-chart"),
         dcc.Graph(id="left-chart", style={"width": "100%", "height": "300px", "display": "inline-block"}),
     ],
     width={"size": 6},
@@ -350,6 +367,7 @@ second_graph = dbc.Col(
             labelStyle={"display": "inline-block", "margin-left": "50px"},
             inputStyle={"margin-right": "1px", "margin-left": "5px"},
         ),
+        graph_progress("right-chart"),
         dcc.Graph(id="right-chart", style={"width": "100%", "height": "300px", "display": "inline-block"}),
     ],
     width={"size": 6},
@@ -384,6 +402,7 @@ bottom_graph = dbc.Col(
             inputStyle={"margin-right": "1px", "margin-left": "5px"},
         ),
         # graphing object
+        graph_progress("series-chart"),
         dcc.Graph(id="series-chart", style={"width": "100%", "height": "300px", "display": "inline-block"}),
     ]
 )
@@ -448,12 +467,30 @@ layout = dbc.Container(
         geojson_div,
         inputs_div,
         dcc.Store(id="track-annoying-alert", storage_type="memory"),
+        dcc.Store(id="map-state", storage_type="memory"),
+        dcc.Store(id="series-chart-state", storage_type="memory"),
+        dcc.Store(id="left-chart-state", storage_type="memory"),
+        dcc.Store(id="right-chart-state", storage_type="memory"),
+        # selections handed from the light callbacks to the background callbacks drawing the heavy graphs
+        dcc.Store(id="mapbox-job", storage_type="memory"),
+        dcc.Store(id="series-chart-job", storage_type="memory"),
+        dcc.Store(id="left-chart-job", storage_type="memory"),
+        dcc.Store(id="right-chart-job", storage_type="memory"),
     ],
     style={"background-color": "#111111"} if setting == "dark" else None,
     fluid=True,
 )
 layout = html.Div([navbar, layout])
 
+
+def serve_layout():
+    """
+    Layout of every page load, the date range ends on the day of the request rather than the day the app was loaded
+    """
+    date_range.end_date = default_end_date()
+    return layout
+
+
 # Apply to WSGI server
-application.layout = layout
+application.layout = serve_layout
 application.title = "PropEireDB"
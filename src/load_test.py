@@ -0,0 +1,91 @@
+"""
+Load test of the memoized callbacks, replays the warmed selections from several threads and reports the latency percentiles
+"""
+import logging
+import random
+import threading
+import time
+import typing
+
+import numpy as np
+
+from cache_warmer import enumerate_selections, selection_jobs
+from server_config import CACHE, CACHE_MAX_STALE, REDIS_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+
+def _replay(jobs: typing.List[typing.Tuple[typing.Callable, typing.Tuple]], deadline: float, seed: int) -> typing.List[float]:
+    """
+    Calls random jobs until the deadline
+
+    Returns:
+        typing.List[float]: latency of every call in milliseconds
+    """
+    rng = random.Random(seed)
+    latencies = []
+    while time.monotonic() < deadline:
+        func, args = rng.choice(jobs)
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            log.debug(f"{func.__name__} failed: {e}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def load_test(duration: int = 60, concurrency: int = 1, presets: typing.List[str] = None, seed: int = 0) -> typing.Dict[str, float]:
+    """
+    Warms the jobs of the selections once, then calls them at random from concurrency threads for duration seconds.
+    Run it with a short REDIS_TIMEOUT so entries expire during the test, and CACHE_MAX_STALE=0 for the blocking baseline.
+    A single thread stands for one sync gunicorn worker, more threads share the GIL with the refresh threads
+
+    Args:
+        duration (int, optional): seconds the load runs. Defaults to 60.
+        concurrency (int, optional): threads calling the jobs. Defaults to 1.
+        presets (typing.List[str], optional): date presets of the selections. Defaults to ['last_5_years'].
+        seed (int, optional): seed of the job order. Defaults to 0.
+
+    Returns:
+        typing.Dict[str, float]: call count and latency percentiles in milliseconds
+    """
+    selections = enumerate_selections(presets or ["last_5_years"])
+    jobs = [job for region, cache in selections for job in selection_jobs(region, cache)]
+    log.info(f"warming {len(jobs)} jobs, timeout {REDIS_TIMEOUT}s, max stale {CACHE_MAX_STALE}s")
+    for func, args in jobs:
+        try:
+            func(*args)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    deadline = time.monotonic() + duration
+    results = [[] for _ in range(concurrency)]
+
+    def worker(i):
+        results[i] = _replay(jobs, deadline, seed + i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = np.array([i for result in results for i in result])
+    stats = {
+        "calls": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+    cache_stats = getattr(CACHE.cache, "stats", dict)()
+    stats.update({k: cache_stats[k] for k in ("local_hits", "redis_hits", "stale_hits", "misses") if k in cache_stats})
+    log.info(
+        "{calls} calls, p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms, max {max_ms:.1f} ms".format(**stats)
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,152 @@
+"""
+Areas of every map type for the dropdowns and the input model, read from propeiredb.area_dim once per
+dataset version and kept in a snapshot file
+"""
+import json
+import logging
+import os
+import threading
+import typing
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import ProgrammingError
+
+from utils.area_dim import AREA_LEVELS, area_label
+from utils.dataset_version import DatasetVersion
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data/snapshots/area_options.json"
+)
+
+# Bumped when the layout of the snapshot changes so older snapshots are pulled again
+SNAPSHOT_FORMAT = 2
+
+
+class AreaOptions(object):
+    """
+    Holds the areas of every level in process, read from the snapshot file written for the current dataset version
+    and pulled from area_dim only when the snapshot is missing or for an older version. Nothing is loaded
+    until first use, with gunicorn's preload_app the master loads it once and the workers share it
+    """
+
+    def __init__(self, db_engine: Engine, dataset_version: DatasetVersion = None, snapshot_path: str = SNAPSHOT_PATH):
+        self.engine = db_engine
+        self.dataset_version = dataset_version
+        self.snapshot_path = snapshot_path
+        self._areas = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def scan_query() -> str:
+        """
+        Counts every area of every level from the registers, only used before area_dim is first filled
+        """
+        return " UNION ALL ".join(
+            f"""
+            SELECT '{level}' as level, {column}::text as area, count(*) as row_count
+                , min(sale_date) as first_sale_date, max(sale_date) as last_sale_date
+            FROM {table} WHERE {column} is not null GROUP BY {column}
+            """
+            for level, (table, column) in AREA_LEVELS.items()
+        )
+
+    def _pull_areas(self) -> typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]:
+        query = "SELECT level, area, label, row_count, first_sale_date, last_sale_date FROM propeiredb.area_dim"
+        try:
+            with self.engine.connect() as conn:
+                data = pd.read_sql(text(query), con=conn)
+        except ProgrammingError as e:
+            log.warning(f"could not read propeiredb.area_dim: {e.orig}")
+            data = pd.DataFrame()
+
+        if data.empty:
+            log.warning("propeiredb.area_dim is empty, counting the areas from the registers")
+            with self.engine.connect() as conn:
+                data = pd.read_sql(text(self.scan_query()), con=conn)
+            data["label"] = data["area"].map(area_label)
+
+        for column in ("first_sale_date", "last_sale_date"):
+            data[column] = data[column].map(lambda x: x.isoformat() if pd.notna(x) else None)
+        data["row_count"] = data["row_count"].astype(int)
+
+        data = data.sort_values(["level", "area"])
+        return {
+            level: data.loc[data["level"] == level].drop(columns="level").to_dict(orient="records")
+            for level in AREA_LEVELS
+        }
+
+    def _read_snapshot(self, version: int) -> typing.Optional[typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]]:
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            return None
+        if data.get("format") != SNAPSHOT_FORMAT or data.get("version") != version:
+            return None
+        return data["areas"]
+
+    def _write_snapshot(self, version: int, areas: typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temp_path = f"{self.snapshot_path}.{os.getpid()}"
+            with open(temp_path, "w", encoding="utf-8") as snapshot:
+                json.dump({"format": SNAPSHOT_FORMAT, "version": version, "areas": areas}, snapshot)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            log.warning(f"could not write the area options snapshot: {e}")
+
+    def _load(self, version: int) -> typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]:
+        areas = self._read_snapshot(version)
+        if areas is None:
+            areas = self._pull_areas()
+            self._write_snapshot(version, areas)
+            log.info(f"area options pulled for dataset version {version}")
+        return areas
+
+    def _current(self) -> typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]:
+        version = self.dataset_version.current() if self.dataset_version is not None else 0
+        if self._areas is None or self._version != version:
+            with self._lock:
+                if self._areas is None or self._version != version:
+                    self._areas = self._load(version)
+                    self._version = version
+        return self._areas
+
+    def areas(self) -> typing.Dict[str, typing.List[str]]:
+        """
+        Areas per level, reloaded when the dataset version moves on
+
+        Returns:
+            typing.Dict[str, typing.List[str]]: level to a copy of its areas
+        """
+        return {level: [i["area"] for i in areas] for level, areas in self._current().items()}
+
+    def dropdown_options(self, level: str) -> typing.List[typing.Dict[str, typing.Any]]:
+        """
+        Options of the area dropdown for a level, 'All' first. Areas without sales are greyed out
+        and every area carries its sale count and date range as a tooltip
+
+        Args:
+            level (str): province, county or dublin_region
+
+        Returns:
+            typing.List[typing.Dict[str, typing.Any]]: label, value, disabled and title of each area
+        """
+        options = [{"label": "All", "value": "All"}]
+        for i in self._current()[level]:
+            title = f"{i['row_count']:,} sales"
+            if i["first_sale_date"] is not None:
+                title += f", {i['first_sale_date']} to {i['last_sale_date']}"
+            options.append(
+                {"label": i["label"], "value": area_label(i["area"]), "disabled": i["row_count"] == 0, "title": title}
+            )
+        return options
+
+
+if __name__ == "__main__":
+    pass
@@ -11,19 +11,37 @@ from models.input_model import InputModel
 import typing
 from sqlalchemy import text
 
+from utils.dtype_policy import read_frame
+from utils.query_control import QueryControl
+
 
 class DataModel(object):
     """
     Object Generates the data for various graphs by a dictionary input
     """
 
-    def __init__(self, input_parser: InputModel, db_engine: Engine):
+    def __init__(
+        self,
+        input_parser: InputModel,
+        db_engine: Engine,
+        plan_loader: typing.Optional[typing.Callable[[typing.Tuple], typing.Any]] = None,
+        query_control: typing.Optional[QueryControl] = None,
+    ):
         """
         Takes in the cleansed input from the input model as to generate the data
+
+        plan_loader takes the selection tuple and returns a SelectionPlan, when given the aggregated queries
+        are answered from the plan rather than each running their own sql
+
+        query_control runs the queries tagged with the selection under a statement timeout, cancelled
+        once the session moves on to another selection
         """
 
         self.input_parser = input_parser
         self.engine = db_engine
+        self.plan_loader = plan_loader
+        self.query_control = query_control
+        self._plan = None
 
     def import_json(self, json_input: typing.Dict[str, typing.Any]) -> None:
         """
@@ -66,6 +84,45 @@ class DataModel(object):
 
         self.joined_params = ":".join(params)
 
+        # Selection for the query planner, a new selection needs a new plan
+        self.selection = (
+            self.main_data_table,
+            self.grouping_column,
+            tuple(sorted(cleansed_json_input["area"])),
+            self.start_date,
+            self.end_date,
+            self.period_choices,
+        )
+        self._plan = None
+
+    def selection_plan(self):
+        """
+        Returns the SelectionPlan of the current selection, None when no plan loader was given
+        """
+        if self.plan_loader is None:
+            return None
+        if self._plan is None:
+            self._plan = self.plan_loader(self.selection)
+        return self._plan
+
+    def _read_sql(self, query: str, query_name: str) -> pd.DataFrame:
+        """
+        Pulls the query into a dataframe with the dtype policy applied, memory report is logged at debug level
+
+        Args:
+            query (str): sql query to run
+            query_name (str): name of the query for the logs
+
+        Returns:
+            pd.DataFrame: query results
+        """
+        if self.query_control is None:
+            connection = self.engine.connect()
+        else:
+            connection = self.query_control.connect(self.selection, query_name)
+        with connection as conn:
+            return read_frame(query_name, pd.read_sql, text(query), con=conn)
+
     def total_query(self, agg_func: typing.AnyStr) -> float:
         """
         creates a sql query with an aggregated function of a single value selected from all choices in region based on periods selected
@@ -76,6 +133,9 @@ class DataModel(object):
         Returns:
             float: _description_
         """
+        if self.selection_plan() is not None:
+            return self.selection_plan().total(agg_func)
+
         inner_query = f"""
         SELECT
             {agg_func}(price)
@@ -85,7 +145,7 @@ class DataModel(object):
         and {self.grouping_column} in ({self.area_choices});
         """
 
-        return float(pd.read_sql(text(inner_query), con=self.engine.connect())[agg_func])
+        return float(self._read_sql(inner_query, f"total_query:{agg_func}")[agg_func].iloc[0])
 
     def pull_choices_grouped_by_year(self) -> pd.DataFrame:
         """
@@ -103,6 +163,9 @@ class DataModel(object):
         Returns:
             pd.DataFrame()
         """
+        if self.selection_plan() is not None:
+            return self.selection_plan().grouped_by_year()
+
         data_source = "propeiredb.{}_agg_data".format(self.grouping_column)
         query = f"""
             SELECT
@@ -116,7 +179,7 @@ class DataModel(object):
                 and {self.grouping_column} in ({self.area_choices}) group by {self.grouping_column}, year;"""
 
         # print(f"pulled_group_choices_by_year: {query}")
-        return pd.read_sql(text(query), con=self.engine.connect())
+        return self._read_sql(query, "pull_choices_grouped_by_year")
 
     def pull_data_query(self) -> pd.DataFrame:
         """
@@ -141,7 +204,64 @@ class DataModel(object):
             and {self.grouping_column} in ({self.area_choices});
         """
 
-        return pd.read_sql(text(query), con=self.engine.connect()).sort_values(by="period")
+        return self._read_sql(query, "pull_data_query").sort_values(by="period")
+
+    def pull_points_in_bounds(self, bounds: typing.Sequence[float]) -> pd.DataFrame:
+        """
+        Geocoded sales of the selection inside a lon/lat box, the raw points of the scatter map for the area
+        on screen rather than the whole selection
+
+        Args:
+            bounds (typing.Sequence[float]): min lon, min lat, max lon and max lat
+
+        Returns:
+            pd.DataFrame: columns=['lat', 'lon', 'price', 'period']
+        """
+        min_lon, min_lat, max_lon, max_lat = (float(i) for i in bounds)
+        query = f"""
+            SELECT
+                lat, lon, price, period
+            FROM {self.main_data_table}
+            WHERE sale_date between '{self.start_date}' and '{self.end_date}'
+            and {self.grouping_column} in ({self.area_choices})
+            and lat between {min_lat} and {max_lat}
+            and lon between {min_lon} and {max_lon}
+        """
+
+        return self._read_sql(query, "pull_points_in_bounds").sort_values(by="period")
+
+    def pull_clustered_points(self, grid_size: float, by_period: bool = False) -> pd.DataFrame:
+        """
+        Snaps the geocoded points of the selection to a lat/lon grid in sql and aggregates each cell,
+        keeps the scatter map from shipping every single sale to the browser
+
+        Args:
+            grid_size (float): size of a grid cell in degrees
+            by_period (bool, optional): splits the cells by period for animations. Defaults to False.
+
+        Returns:
+            pd.DataFrame: columns=['lat', 'lon', ('period'), 'num_of_sales', 'total_value', 'avg_price']
+        """
+        period_column = ", period" if by_period else ""
+        query = f"""
+            SELECT
+                (floor(lat / {grid_size}) + 0.5) * {grid_size} as lat,
+                (floor(lon / {grid_size}) + 0.5) * {grid_size} as lon
+                {period_column}
+                , count(price) as num_of_sales
+                , sum(price) as total_value
+                , avg(price) as avg_price
+            FROM {self.main_data_table}
+            WHERE sale_date between '{self.start_date}' and '{self.end_date}'
+            and {self.grouping_column} in ({self.area_choices})
+            and lat is not null and lon is not null
+            group by 1, 2 {period_column}
+        """
+
+        data = self._read_sql(query, "pull_clustered_points")
+        if by_period:
+            data = data.sort_values(by="period")
+        return data
 
     def pull_grouped_data(self, grouping=None) -> pd.DataFrame:
         """
@@ -153,6 +273,8 @@ class DataModel(object):
         Returns:
             pd.DataFrame: _description_
         """
+        if self.selection_plan() is not None and grouping in (None, "period", "year"):
+            return self.selection_plan().grouped(grouping)
 
         data_source = "propeiredb.{}_agg_data".format(self.grouping_column)
 
@@ -184,7 +306,7 @@ class DataModel(object):
             """
 
         # print(f"pulled_grouped_data: {query}")
-        return pd.read_sql(text(query), con=self.engine.connect())
+        return self._read_sql(query, "pull_grouped_data")
 
     def market_share_per_area(self):
         """
@@ -224,14 +346,10 @@ class DataModel(object):
         """
 
         # Total value of all areas for the period
-        total_value = f"""
-            SELECT
-                sum(total_value) as total_value
-            from propeiredb.{self.grouping_column}_agg_data
-            WHERE period in ({self.period_choices})
-                and {self.grouping_column} is not null
-        """
-        total_value = float(pd.read_sql(text(total_value), con=self.engine.connect())["total_value"])
+        if self.selection_plan() is not None:
+            total_value = self.selection_plan().all_areas_total()
+        else:
+            total_value = self._all_areas_total()
 
         # pulls in the total select value
         data = self.pull_grouped_data()
@@ -247,6 +365,19 @@ class DataModel(object):
 
         return pd.DataFrame.from_dict(frame)
 
+    def _all_areas_total(self) -> float:
+        """
+        Total value of all areas for the selected periods
+        """
+        total_value = f"""
+            SELECT
+                sum(total_value) as total_value
+            from propeiredb.{self.grouping_column}_agg_data
+            WHERE period in ({self.period_choices})
+                and {self.grouping_column} is not null
+        """
+        return float(self._read_sql(total_value, "market_share_selected")["total_value"].iloc[0])
+
 
 if __name__ == "__main__":
     pass
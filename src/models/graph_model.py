@@ -1,6 +1,129 @@
+import logging
+import math
+
+from dash import Patch
+import numpy as np
+import pandas as pd
 import plotly.express as px
 
-from utils.geojson_map_cleanse import DUBLIN_GEOJSON, PROVINCE_GEOJSON, COUNTY_GEOJSON
+from utils.geojson_map_cleanse import geojson_level_for_zoom, load_geojson_level
+
+log = logging.getLogger(__name__)
+
+# Scatter map clustering
+CLUSTER_CELL_PIXELS = 24  # rough on screen width of a cluster cell
+CLUSTER_MAX_MARKERS = 1500  # cap on the markers drawn per frame
+RAW_POINTS_ZOOM = 14  # zoom level from which the individual sales are drawn
+MAP_VIEWPORT_PIXELS = (1600, 1000)  # size of the map assumed when only its centre is known
+
+
+def cluster_grid_size(zoom: float, cell_pixels: int = CLUSTER_CELL_PIXELS) -> float:
+    """
+    Size of a cluster cell in degrees so that a cell covers roughly cell_pixels on screen at the given mapbox zoom
+
+    Args:
+        zoom (float): mapbox zoom level
+        cell_pixels (int, optional): width of a cell on screen. Defaults to CLUSTER_CELL_PIXELS.
+
+    Returns:
+        float: grid size in degrees
+    """
+    return round(360 / (256 * 2**zoom) * cell_pixels, 6)
+
+
+def view_bounds(relayout: dict, zoom: float) -> list:
+    """
+    Lon/lat bounds of the map on screen from its relayoutData, the corners plotly reports or else a viewport of
+    MAP_VIEWPORT_PIXELS around the centre
+
+    Args:
+        relayout (dict): relayoutData of the map
+        zoom (float): mapbox zoom level, used when relayout has no zoom
+
+    Returns:
+        list: min lon, min lat, max lon and max lat, None when relayout does not say where the map is
+    """
+    if not relayout:
+        return None
+    if "mapbox._derived" in relayout:
+        lon, lat = zip(*relayout["mapbox._derived"]["coordinates"])
+        return [min(lon), min(lat), max(lon), max(lat)]
+    if "mapbox.center" in relayout:
+        center = relayout["mapbox.center"]
+        degrees_per_pixel = 360 / (256 * 2 ** relayout.get("mapbox.zoom", zoom))
+        half_width = MAP_VIEWPORT_PIXELS[0] / 2 * degrees_per_pixel
+        half_height = MAP_VIEWPORT_PIXELS[1] / 2 * degrees_per_pixel * math.cos(math.radians(center["lat"]))
+        return [
+            center["lon"] - half_width,
+            center["lat"] - half_height,
+            center["lon"] + half_width,
+            center["lat"] + half_height,
+        ]
+    return None
+
+
+def points_bounds(view: list, zoom: float) -> list:
+    """
+    Bounds of the raw points drawn for a view, grown by a map tile on every side and snapped to the tile grid so
+    small pans stay inside them and views close to one another share the cached figure
+
+    Args:
+        view (list): min lon, min lat, max lon and max lat on screen, as returned by view_bounds
+        zoom (float): mapbox zoom level
+
+    Returns:
+        list: min lon, min lat, max lon and max lat
+    """
+    tile = 360 / 2 ** int(zoom)
+    min_lon, min_lat, max_lon, max_lat = view
+    return [
+        round((math.floor(min_lon / tile) - 1) * tile, 6),
+        round((math.floor(min_lat / tile) - 1) * tile, 6),
+        round((math.ceil(max_lon / tile) + 1) * tile, 6),
+        round((math.ceil(max_lat / tile) + 1) * tile, 6),
+    ]
+
+
+def bounds_contain(outer: list, inner: list) -> bool:
+    """
+    Whether the lon/lat box inner lies within outer
+    """
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+def coarsen_clusters(data: pd.DataFrame, grid_size: float, max_markers: int, by_period: bool = False) -> pd.DataFrame:
+    """
+    Merges neighbouring cells by doubling the grid until each frame holds no more than max_markers cells
+
+    Args:
+        data (pd.DataFrame): clustered points as returned by DataModel.pull_clustered_points
+        grid_size (float): grid size in degrees the points were clustered at
+        max_markers (int): max number of cells per frame
+        by_period (bool, optional): whether the cells are split by period. Defaults to False.
+
+    Returns:
+        pd.DataFrame: clustered points with at most max_markers cells per frame
+    """
+    keys = ["period"] if by_period else []
+
+    def largest_frame(frame):
+        if len(frame) == 0:
+            return 0
+        return frame.groupby(keys, observed=True).size().max() if by_period else len(frame)
+
+    while largest_frame(data) > max_markers:
+        grid_size *= 2
+        data = (
+            data.assign(
+                lat=(np.floor(data["lat"] / grid_size) + 0.5) * grid_size,
+                lon=(np.floor(data["lon"] / grid_size) + 0.5) * grid_size,
+            )
+            .groupby(keys + ["lat", "lon"], observed=True, as_index=False)
+            .agg(num_of_sales=("num_of_sales", "sum"), total_value=("total_value", "sum"))
+        )
+        data["avg_price"] = data["total_value"] / data["num_of_sales"]
+
+    return data
 
 
 class GraphModel(object):
@@ -37,12 +160,19 @@ class GraphModel(object):
         return "{:.{}f}{}".format(round(num, round_to), round_to, ["", "K", "M", "B", "T", "P"][magnitude])
 
     # Graphs
-    def scatter_map(self, animation=False, zoom=10):
+    def scatter_map(self, animation=False, zoom=10, max_markers=CLUSTER_MAX_MARKERS, bounds=None):
         """
-        Creates an scatter map with plotly express for displaying all the points on the map that were encoded
-        Colour and size is set by price. Data can be stacked for entire view or split for animation
+        Creates an scatter map with plotly express for displaying the points on the map that were encoded.
+        Below RAW_POINTS_ZOOM the points are clustered into grid cells sized by the number of sales and coloured
+        by average price, from RAW_POINTS_ZOOM on every point inside bounds, min lon, min lat, max lon and max lat,
+        is drawn with colour and size set by price. Without bounds, ie. before the map reported its view, the points
+        stay clustered rather than every sale of the selection being sent.
+        Data can be stacked for entire view or split for animation
         """
-        data = self.data_object.pull_data_query()
+        if zoom < RAW_POINTS_ZOOM or bounds is None:
+            return self.cluster_map(animation=animation, zoom=zoom, max_markers=max_markers)
+
+        data = self.data_object.pull_points_in_bounds(bounds)
         if animation:
             fig = px.scatter_mapbox(
                 data,
@@ -74,6 +204,40 @@ class GraphModel(object):
             )
             fig.update_mapboxes(style="open-street-map")
             fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        # centred on the view rather than on the points, of which there may be none
+        fig.update_mapboxes(center={"lon": (bounds[0] + bounds[2]) / 2, "lat": (bounds[1] + bounds[3]) / 2})
+        fig.update_layout(uirevision="scatter_map")
+        return fig
+
+    def cluster_map(self, animation=False, zoom=10, max_markers=CLUSTER_MAX_MARKERS):
+        """
+        Scatter map of the sales clustered into grid cells in the database, the grid follows the zoom level
+        and is coarsened until there are no more than max_markers per frame
+        """
+        grid_size = cluster_grid_size(zoom)
+        data = self.data_object.pull_clustered_points(grid_size, by_period=animation)
+        data = coarsen_clusters(data, grid_size, max_markers, by_period=animation)
+
+        fig = px.scatter_mapbox(
+            data,
+            lat="lat",
+            lon="lon",
+            color="avg_price",
+            size="num_of_sales",
+            hover_data={"lat": False, "lon": False, "num_of_sales": True, "total_value": ":,.0f", "avg_price": ":,.0f"},
+            labels={"num_of_sales": "Volume of Sales", "total_value": "Total Value", "avg_price": "Average Price"},
+            color_continuous_scale=px.colors.sequential.Viridis,
+            size_max=40,
+            zoom=zoom,
+            animation_frame="period" if animation else None,
+            template=self.template,
+        )
+
+        if animation:
+            fig.layout.updatemenus[0].buttons[0].args[1]["frame"]["duration"] = 2000
+
+        fig.update_mapboxes(style="open-street-map")
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, uirevision="scatter_map")
         return fig
 
     def line_chart(self, chart):
@@ -202,16 +366,79 @@ class GraphModel(object):
             )
         return graph
 
-    def choropleth_map(self):
+    # Patches
+    @staticmethod
+    def figure_signature(fig):
         """
-        Shows the breakdown for average price comparison across the country
+        Describes the trace structure, axis titles and hover text of a figure, figures with the same signature can be
+        patched into one another. The chart type and grouping show in the axis titles and hovertemplates, so switching
+        Total Value to Average Price or period to year sends the full figure
+        """
+        return [
+            [fig.layout.xaxis.title.text, fig.layout.yaxis.title.text],
+            *([trace.type, trace.name, trace.hovertemplate] for trace in fig.data),
+        ]
+
+    @staticmethod
+    def data_patch(fig):
+        """
+        Patch that swaps only the data arrays of the traces of a figure with the same signature
+        """
+        patched = Patch()
+        for i, trace in enumerate(fig.data):
+            for key in ("x", "y", "z", "locations", "customdata"):
+                if key in trace and trace[key] is not None:
+                    patched["data"][i][key] = trace[key]
+        return patched
+
+    @staticmethod
+    def choropleth_patch(arrays):
+        """
+        Patch for a choropleth map built by choropleth_map, swaps the data arrays and the colour range
+        leaving the geojson, layout and template already on the client untouched
+
+        Args:
+            arrays (dict): as returned by choropleth_arrays
+        """
+        patched = Patch()
+        patched["data"][0]["locations"] = arrays["locations"]
+        patched["data"][0]["z"] = arrays["z"]
+        patched["data"][0]["customdata"] = arrays["customdata"]
+        patched["layout"]["coloraxis"]["cmin"] = arrays["cmin"]
+        patched["layout"]["coloraxis"]["cmax"] = arrays["cmax"]
+        return patched
+
+    def _choropleth_data(self):
+        """
+        Pulls the market share data of the choropleth map
         """
         # Pulls the market share data and creates the colour based off of the market share
         data = self.data_object.market_share_per_area()
-        region = self.data_object.grouping_column
 
         # Cleans up the output for the user
         data["avg_price"] = data["avg_price"].apply(lambda x: GraphModel.human_format(x, 2))
+        return data
+
+    def choropleth_arrays(self):
+        """
+        Data arrays of the choropleth map in the layout plotly express gives them in choropleth_map
+        """
+        data = self._choropleth_data()
+        region = self.data_object.grouping_column
+        return {
+            "locations": data[region].astype(str).tolist(),
+            "z": data["total_value"].tolist(),
+            "customdata": data[[region, "total_value", "market_share", "avg_price"]].astype(object).values.tolist(),
+            "cmin": float(data["total_value"].min()) if len(data) else None,
+            "cmax": float(data["total_value"].max()) if len(data) else None,
+        }
+
+    def choropleth_map(self):
+        """
+        Shows the breakdown for average price comparison across the country
+        """
+        data = self._choropleth_data()
+        region = self.data_object.grouping_column
 
         # NOTE: string format will make colour of regions on map discrete colour palete rather
         # data['total_value']=data['total_value'].apply(lambda x: GraphModel.human_format(x, 2))
@@ -226,16 +453,17 @@ class GraphModel(object):
             lons = -6.2603
             zoom = 10
 
-        # Sorts out the assignement of regions from the dataset and the geojson
+        # Sorts out the assignement of regions from the dataset and the geojson, detail level follows the zoom
+        level = geojson_level_for_zoom(zoom)
         if region == "province":
             geojson_key = "id"
-            geojson = PROVINCE_GEOJSON
+            geojson = load_geojson_level("province", level)
         elif region == "county":
             geojson_key = "id"
-            geojson = COUNTY_GEOJSON
+            geojson = load_geojson_level("county", level)
         else:
             geojson_key = "id"
-            geojson = DUBLIN_GEOJSON
+            geojson = load_geojson_level("dublin", level)
 
         geojson_key = f"properties.{geojson_key}"
 
@@ -260,4 +488,7 @@ class GraphModel(object):
             template=self.template,
         )
         fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"choropleth_map {region}/{level}: {len(fig.to_json()) / 1024:.0f} KiB payload")
         return fig
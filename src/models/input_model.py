@@ -1,8 +1,9 @@
 import functools
+import threading
 
-import pandas as pd
 import typing
-from sqlalchemy import text
+
+from models.area_options import AreaOptions
 
 
 class InputModel(object):
@@ -10,10 +11,15 @@ class InputModel(object):
     Cleanses the input from the user to a more queryable format for feeding into the data model
     """
 
-    def __init__(self, db_engine):
-        # Pulls in the area options
-        self._area_options = self._pull_area_options(db_engine)
+    def __init__(self, db_engine, area_options: AreaOptions = None):
+        # Area options are loaded on first use and shared with the dropdowns
+        self.area_options = area_options or AreaOptions(db_engine)
         self._year_options = [str(i) for i in range(2010, 2020)]
+        self._lock = threading.Lock()
+
+    @property
+    def _area_options(self) -> typing.Dict[str, typing.List[str]]:
+        return self.area_options.areas()
 
     def cleanse_input(self, json_input: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
         """
@@ -27,6 +33,11 @@ class InputModel(object):
         Returns:
             typing.Dict[str, typing.Any]: with the same key values bar the invert with more queryable data format for inputs
         """
+        # invert is held on the object while cleaning, the lock keeps threads from cleaning over one another
+        with self._lock:
+            return self._cleanse_input(json_input)
+
+    def _cleanse_input(self, json_input: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
         # Sets the invert attribute
         try:
             self.invert = self._clean_invert(json_input["invert"])
@@ -51,32 +62,6 @@ class InputModel(object):
 
         return cleansed_input
 
-    def _pull_area_options(self, engine):
-        """
-        Connencts to postgres database for pulling in the values
-
-        Returns:
-            dict(), key values of lists for province, county and encoded_region
-        """
-        area_options = {}
-        columns = ["province", "county", "dublin_region"]
-        for i in columns:
-            if i != "dublin_region":
-                # query to pull in all the needed columns
-                query = f"SELECT {i} from propeiredb.residential_register where {i} is not null group by {i};"
-                column_to_match = i
-            else:
-                column_to_match = "region"
-                query = "SELECT region from propeiredb.residential_register_dublin_mapped where region is not null group by region;"
-
-            # Pull the data from the db
-            with engine.begin() as conn:
-                data = pd.read_sql_query(sql=text(query), con=conn)
-
-            data = list(data[column_to_match])
-            area_options[i] = data
-        return area_options
-
     def _clean_invert(self, invert: bool):
         """
         Returns the invert to a bool rather than list
@@ -0,0 +1,158 @@
+"""
+Plans the data of every dashboard chart for a selection into as few sql statements as possible
+"""
+import typing
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from utils.dtype_policy import read_frame
+from utils.query_control import QueryControl
+
+# GROUPING(period, year) value of each grouping set
+GROUPING_SETS = {None: 3, "period": 1, "year": 2}
+
+
+class SelectionPlan(object):
+    """
+    Results of the planned statements for one selection, fanned out to the chart builders in the
+    same shape the matching DataModel queries return
+    """
+
+    def __init__(self, aggregates: pd.DataFrame, totals: pd.DataFrame, grouping_column: str, areas: typing.List[str]):
+        self.aggregates = aggregates
+        self.totals = totals
+        self.grouping_column = grouping_column
+        self.areas = list(areas)
+
+    def grouped(self, grouping: str = None) -> pd.DataFrame:
+        """
+        Selected areas grouped by area, (area, period) or (area, year)
+
+        Args:
+            grouping (str, optional): None, period or year. Defaults to None.
+
+        Returns:
+            pd.DataFrame: columns=[grouping, area, 'total_value', 'avg_price', 'num_of_sales']
+        """
+        data = self.aggregates[
+            (self.aggregates["grouping_set"] == GROUPING_SETS[grouping])
+            & (self.aggregates[self.grouping_column].isin(self.areas))
+        ]
+
+        columns = [self.grouping_column] if grouping is None else [grouping, self.grouping_column]
+        data = data[columns + ["total_value", "avg_price", "num_of_sales"]].copy()
+        for column in columns:
+            if isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = data[column].cat.remove_unused_categories()
+
+        if grouping is not None:
+            data = data.sort_values(by=columns)
+        return data.reset_index(drop=True)
+
+    def grouped_by_year(self) -> pd.DataFrame:
+        """
+        Selected areas grouped by (area, year) in the column order of DataModel.pull_choices_grouped_by_year
+        """
+        return self.grouped("year")[[self.grouping_column, "year", "total_value", "avg_price", "num_of_sales"]]
+
+    def all_areas_total(self) -> float:
+        """
+        Total value of every area over the selected periods
+        """
+        data = self.aggregates[self.aggregates["grouping_set"] == GROUPING_SETS[None]]
+        return float(data["total_value"].sum())
+
+    def total(self, agg_func: str) -> float:
+        """
+        Single aggregate of the price over the selection
+
+        Args:
+            agg_func (str): sum, avg, count
+        """
+        return float(self.totals[agg_func].iloc[0])
+
+
+class QueryPlanner(object):
+    """
+    Merges the data needs of the map, the charts, the pie chart and the summary values of a selection into
+    one GROUPING SETS statement over the aggregated views and one statement for the price totals
+    """
+
+    def __init__(self, db_engine: Engine, query_control: typing.Optional[QueryControl] = None):
+        self.engine = db_engine
+        self.query_control = query_control
+
+    @staticmethod
+    def aggregates_query(grouping_column: str, period_choices: str) -> str:
+        """
+        Every area over the selected periods grouped by (area), (area, period) and (area, year),
+        areas are not filtered so the all area total of the pie chart comes from the same statement
+        """
+        return f"""
+            SELECT
+                {grouping_column}
+                , period
+                , year
+                , GROUPING(period, year) as grouping_set
+                , round(sum(total_value),2) as total_value
+                , round(avg(avg_price),2) as avg_price
+                , round(sum(num_of_sales),2) as num_of_sales
+            FROM propeiredb.{grouping_column}_agg_data
+            WHERE period in ({period_choices})
+                and {grouping_column} is not null
+            GROUP BY GROUPING SETS (({grouping_column}), ({grouping_column}, period), ({grouping_column}, year))
+        """
+
+    @staticmethod
+    def totals_query(main_data_table: str, grouping_column: str, area_choices: str, start_date: str, end_date: str) -> str:
+        """
+        sum, count and avg of the price over the selection in a single row
+        """
+        return f"""
+            SELECT
+                sum(price) as sum
+                , count(price) as count
+                , avg(price) as avg
+            FROM {main_data_table}
+            WHERE sale_date between '{start_date}' and '{end_date}'
+                and {grouping_column} in ({area_choices});
+        """
+
+    def plan(self, selection: typing.Tuple) -> SelectionPlan:
+        """
+        Runs the planned statements for a selection on a single connection
+
+        Args:
+            selection (typing.Tuple): as given by DataModel.selection
+
+        Returns:
+            SelectionPlan: results to fan out to the charts
+        """
+        main_data_table, grouping_column, areas, start_date, end_date, period_choices = selection
+        area_choices = ", ".join(f"'{i}'" for i in areas)
+
+        if self.query_control is None:
+            connection = self.engine.connect()
+        else:
+            connection = self.query_control.connect(selection, "query_planner")
+        with connection as conn:
+            aggregates = read_frame(
+                "query_planner:aggregates",
+                pd.read_sql,
+                text(self.aggregates_query(grouping_column, period_choices)),
+                con=conn,
+            )
+            totals = read_frame(
+                "query_planner:totals",
+                pd.read_sql,
+                text(self.totals_query(main_data_table, grouping_column, area_choices, start_date, end_date)),
+                con=conn,
+            )
+
+        return SelectionPlan(aggregates, totals, grouping_column, areas)
+
+
+if __name__ == "__main__":
+    pass
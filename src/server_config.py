@@ -3,13 +3,18 @@ Sets the config for the application
 """
 # Flask modules
 import os
+import tempfile
 
 import dash
 import dash_bootstrap_components as dbc
-from flask import Flask
+import diskcache
+from flask import Flask, g, jsonify, request
 from flask_caching import Cache
 
 from dotenv import load_dotenv
+from utils.dataset_version import DatasetVersion
+from utils.query_control import QueryControl, SESSION_COOKIE, new_session_id
+from utils.stale_cache import StaleWhileRevalidate
 from utils.db_connections import (
     create_postgres_sql_connection,
     create_redis_connection,
@@ -19,10 +24,28 @@ from utils.db_connections import (
 
 # Global Settings
 load_dotenv()
-PG_CONNECTION = create_postgres_sql_connection(os.getenv("POSTGRES_DSN"))
+# The engine and redis client only connect on first use, PG_CONNECTION is opened lazily by __getattr__ below
 PG_ALCHEMY_CONNECTION = create_sql_alchemy_engine(os.getenv("POSTGRES_DSN"))
 REDIS_CONNECTION = create_redis_connection(os.getenv("REDIS_DSN"))
-REDIS_TIMEOUT = 60
+
+# Cache entries are keyed on the dataset version, so they can live long and are dropped when new data lands
+REDIS_TIMEOUT = int(os.getenv("REDIS_TIMEOUT", 60 * 60 * 24))
+DATASET_VERSION = DatasetVersion(REDIS_CONNECTION, PG_ALCHEMY_CONNECTION)
+
+# Seconds an expired entry is still served while it is refreshed in the background, 0 blocks on the refresh
+CACHE_MAX_STALE = int(os.getenv("CACHE_MAX_STALE", 60 * 60 * 6))
+
+# Milliseconds a dashboard query may run before postgres cancels it
+QUERY_STATEMENT_TIMEOUT = int(os.getenv("QUERY_STATEMENT_TIMEOUT", 30000))
+QUERY_CONTROL = QueryControl(PG_ALCHEMY_CONNECTION, REDIS_CONNECTION, statement_timeout=QUERY_STATEMENT_TIMEOUT)
+
+# Sends dash.Patch updates of only the data arrays once a figure is on the client
+PATCH_FIGURES = os.getenv("PATCH_FIGURES", "true").lower() == "true"
+
+# Heavy callbacks run as background callbacks in processes of their own so they never hold up a gunicorn worker,
+# the jobs, their progress and results are kept in a diskcache shared by the workers on the host
+BACKGROUND_CACHE_DIR = os.getenv("BACKGROUND_CACHE_DIR", os.path.join(tempfile.gettempdir(), "propeiredb-background"))
+BACKGROUND_MANAGER = dash.DiskcacheManager(diskcache.Cache(BACKGROUND_CACHE_DIR))
 
 server = Flask(__name__)  # NOTE: https://community.plot.ly/t/how-to-run-dash-on-a-public-ip/4796/3
 
@@ -31,6 +54,7 @@ application = dash.Dash(
     name="app1",
     server=server,
     external_stylesheets=[dbc.themes.FLATLY],
+    background_callback_manager=BACKGROUND_MANAGER,
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
 )
 
@@ -38,10 +62,51 @@ CACHE = Cache(
     application.server,
     config={
         # try 'filesystem' if you don't want to setup redis
-        "CACHE_TYPE": "redis",
+        # redis with an in process LRU of the hot entries in front of it, see utils/tiered_cache.py
+        "CACHE_TYPE": "utils.tiered_cache.TieredRedisCache",
         "CACHE_REDIS_URL": os.getenv("REDIS_DSN"),
+        "CACHE_LOCAL_MAX_BYTES": int(os.getenv("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024)),
+        "CACHE_LOCAL_TTL": int(os.getenv("CACHE_LOCAL_TTL", 300)),
+        # figures are stored as compressed figure json, zlib or lz4
+        "CACHE_COMPRESSION": os.getenv("CACHE_COMPRESSION", "zlib"),
+        "CACHE_MAX_ENTRY_BYTES": int(os.getenv("CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)),
     },
 )
 
+STALE_CACHE = StaleWhileRevalidate(CACHE, max_stale=CACHE_MAX_STALE)
+
+
+@server.before_request
+def assign_session():
+    """
+    Gives a browser without a session cookie a session id, the queries of a session's older selections are cancelled
+    """
+    if SESSION_COOKIE not in request.cookies:
+        g.session_id = new_session_id()
+
+
+@server.after_request
+def set_session_cookie(response):
+    if "session_id" in g:
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite="Lax")
+    return response
+
+
+@server.route("/cache-stats")
+def cache_stats():
+    """
+    Per tier hit counters of the worker serving the request
+    """
+    return jsonify(CACHE.cache.stats())
+
+
+def __getattr__(name):
+    # the web app reads through the sqlalchemy engine, the raw connection is only opened for callers importing it
+    if name == "PG_CONNECTION":
+        globals()[name] = create_postgres_sql_connection(os.getenv("POSTGRES_DSN"))
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,113 @@
+"""
+Measures the start up of the web app, the import time of wsgi and the boot time and memory of each gunicorn worker
+"""
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Logged by post_worker_init in gunicorn.conf.py
+WORKER_READY = re.compile(r"Worker ready \(pid: (\d+)\) in ([\d.]+)s")
+
+
+def import_time(module: str = "wsgi") -> float:
+    """
+    Seconds a fresh interpreter takes to import the module
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=SRC_DIRECTORY, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def process_memory(pid: int) -> typing.Dict[str, int]:
+    """
+    Rss and Pss of a process in KiB, Pss splits the pages shared copy on write between the processes sharing them
+    """
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as smaps:
+        for line in smaps:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                memory[key.lower() + "_kib"] = int(value.split()[0])
+    return memory
+
+
+def gunicorn_workers(workers: int = 2, preload: bool = True, timeout: float = 180) -> typing.Dict[str, typing.Any]:
+    """
+    Starts gunicorn with gunicorn.conf.py, waits for every worker to report ready and samples its memory
+
+    Args:
+        workers (int, optional): worker processes. Defaults to 2.
+        preload (bool, optional): loads the app in the master before forking. Defaults to True.
+        timeout (float, optional): seconds to wait for the workers. Defaults to 180.
+
+    Returns:
+        typing.Dict[str, typing.Any]: time until every worker was ready, boot time and memory per worker
+    """
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload).lower())
+    command = ["gunicorn", "wsgi:server", "-c", "gunicorn.conf.py", "--workers", str(workers), "--bind", "127.0.0.1:0"]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=SRC_DIRECTORY, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    ready = {}
+    done = threading.Event()
+
+    def read_log():
+        for line in process.stderr:
+            match = WORKER_READY.search(line)
+            if match:
+                ready[int(match.group(1))] = float(match.group(2))
+                if len(ready) >= workers:
+                    done.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+    try:
+        if done.wait(timeout) is False:
+            raise TimeoutError(f"{len(ready)} of {workers} workers ready after {timeout}s")
+        all_ready = time.perf_counter() - start
+
+        results = []
+        for pid, boot in ready.items():
+            results.append({"pid": pid, "boot_s": boot, **process_memory(pid)})
+        master = process_memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait(30)
+
+    return {"preload": preload, "all_ready_s": all_ready, "master": master, "workers": results}
+
+
+def profile_startup(workers: int = 2) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Logs the import time and the gunicorn worker boot time and memory without and with preload_app
+    """
+    log.info(f"import wsgi: {import_time():.2f}s")
+
+    runs = []
+    for preload in (False, True):
+        run = gunicorn_workers(workers, preload)
+        runs.append(run)
+        log.info(
+            f"preload_app={preload}: all {workers} workers ready in {run['all_ready_s']:.2f}s, "
+            f"master rss {run['master']['rss_kib'] / 1024:.0f} MiB"
+        )
+        for worker in run["workers"]:
+            log.info(
+                f"  worker {worker['pid']}: boot {worker['boot_s']:.2f}s, "
+                f"rss {worker['rss_kib'] / 1024:.0f} MiB, pss {worker['pss_kib'] / 1024:.0f} MiB"
+            )
+    return runs
+
+
+if __name__ == "__main__":
+    pass
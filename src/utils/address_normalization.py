@@ -0,0 +1,85 @@
+"""
+    @about: Normalized form of a PPR address, spelling variants of the same address share it. normalize_address keys
+    single addresses, normalize_addresses and address_cluster_keys apply the same rules to whole columns with the
+    pandas string methods so the register can be clustered before geocoding
+"""
+import re
+
+import pandas as pd
+
+# Rewrites applied in order after casefolding, the escape character and "*" typos are the ones
+# process_downloaded_data flattens
+_RULES = [
+    (re.compile(r"\\"), ""),
+    (re.compile(r"\*"), "8"),
+    (re.compile(r"[^\w\s]"), " "),
+    (re.compile(r"\bapts\b"), "apartments"),
+    (re.compile(r"\bapt\b"), "apartment"),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"^\s+|\s+$"), ""),
+    (re.compile(r"(\s+(republic of )?ireland)+$"), ""),
+]
+_COUNTY_SUFFIX = re.compile(r"\s+(?:(?:co|county) )?(\w+)$")
+
+
+def normalize_address(address: str) -> str:
+    """
+    Lowercased address with the punctuation, repeated whitespace and a trailing Ireland taken out and apt spelled
+    out as apartment
+
+    Args:
+        address (str): raw or geocoder bound address
+
+    Returns:
+        str: normalized address
+    """
+    address = str(address).casefold()
+    for pattern, replacement in _RULES:
+        address = pattern.sub(replacement, address)
+    return address
+
+
+def normalize_addresses(addresses: pd.Series) -> pd.Series:
+    """
+    normalize_address of every address of a column
+
+    Args:
+        addresses (pd.Series): raw or geocoder bound addresses
+
+    Returns:
+        pd.Series: normalized addresses
+    """
+    addresses = addresses.astype(str).str.casefold()
+    for pattern, replacement in _RULES:
+        addresses = addresses.str.replace(pattern, replacement, regex=True)
+    return addresses
+
+
+def address_cluster_keys(addresses: pd.Series, counties: pd.Series) -> pd.Series:
+    """
+    Key shared by the addresses that geocode to the same place, the normalized address without its county suffix
+    blocked by the county of the sale so only addresses of the same county are ever merged
+
+    Args:
+        addresses (pd.Series): raw addresses
+        counties (pd.Series): county of each address
+
+    Returns:
+        pd.Series: cluster key of each address
+    """
+    counties = counties.fillna("").astype(str).str.casefold().str.strip()
+    normalized = normalize_addresses(addresses)
+
+    # "<county>", "co <county>" or both trailing the address, only when it is the county of the sale
+    keys = normalized
+    for _ in range(2):
+        own_county = keys.str.extract(_COUNTY_SUFFIX, expand=False) == counties
+        keys = keys.mask(own_county, keys.str.replace(_COUNTY_SUFFIX, "", regex=True))
+    # an address that was nothing but its county keeps it
+    keys = keys.mask(keys == "", normalized)
+
+    return counties + "|" + keys
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,87 @@
+"""
+    @about: Maintains propeiredb.area_dim, the areas of every map type with their sale counts and date range
+"""
+import logging
+import typing
+
+from psycopg2.extensions import connection as PostgresConnection
+from psycopg2.extras import execute_values
+
+log = logging.getLogger(__name__)
+
+# Area level to the table and column its areas are counted from
+AREA_LEVELS = {
+    "province": ("propeiredb.residential_register", "province"),
+    "county": ("propeiredb.residential_register", "county"),
+    "dublin_region": ("propeiredb.residential_register_dublin_mapped", "region"),
+}
+
+
+def area_label(area: str) -> str:
+    """
+    Display label of an area, matches the title casing the dropdowns always used
+    """
+    return str(area).title()
+
+
+def refresh_area_dim(pg_connection: PostgresConnection, level: str, areas: typing.Iterable[str] = None) -> int:
+    """
+    Recounts the given areas of a level, or the whole level, and upserts them into area_dim.
+    Areas that no longer have any sales are kept with a row count of 0 so the dropdowns can grey them out
+
+    Args:
+        pg_connection (PostgresConnection): connection to the database
+        level (str): province, county or dublin_region
+        areas (typing.Iterable[str], optional): areas touched by a load. Defaults to None, every area of the level.
+
+    Returns:
+        int: areas upserted
+    """
+    table, column = AREA_LEVELS[level]
+    areas = None if areas is None else sorted({str(i) for i in areas if i is not None})
+    if areas is not None and len(areas) == 0:
+        return 0
+
+    area_filter = "" if areas is None else f"and {column} = ANY(%(areas)s)"
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {column}::text, count(*), min(sale_date), max(sale_date)
+            FROM {table}
+            WHERE {column} is not null {area_filter}
+            GROUP BY {column};
+            """,
+            {"areas": areas},
+        )
+        counted = {row[0]: row for row in cursor.fetchall()}
+
+        # areas asked for, or already in the dimension, without any sales left
+        if areas is None:
+            cursor.execute("SELECT area FROM propeiredb.area_dim WHERE level = %(level)s;", {"level": level})
+            areas = [row[0] for row in cursor.fetchall()]
+        empty = [(area, 0, None, None) for area in areas if area not in counted]
+
+        rows = [(level, area, area_label(area), count, first, last) for area, count, first, last in counted.values()]
+        rows += [(level, area, area_label(area), count, first, last) for area, count, first, last in empty]
+        execute_values(
+            cursor,
+            """
+            INSERT INTO propeiredb.area_dim (level, area, label, row_count, first_sale_date, last_sale_date)
+            VALUES %s
+            ON CONFLICT (level, area) DO UPDATE SET
+                label = EXCLUDED.label,
+                row_count = EXCLUDED.row_count,
+                first_sale_date = EXCLUDED.first_sale_date,
+                last_sale_date = EXCLUDED.last_sale_date,
+                updated_at = now();
+            """,
+            rows,
+        )
+    pg_connection.commit()
+
+    log.info(f"area_dim refreshed {len(rows)} {level} areas, {len(empty)} without sales")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    pass
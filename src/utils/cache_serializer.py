@@ -0,0 +1,146 @@
+"""
+    @about: Compact serializer of the redis cache, plotly figures are stored as compressed figure json
+    and every other value as a compressed pickle
+"""
+import json
+import logging
+import pickle
+import time
+import typing
+import zlib
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from cachelib.serializers import RedisSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+log = logging.getLogger(__name__)
+
+# Header of a stored value, kind then codec. '!' is the plain pickle of cachelib's RedisSerializer
+FIGURE, PICKLE = b"F", b"P"
+CODECS = {"zlib": b"z", "lz4": b"l", "none": b"-"}
+
+JSON_ENGINE = "orjson" if orjson is not None else "json"
+
+
+def _compress(codec: bytes, data: bytes, level: int) -> bytes:
+    if codec == CODECS["zlib"]:
+        return zlib.compress(data, level)
+    if codec == CODECS["lz4"]:
+        return lz4.compress(data)
+    return data
+
+
+def _decompress(codec: bytes, data: bytes) -> bytes:
+    if codec == CODECS["zlib"]:
+        return zlib.decompress(data)
+    if codec == CODECS["lz4"]:
+        return lz4.decompress(data)
+    return data
+
+
+def _json_loads(data: bytes) -> typing.Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CompactSerializer(RedisSerializer):
+    """
+    Stores plotly figures as figure json, written with plotly's orjson engine, instead of pickling the whole
+    figure object, and compresses every value larger than compress_min_bytes with zlib or lz4.
+
+    Values written by the plain RedisSerializer are still read.
+    """
+
+    def __init__(self, codec: str = "zlib", level: int = 6, compress_min_bytes: int = 1024):
+        if codec == "lz4" and lz4 is None:
+            log.warning("lz4 is not installed, compressing the cache with zlib")
+            codec = "zlib"
+        self.codec = CODECS[codec]
+        self.level = level
+        self.compress_min_bytes = compress_min_bytes
+
+    def dumps(self, value: typing.Any, protocol: int = pickle.HIGHEST_PROTOCOL) -> bytes:
+        if isinstance(value, go.Figure):
+            kind, data = FIGURE, pio.to_json(value, validate=False, engine=JSON_ENGINE).encode()
+        else:
+            kind, data = PICKLE, pickle.dumps(value, protocol)
+
+        codec = self.codec if len(data) >= self.compress_min_bytes else CODECS["none"]
+        return kind + codec + _compress(codec, data, self.level)
+
+    def loads(self, value: typing.Optional[bytes]) -> typing.Any:
+        if value is None:
+            return None
+
+        kind, codec = value[:1], value[1:2]
+        if kind not in (FIGURE, PICKLE):
+            return super().loads(value)
+
+        try:
+            data = _decompress(codec, value[2:])
+            if kind == FIGURE:
+                # the json was written from a valid figure, validating it again costs more than the read
+                return go.Figure(_json_loads(data), _validate=False)
+            return pickle.loads(data)
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not read a cached value: {e}")
+            return None
+
+
+def benchmark_serializers(
+    values: typing.Dict[str, typing.Any], serializers: typing.Dict[str, RedisSerializer], redis_connection, repeat: int = 20
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Stored bytes and redis hit latency of each value under each serializer, the values are written to redis
+    under a benchmark key and read back repeat times
+
+    Args:
+        values (typing.Dict[str, typing.Any]): name to value, ie. figures of the memoized callbacks
+        serializers (typing.Dict[str, RedisSerializer]): name to serializer
+        redis_connection (StrictRedis): redis the cache lives in
+        repeat (int, optional): reads per value. Defaults to 20.
+
+    Returns:
+        typing.List[typing.Dict[str, typing.Any]]: one row per value and serializer
+    """
+    rows = []
+    for value_name, value in values.items():
+        for serializer_name, serializer in serializers.items():
+            key = f"propeiredb:benchmark:{value_name}:{serializer_name}"
+
+            start = time.perf_counter()
+            dump = serializer.dumps(value)
+            dumps_ms = (time.perf_counter() - start) * 1000
+            redis_connection.set(key, dump, ex=60)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                serializer.loads(redis_connection.get(key))
+            hit_ms = (time.perf_counter() - start) * 1000 / repeat
+            redis_connection.delete(key)
+
+            rows.append(
+                {
+                    "value": value_name,
+                    "serializer": serializer_name,
+                    "stored_bytes": len(dump),
+                    "dumps_ms": round(dumps_ms, 2),
+                    "hit_ms": round(hit_ms, 2),
+                }
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,98 @@
+"""
+    @about: Version counter of the data in the database, bumped by the pipeline and mixed into the cache keys
+"""
+import logging
+import time
+
+from psycopg2.extensions import connection as PostgresConnection
+from redis import StrictRedis
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+DATASET_VERSION_KEY = "propeiredb:dataset_version"
+
+
+def bump_dataset_version(pg_connection: PostgresConnection, redis_connection: StrictRedis = None) -> int:
+    """
+    Increments the dataset version in postgres and publishes it to redis, called at the end of every data load
+
+    Args:
+        pg_connection (PostgresConnection): connection to the database
+        redis_connection (StrictRedis, optional): redis the web app caches in. Defaults to None.
+
+    Returns:
+        int: the new version
+    """
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE propeiredb.dataset_version
+            SET version = version + 1, updated_at = now()
+            WHERE id = 1
+            RETURNING version;
+            """
+        )
+        version = cursor.fetchone()[0]
+
+    if redis_connection is not None:
+        redis_connection.set(DATASET_VERSION_KEY, version)
+
+    log.info(f"dataset version bumped to {version}")
+    return version
+
+
+class DatasetVersion(object):
+    """
+    Reads the dataset version from redis, falling back to postgres, and holds it in process for poll_interval seconds
+    """
+
+    def __init__(self, redis_connection: StrictRedis, db_engine: Engine, poll_interval: float = 2.0):
+        self.redis_connection = redis_connection
+        self.engine = db_engine
+        self.poll_interval = poll_interval
+        self._version = None
+        self._read_at = 0.0
+
+    def _read(self) -> int:
+        try:
+            version = self.redis_connection.get(DATASET_VERSION_KEY)
+            if version is not None:
+                return int(version)
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not read the dataset version from redis: {e}")
+
+        try:
+            with self.engine.connect() as conn:
+                version = conn.execute(text("SELECT version FROM propeiredb.dataset_version WHERE id = 1")).scalar()
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not read the dataset version from postgres: {e}")
+            return self._version or 0
+
+        version = int(version or 0)
+        try:
+            self.redis_connection.set(DATASET_VERSION_KEY, version)
+        except Exception:  # pylint: disable=broad-except
+            pass
+        return version
+
+    def current(self) -> int:
+        """
+        Current dataset version
+        """
+        now = time.monotonic()
+        if self._version is None or now - self._read_at >= self.poll_interval:
+            self._version = self._read()
+            self._read_at = now
+        return self._version
+
+    def make_name(self, fname: str) -> str:
+        """
+        Used as make_name in CACHE.memoize, puts the dataset version into every memoized key
+        """
+        return f"{fname}:v{self.current()}"
+
+
+if __name__ == "__main__":
+    pass
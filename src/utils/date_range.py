@@ -0,0 +1,20 @@
+"""
+    @about: Default date range of the dashboard, shared by the date picker of the layout and the cache warmer so the
+    selections warmed are the ones a page load asks for
+"""
+from datetime import date
+
+# First date of the date range picker, the register starts in 2010
+DATA_START_DATE = date(2010, 1, 1)
+
+
+def default_end_date() -> date:
+    """
+    End of the default date range, today in the server's timezone, looked up on every call so a long running
+    server moves on at midnight
+    """
+    return date.today()
+
+
+if __name__ == "__main__":
+    pass
@@ -48,6 +48,22 @@ def create_postgres_sql_connection(dsn: str) -> PostgresConnection:
     return postgres_connection
 
 
+def clone_postgres_connection(connection: PostgresConnection) -> PostgresConnection:
+    """
+    New connection to the same database as connection, for a thread that must not share it. The dsn psycopg2
+    reports hides the password, which is taken from the connection info instead
+
+    Args:
+        connection (PostgresConnection): connection to copy
+
+    Returns:
+        PostgresConnection: connection with the same dsn and autocommit
+    """
+    clone = pg_connection(connection.dsn, password=connection.info.password)
+    clone.autocommit = connection.autocommit
+    return clone
+
+
 def create_redis_connection(dsn: str) -> StrictRedis:
     """
     [summary]
@@ -61,5 +77,5 @@ def create_redis_connection(dsn: str) -> StrictRedis:
     """
     # Read in config Connection
 
-    redis_connection = StrictRedis(dsn)
+    redis_connection = StrictRedis.from_url(dsn)
     return redis_connection
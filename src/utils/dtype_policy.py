@@ -0,0 +1,143 @@
+"""
+    @about: Dtype policy applied to every frame pulled from the database, keeps query results lean in memory
+"""
+import logging
+import time
+from decimal import Decimal
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+
+# Low cardinality text columns stored as pandas category
+CATEGORY_COLUMNS = (
+    "county",
+    "province",
+    "region",
+    "period",
+    "year",
+    "month",
+    "postal_code",
+    "dublin_area_code",
+    "not_full_market_price",
+    "vat_exclusive",
+    "property_description",
+    "property_size_description",
+)
+
+# NUMERIC/DECIMAL columns that come back from psycopg2 as python Decimal objects
+NUMERIC_COLUMNS = ("price", "total_value", "num_of_sales", "sum", "count")
+
+# NUMERIC/DECIMAL columns that are always fractional
+FLOAT_COLUMNS = ("avg_price", "avg", "lat", "lon")
+
+# DATE columns that come back as python date objects
+DATE_COLUMNS = ("sale_date",)
+
+
+def _to_number(series: pd.Series) -> pd.Series:
+    """
+    Casts a series of Decimal/objects to int64 when every value is whole, otherwise float64
+
+    Args:
+        series (pd.Series): column to cast
+
+    Returns:
+        pd.Series: numeric column
+    """
+    if series.dtype == object:
+        series = pd.to_numeric(series.map(lambda x: float(x) if isinstance(x, Decimal) else x), errors="coerce")
+
+    if pd.api.types.is_float_dtype(series) and series.notna().all() and len(series) > 0:
+        values = series.to_numpy()
+        if np.array_equal(values, np.floor(values)) and np.abs(values).max() < 2**53:
+            return series.astype("int64")
+
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype("int64")
+
+    return series.astype("float64")
+
+
+def apply_dtype_policy(
+    df: pd.DataFrame,
+    category_columns: Iterable[str] = CATEGORY_COLUMNS,
+    numeric_columns: Iterable[str] = NUMERIC_COLUMNS,
+    float_columns: Iterable[str] = FLOAT_COLUMNS,
+    date_columns: Iterable[str] = DATE_COLUMNS,
+) -> pd.DataFrame:
+    """
+    Converts a raw query frame to memory lean dtypes, low cardinality text to category,
+    Decimal prices to float64/int64 and dates to datetime64
+
+    Args:
+        df (pd.DataFrame): frame as returned from pd.read_sql
+        category_columns (Iterable[str], optional): columns to store as category. Defaults to CATEGORY_COLUMNS.
+        numeric_columns (Iterable[str], optional): columns to cast to int64 or float64. Defaults to NUMERIC_COLUMNS.
+        float_columns (Iterable[str], optional): columns to cast to float64. Defaults to FLOAT_COLUMNS.
+        date_columns (Iterable[str], optional): columns to cast to datetime64. Defaults to DATE_COLUMNS.
+
+    Returns:
+        pd.DataFrame: same frame with the converted columns
+    """
+    for column in df.columns.intersection(list(numeric_columns)):
+        df[column] = _to_number(df[column])
+
+    for column in df.columns.intersection(list(float_columns)):
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+
+    for column in df.columns.intersection(list(date_columns)):
+        df[column] = pd.to_datetime(df[column])
+
+    for column in df.columns.intersection(list(category_columns)):
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+
+    return df
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    """
+    Deep memory usage of the frame in bytes
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def read_frame(query_name: str, read_func, *args, **kwargs) -> pd.DataFrame:
+    """
+    Runs the read function, applies the dtype policy and logs a memory report of the query at debug level
+
+    Args:
+        query_name (str): name used in the log output
+        read_func (Callable): function returning a dataframe, ie. pd.read_sql
+
+    Returns:
+        pd.DataFrame: frame with the dtype policy applied
+    """
+    start = time.perf_counter()
+    df = read_func(*args, **kwargs)
+    fetched = time.perf_counter()
+
+    if log.isEnabledFor(logging.DEBUG) is False:
+        return apply_dtype_policy(df)
+
+    raw_bytes = frame_memory(df)
+    df = apply_dtype_policy(df)
+    lean_bytes = frame_memory(df)
+    log.debug(
+        "%s: %d rows, fetched in %.3fs, %.1f KiB -> %.1f KiB (%.0f%% saved)",
+        query_name,
+        len(df),
+        fetched - start,
+        raw_bytes / 1024,
+        lean_bytes / 1024,
+        (1 - lean_bytes / raw_bytes) * 100 if raw_bytes else 0.0,
+    )
+    return df
+
+
+if __name__ == "__main__":
+    pass
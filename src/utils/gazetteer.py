@@ -0,0 +1,219 @@
+"""
+    @about: Offline first pass of the geocoding. Addresses are resolved against a gazetteer of the Dublin postal
+    districts and counties, placed at a point inside each boundary, and of the localities and Eircode routing keys
+    of an optional csv, and only the ones it cannot place well enough go on to the geocoding API
+
+    The csv has a header of name,lat,lon and an optional county column, a name shaped like a routing key (A94, D6W)
+    is a routing key and anything else a locality found by its name in the address
+"""
+import csv
+import dataclasses
+import logging
+import os
+import re
+import typing
+
+import shapely
+
+from .address_normalization import normalize_address
+from .spatial_join import boundary_index
+
+log = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data/gazetteer/localities.csv"
+)
+
+# How closely a match places an address, from the county alone up to a locality named in the address
+LOW = 1
+MEDIUM = 2
+HIGH = 3
+CONFIDENCE_LEVELS = {"low": LOW, "medium": MEDIUM, "high": HIGH}
+CONFIDENCE_NAMES = {level: name for name, level in CONFIDENCE_LEVELS.items()}
+
+ROUTING_KEY = re.compile(r"^([ac-fhknprtv-y]\d{2}|d6w)$")
+EIRCODE = re.compile(r"\b([ac-fhknprtv-y]\d{2}|d6w) ?[0-9ac-fhknprtv-y]{4}\b")
+# Words after a place name that make it a street named after the place, Rathmines Road is not in Rathmines
+THOROUGHFARES = {
+    "avenue",
+    "ave",
+    "road",
+    "rd",
+    "street",
+    "st",
+    "lane",
+    "park",
+    "drive",
+    "grove",
+    "court",
+    "crescent",
+    "terrace",
+    "square",
+    "way",
+    "close",
+    "green",
+    "hill",
+    "view",
+    "heights",
+    "lawn",
+    "lawns",
+    "place",
+    "rise",
+    "walk",
+    "wood",
+    "gardens",
+    "manor",
+    "downs",
+}
+DUBLIN_DISTRICT = re.compile(r"\b(?:dublin|baile átha cliath) (\d{1,2}w?)\b")
+
+
+@dataclasses.dataclass
+class GazetteerMatch:
+    name: str
+    lat: float
+    lon: float
+    confidence: int
+    source: str
+
+
+def dublin_district_key(district: str) -> str:
+    """
+    Routing key of a Dublin postal district, 8 to D08 and 6w to D6W
+    """
+    district = district.casefold()
+    return "d6w" if district == "6w" else f"d{int(district):02d}"
+
+
+class Gazetteer(object):
+    """
+    Hash index of place names to points. Localities are kept by their tuple of name tokens, an address is matched
+    by looking up its token n-grams from the end so the most specific place, usually written last before the county,
+    wins, and a locality is only taken when it is in the county of the sale
+    """
+
+    def __init__(self):
+        self.localities: typing.Dict[typing.Tuple[str, ...], typing.List[typing.Tuple[str, float, float, str]]] = {}
+        self.routing_keys: typing.Dict[str, typing.Tuple[str, float, float]] = {}
+        self.counties: typing.Dict[str, typing.Tuple[str, float, float]] = {}
+        self.max_tokens = 0
+
+    def __len__(self) -> int:
+        return sum(len(i) for i in self.localities.values()) + len(self.routing_keys) + len(self.counties)
+
+    def add_locality(self, name: str, lat: float, lon: float, county: str = None):
+        tokens = tuple(normalize_address(name).split())
+        if len(tokens) == 0:
+            return
+        self.localities.setdefault(tokens, []).append((name, lat, lon, (county or "").casefold()))
+        self.max_tokens = max(self.max_tokens, len(tokens))
+
+    def add_routing_key(self, key: str, lat: float, lon: float, name: str = None):
+        self.routing_keys[key.casefold()] = (name or key.upper(), lat, lon)
+
+    def add_county(self, county: str, lat: float, lon: float):
+        self.counties[county.casefold()] = (county, lat, lon)
+
+    def add_boundaries(self):
+        """
+        Adds a point inside every Dublin postal district, under its routing key, and inside every county
+        """
+        dublin = boundary_index("dublin")
+        for name, point in zip(dublin.names, shapely.point_on_surface(dublin.geometries)):
+            district = re.sub(r"^d", "", name.casefold())
+            if re.fullmatch(r"\d{1,2}w?", district):
+                self.add_routing_key(dublin_district_key(district), point.y, point.x, f"Dublin {district.upper()}")
+
+        counties = boundary_index("county")
+        for name, point in zip(counties.names, shapely.point_on_surface(counties.geometries)):
+            self.add_county(name, point.y, point.x)
+
+    def load_csv(self, path: str) -> int:
+        """
+        Adds the localities and routing keys of a csv with name, lat, lon and an optional county
+
+        Returns:
+            int: entries added
+        """
+        added = 0
+        with open(path, encoding="utf-8", newline="") as gazetteer_file:
+            for row in csv.DictReader(gazetteer_file):
+                name = row["name"].strip()
+                lat, lon = float(row["lat"]), float(row["lon"])
+                if ROUTING_KEY.match(name.casefold()):
+                    self.add_routing_key(name, lat, lon)
+                else:
+                    self.add_locality(name, lat, lon, row.get("county"))
+                added += 1
+        log.info(f"{added} gazetteer entries loaded from {path}")
+        return added
+
+    @classmethod
+    def from_files(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        """
+        Gazetteer of the boundaries and, when the file exists, the localities and routing keys of path
+        """
+        gazetteer = cls()
+        gazetteer.add_boundaries()
+        if path and os.path.exists(path):
+            gazetteer.load_csv(path)
+        return gazetteer
+
+    def match_locality(
+        self, tokens: typing.Sequence[str], county: str
+    ) -> typing.Optional[typing.Tuple[str, float, float, str]]:
+        for end in range(len(tokens), 0, -1):
+            for size in range(min(self.max_tokens, end), 0, -1):
+                name = tuple(tokens[end - size : end])
+                # the county written after the address is not a locality of it
+                candidates = self.localities.get(name) if name != (county,) else None
+                if not candidates or (end < len(tokens) and tokens[end] in THOROUGHFARES):
+                    continue
+                in_county = [i for i in candidates if i[3] in ("", county)]
+                # a name shared by places of the same county does not say which one
+                if len(in_county) == 1:
+                    return in_county[0]
+        return None
+
+    def resolve(self, address: str, county: str = None, postal_code: str = None) -> typing.Optional[GazetteerMatch]:
+        """
+        Best match of an address
+
+        Args:
+            address (str): address of the sale
+            county (str, optional): county of the sale. Defaults to None.
+            postal_code (str, optional): PPR postal code, ie. Dublin 8. Defaults to None.
+
+        Returns:
+            typing.Optional[GazetteerMatch]: a locality named in the address at HIGH, its Eircode routing key or
+                Dublin postal district at MEDIUM, its county at LOW and None without any
+        """
+        normalized = normalize_address(address)
+        county = county.casefold().strip() if isinstance(county, str) else ""
+        postal_code = normalize_address(postal_code) if isinstance(postal_code, str) else ""
+
+        if self.localities:
+            locality = self.match_locality(normalized.split(), county)
+            if locality is not None:
+                name, lat, lon, _ = locality
+                return GazetteerMatch(name, lat, lon, HIGH, "locality")
+
+        eircode = EIRCODE.search(normalized)
+        district = DUBLIN_DISTRICT.search(f"{postal_code} {normalized}")
+        routing_key = None
+        if eircode is not None:
+            routing_key = eircode.group(1)
+        elif district is not None and county in ("", "dublin"):
+            routing_key = dublin_district_key(district.group(1))
+        if routing_key in self.routing_keys:
+            name, lat, lon = self.routing_keys[routing_key]
+            return GazetteerMatch(name, lat, lon, MEDIUM, "routing_key")
+
+        if county in self.counties:
+            name, lat, lon = self.counties[county]
+            return GazetteerMatch(f"Co. {name}", lat, lon, LOW, "county")
+        return None
+
+
+if __name__ == "__main__":
+    pass
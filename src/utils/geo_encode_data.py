@@ -1,20 +1,33 @@
 """
 Functions to help with the geoencoding
 """
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List
 import dataclasses
+import functools
+import itertools
 import googlemaps
 import logging
+import queue
+import threading
 
+import numpy as np
 import pandas as pd
+from psycopg2 import sql
 from psycopg2.extensions import connection as PostgresConnection
-from shapely.geometry.polygon import Polygon
+from psycopg2.extras import execute_values
 from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
 from tqdm import tqdm
 
-from .db_utils import recursive_list_float_extractor
+from .address_normalization import address_cluster_keys, normalize_addresses
+from .db_connections import clone_postgres_connection
+from .geocode_cache import GeocodeCache
+from .gazetteer import CONFIDENCE_NAMES, HIGH, Gazetteer
+from .geocode_queue import claim_addresses, complete_addresses, release_addresses, worker_name
+from .geocoder import ConcurrentGeocoder
+from .region_index import region_polygons
+from .spatial_join import boundary_indexes, spatial_join
 from .pandas_upsert import PandaSqlPlus
-from .geojson_map_cleanse import DUBLIN_GEOJSON
 
 
 # -----------------------------------------------------------------------------
@@ -28,11 +41,30 @@ class GeoEncodedAddress:
     lon: float
     address_hash: str | None = None
     region: str | None = None
+    geo_county: str | None = None
+    geo_province: str | None = None
+    geocoder: str = "google"
+    confidence: str | None = None
 
 
-def encode_address(address: str, client: googlemaps.Client) -> GeoEncodedAddress:
-    geocode_result = client.geocode(address)
+def geocode_response(
+    address: str, client: googlemaps.Client, cache: GeocodeCache = None, record_stats: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Raw response of the geocoder for an address, from the cache when it holds the address
+    """
+    if cache is not None:
+        cached, response = cache.get(address, record_stats)
+        if cached and response is not None:
+            return response
+
+    response = client.geocode(address)
+    if cache is not None:
+        cache.set(address, response)
+    return response
 
+
+def parse_geocode_response(address: str, geocode_result: List[Dict[str, Any]]) -> GeoEncodedAddress:
     if len(geocode_result) == 0:
         raise ValueError("No results found")
     geocode_result = geocode_result[0]
@@ -44,39 +76,39 @@ def encode_address(address: str, client: googlemaps.Client) -> GeoEncodedAddress
     return GeoEncodedAddress(input_address=address, output_address=output_address, lat=lat, lon=lon)
 
 
-def generate_region_points(geojson: Dict[str, Any]) -> Dict[str, Polygon]:
+def encode_address(
+    address: str, client: googlemaps.Client, cache: GeocodeCache = None, record_stats: bool = True
+) -> GeoEncodedAddress:
+    return parse_geocode_response(address, geocode_response(address, client, cache, record_stats))
+
+
+def generate_region_points(geojson: Dict[str, Any]) -> Dict[str, BaseGeometry]:
     """
-    Given a converted geojson, it extracts the feature ID's and returns a dict of polygon points
+    Given a converted geojson, it extracts the feature ID's and returns a dict of polygons,
+    MultiPolygon features keep every part and hole
 
     Args:
-        geojson (Dict[str, Any]): _description_
+        geojson (Dict[str, Any]): cleansed geojson
 
     Returns:
-        Dict[str, Polygon]: _description_
+        Dict[str, BaseGeometry]: feature id to its polygon
     """
-    geojson = geojson["features"]
-    mapped_polygons = {}
-    for i in geojson:
-        #  Returns list of lists which each contain the lat and lon points which is used in polygon object
-        points = recursive_list_float_extractor(i["geometry"]["coordinates"])
-        #  Creates the polygon object from data file
-        poly = Polygon(points)
-        mapped_polygons[i["id"]] = poly
-
-    return mapped_polygons
+    return region_polygons(geojson)
 
 
-def assign_region(lon: float, lat: float, geojson: Dict[str, Polygon]) -> str | None:
+def assign_region(lon: float, lat: float, geojson: Dict[str, BaseGeometry]) -> str | None:
     """
     Assigns a region based on the lat and lon coordinates and the geojson_details variable defined elsewhere
 
     Args:
         lon (_type_): _description_
         lat (_type_): _description_
-        geojson (Dict[str, Polygon]): _description_
+        geojson (Dict[str, BaseGeometry]): _description_
 
     Returns:
         str | None: the assignement key from the geojson file
+
+    NOTE: tests every polygon in turn, RegionIndex assigns many points at once
     """
 
     point = Point(lon, lat)
@@ -115,68 +147,414 @@ def get_addresses_to_encode(postgres_engine: PostgresConnection, batch_size: int
     return df
 
 
+def count_address_clusters(postgres_engine: PostgresConnection, missing_only: bool = True) -> Dict[str, int]:
+    """
+    Geocoding calls the address clustering of get_encoded_addresses saves over the register
+
+    Args:
+        postgres_engine (PostgresConnection): connection to the database
+        missing_only (bool, optional): only the addresses not geocoded yet. Defaults to True.
+
+    Returns:
+        Dict[str, int]: sales, distinct address hashes and clusters, the calls made with clustering
+    """
+    source = "missing_geo_encoded_addresses" if missing_only else "residential_register"
+    with postgres_engine as conn:
+        df = pd.read_sql(f"SELECT address_hash, address, county FROM propeiredb.{source};", conn)
+
+    addresses = df.drop_duplicates("address_hash")
+    clusters = address_cluster_keys(addresses["address"], addresses["county"]).nunique()
+    counts = {"sales": len(df), "addresses": len(addresses), "clusters": clusters}
+    logging.info(
+        "{sales} sales, {addresses} distinct addresses in {clusters} clusters, "
+        "{saved} fewer geocoding calls".format(saved=counts["addresses"] - clusters, **counts)
+    )
+    return counts
+
+
 # -----------------------------------------------------------------------------
 # Transformation
 # -----------------------------------------------------------------------------
 
 
 def get_encoded_addresses(
-    df: pd.DataFrame, client: googlemaps.Client, region: Dict[str, Polygon]
+    df: pd.DataFrame,
+    client: googlemaps.Client,
+    region: Dict[str, BaseGeometry],
+    queries_per_second: float = 50,
+    max_workers: int = 8,
+    cache: GeocodeCache = None,
+    gazetteer: Gazetteer = None,
+    min_confidence: int = HIGH,
 ) -> List[GeoEncodedAddress]:
     """
     Takes addressses from the dataframe and encodes them using the googlemaps client
     Returns a list of GeoEncodedAddress objects
+
+    With a gazetteer, the addresses it places at min_confidence or better are taken from it offline
+    and only the rest go to the cache and the client
+
+    The addresses are geocoded concurrently by max_workers threads held to queries_per_second,
+    see utils/geocoder.py. With a cache, only the addresses it does not hold are sent to the client
+
+    Spelling variants of the same address are clustered by address_cluster_keys, one representative of each
+    cluster is geocoded and every member gets a copy of its result under its own address_hash
     """
     assert "address" in df.columns, "Address column not found in dataframe"
 
-    df = df.to_dict(orient="records")
-    encoded_addresses = []
-    for i in tqdm(df, total=len(df), desc="Encoding Addresses", unit="address", leave=False):
-        target_address = i["address"]
+    members = df.drop_duplicates("address_hash").reset_index(drop=True)
+    if "county" in members.columns:
+        cluster_keys = address_cluster_keys(members["address"], members["county"])
+    else:
+        cluster_keys = normalize_addresses(members["address"])
+    df = members[~cluster_keys.duplicated()].to_dict(orient="records")
+    logging.info(f"{len(members)} addresses in {len(df)} clusters to geocode")
 
+    target_addresses = []
+    for i in df:
+        target_address = i["address"]
         if "ireland" not in target_address.lower():
             target_address += ", Ireland"
-        try:
-            geo_encoded_address = encode_address(target_address, client)
-        except ValueError:
+        target_addresses.append(target_address)
+
+    results = []
+    misses = list(range(len(df)))
+    if gazetteer is not None:
+        for i in misses:
+            match = gazetteer.resolve(df[i]["address"], df[i].get("county"), df[i].get("postal_code"))
+            if match is not None and match.confidence >= min_confidence:
+                geo_encoded_address = GeoEncodedAddress(
+                    input_address=target_addresses[i],
+                    output_address=match.name,
+                    lat=match.lat,
+                    lon=match.lon,
+                    geocoder="gazetteer",
+                    confidence=CONFIDENCE_NAMES[match.confidence],
+                )
+                results.append((i, geo_encoded_address))
+        resolved = {i for i, _ in results}
+        misses = [i for i in misses if i not in resolved]
+        logging.info(f"{len(resolved)} addresses placed by the gazetteer, {len(misses)} left to geocode")
+
+    if cache is not None:
+        cached = cache.get_many([target_addresses[i] for i in misses])
+        for j, (_, response) in cached.items():
+            if response:
+                results.append((misses[j], parse_geocode_response(target_addresses[misses[j]], response)))
+        misses = [i for j, i in enumerate(misses) if j not in cached]
+        logging.info(f"{len(cached)} addresses answered by the geocode cache, {len(misses)} to geocode")
+
+    geocoder = ConcurrentGeocoder(
+        # misses are looked up again as an earlier thread may have cached a variant of the same address
+        functools.partial(encode_address, client=client, cache=cache, record_stats=False),
+        queries_per_second=queries_per_second,
+        max_workers=max_workers,
+        on_failure=cache.set_failed if cache is not None else None,
+    )
+    geocoded = ((misses[i], result) for i, result in geocoder.geocode_many(target_addresses[i] for i in misses))
+
+    encoded_addresses = {}
+    for i, geo_encoded_address in tqdm(
+        itertools.chain(results, geocoded), total=len(df), desc="Encoding Addresses", unit="address", leave=False
+    ):
+        if geo_encoded_address is None:
             continue
 
-        geo_encoded_address.input_address = i["address"]
-        geo_encoded_address.address_hash = i["address_hash"]
-        geo_encoded_address.region = assign_region(geo_encoded_address.lon, geo_encoded_address.lat, region)
-        encoded_addresses.append(geo_encoded_address)
-
-    return encoded_addresses
+        geo_encoded_address.input_address = df[i]["address"]
+        geo_encoded_address.address_hash = df[i]["address_hash"]
+        encoded_addresses[i] = geo_encoded_address
+    encoded_addresses = [encoded_addresses[i] for i in sorted(encoded_addresses)]
+
+    # region, county and province of the whole batch in one pass
+    joined = spatial_join(
+        [i.lon for i in encoded_addresses], [i.lat for i in encoded_addresses], boundary_indexes(region)
+    )
+    for column, areas in joined.items():
+        for geo_encoded_address, area in zip(encoded_addresses, areas):
+            setattr(geo_encoded_address, column, area)
+
+    # every member of a cluster takes the result of its representative
+    cluster_of = dict(zip(members["address_hash"], cluster_keys))
+    by_cluster = {cluster_of[i.address_hash]: i for i in encoded_addresses}
+    return [
+        dataclasses.replace(by_cluster[key], input_address=address, address_hash=address_hash)
+        for address, address_hash, key in zip(members["address"], members["address_hash"], cluster_keys)
+        if key in by_cluster
+    ]
 
 
 # -----------------------------------------------------------------------------
 # Upload
 # -----------------------------------------------------------------------------
 
+_END = object()
+
+
+def prefetch(items: Iterable[Any], maxsize: int = 2) -> Iterator[Any]:
+    """
+    Iterates items on a background thread at most maxsize items ahead of the consumer, so the stages of a pipeline
+    run at the same time while holding a bounded amount of work. An error of the producer is raised in the consumer,
+    and a consumer stopping early stops the producer once its current item is done
+
+    Args:
+        items (Iterable[Any]): items to produce, ie. a generator doing I/O
+        maxsize (int, optional): items buffered between the threads. Defaults to 2.
+
+    Yields:
+        Any: the items in order
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put((True, item)):
+                    return
+            put((True, _END))
+        except BaseException as e:  # pylint: disable=broad-except
+            put((False, e))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    producer = threading.Thread(target=produce, name="geocode-pipeline", daemon=True)
+    producer.start()
+    try:
+        while True:
+            produced, item = buffer.get()
+            if not produced:
+                raise item
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def claim_pages(
+    postgres_engine: PostgresConnection,
+    batch_size: int,
+    page_size: int,
+    worker: str,
+    lease_seconds: int = 3600,
+    max_attempts: int = 3,
+    schema_name: str = "propeiredb",
+    claimed: List[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Claims up to batch_size addresses from the geocode queue page_size at a time, a page is only claimed when the
+    pipeline is ready for it so its lease starts when its geocoding is near
+
+    Args:
+        claimed (List[str], optional): collects the address hashes claimed. Defaults to None.
+
+    Yields:
+        pd.DataFrame: pages of claimed addresses
+    """
+    remaining = batch_size
+    while remaining > 0:
+        page = claim_addresses(
+            postgres_engine, min(page_size, remaining), worker, lease_seconds, max_attempts, schema_name
+        )
+        if len(page) == 0:
+            return
+        if claimed is not None:
+            claimed.extend(page["address_hash"])
+        remaining -= len(page)
+        yield page
+
 
 def encode_and_upload_missing_addresses(
     postgres_engine: PostgresConnection,
     client: googlemaps.Client,
-    region: Dict[str, Polygon] = generate_region_points(DUBLIN_GEOJSON),
+    region: Dict[str, BaseGeometry] = None,
     batch_size: int = 40_000,
     schema_name: str = "propeiredb",
     table_name: str = "geo_encoding_lookup",
-) -> None:
+    queries_per_second: float = 50,
+    max_workers: int = 8,
+    cache: GeocodeCache = None,
+    lease_seconds: int = 3600,
+    max_attempts: int = 3,
+    page_size: int = 500,
+    flush_size: int = 100,
+    gazetteer: Gazetteer = None,
+    min_confidence: int = HIGH,
+    claim_connection: PostgresConnection = None,
+) -> pd.DataFrame:
     """
     Encodes and uploads missing addresses to the database
+
+    The batch is claimed from the geocode_queue so several geocoders can run at once, the geocoded addresses
+    leave the queue once uploaded and the ones not found are claimed again after lease_seconds, up to max_attempts
+
+    Claiming, geocoding and uploading run as a pipeline: pages of page_size addresses are claimed on one thread,
+    geocoded on another and flushed to the lookup flush_size rows at a time as they come out, with at most two pages
+    waiting between the stages. Memory stays flat over the batch and a failure only loses the pages in flight,
+    which are handed back to the queue
+
+    The claiming thread runs its statements on claim_connection, a psycopg2 connection holds one transaction at a
+    time so a claim committed on the connection of the uploads would commit a half done upsert
+
+    Args:
+        claim_connection (PostgresConnection, optional): connection of the claiming thread. Defaults to None, a
+            connection to the database of postgres_engine opened and closed by the call.
+
+    Returns:
+        pd.DataFrame: the uploaded addresses, with the region, county and province each was assigned
     """
+    assert isinstance(batch_size, int) and batch_size > 0, "Batch size must be a positive integer"
     logging.info("Starting to encode and upload missing addresses")
-    df = get_addresses_to_encode(postgres_engine, batch_size)
-    logging.info(f"Extracted {len(df)} addresses to encode")
-    encoded_addresses = get_encoded_addresses(df, client, region)
-    logging.info(f"Encoded {len(encoded_addresses)} addresses")
-    encoded_addresses = pd.DataFrame(encoded_addresses)
+    worker = worker_name()
+    claimed, completed, uploaded = [], set(), []
+
+    def encode_pages(pages: Iterable[pd.DataFrame]) -> Iterator[List[GeoEncodedAddress]]:
+        for page in pages:
+            yield get_encoded_addresses(
+                page, client, region, queries_per_second, max_workers, cache, gazetteer, min_confidence
+            )
+
+    def flush(rows: List[GeoEncodedAddress]):
+        df = pd.DataFrame(rows)
+        with postgres_engine as conn:
+            upsert = PandaSqlPlus(conn)
+            upsert.upsert_dataframe(df=df, schema_name=schema_name, table_name=table_name, update_rows=True)
+        complete_addresses(postgres_engine, df["address_hash"], worker, schema_name)
+        completed.update(df["address_hash"])
+        uploaded.append(df)
+        logging.info(f"Uploaded {sum(len(i) for i in uploaded)} addresses of {len(claimed)} claimed")
+
+    own_claim_connection = claim_connection is None
+    if own_claim_connection:
+        claim_connection = clone_postgres_connection(postgres_engine)
+    pages = claim_pages(
+        claim_connection, batch_size, page_size, worker, lease_seconds, max_attempts, schema_name, claimed
+    )
+    stages = prefetch(encode_pages(prefetch(pages)))
+    try:
+        pending = []
+        for encoded_addresses in stages:
+            pending.extend(encoded_addresses)
+            while len(pending) >= flush_size:
+                flush(pending[:flush_size])
+                pending = pending[flush_size:]
+        if len(pending) > 0:
+            flush(pending)
+    except BaseException:
+        # the claiming and geocoding threads are stopped first so no claim lands after the release
+        stages.close()
+        release_addresses(postgres_engine, [i for i in claimed if i not in completed], worker, schema_name)
+        raise
+    finally:
+        if own_claim_connection:
+            claim_connection.close()
+
+    logging.info(f"Uploaded {len(completed)} addresses of {len(claimed)} claimed to the database")
+    return pd.concat(uploaded, ignore_index=True) if len(uploaded) > 0 else pd.DataFrame()
 
-    with postgres_engine as conn:
-        upsert = PandaSqlPlus(conn)
-        upsert.upsert_dataframe(df=encoded_addresses, schema_name=schema_name, table_name=table_name, update_rows=True)
 
-    logging.info(f"Uploaded {len(encoded_addresses)} addresses to the database")
+# -----------------------------------------------------------------------------
+# Region Re-assignment
+# -----------------------------------------------------------------------------
+
+
+def reassign_regions(
+    postgres_engine: PostgresConnection,
+    region: Dict[str, BaseGeometry] = None,
+    chunk_size: int = 50_000,
+    schema_name: str = "propeiredb",
+    table_name: str = "geo_encoding_lookup",
+) -> Dict[str, int]:
+    """
+    Assigns the Dublin region, county and province of every geocoded address again from its coordinates, for when
+    the boundaries or their naming change. The table is read in chunks ordered by address_hash, each starting after
+    the last hash of the one before, and only the rows where any of the three changed are written back
+
+    Args:
+        postgres_engine (PostgresConnection): connection to the database
+        region (Dict[str, BaseGeometry], optional): Dublin regions to use instead of the Dublin geojson.
+            Defaults to None.
+        chunk_size (int, optional): rows read per query. Defaults to 50_000.
+        schema_name (str, optional): schema of the lookup. Defaults to "propeiredb".
+        table_name (str, optional): geocoded addresses. Defaults to "geo_encoding_lookup".
+
+    Returns:
+        Dict[str, int]: rows read, rows changed and the changes of each column
+    """
+    assert isinstance(chunk_size, int) and chunk_size > 0, "Chunk size must be a positive integer"
+    indexes = boundary_indexes(region)
+    columns = list(indexes)
+    table = sql.Identifier(schema_name, table_name)
+    select = sql.SQL(
+        """
+        SELECT address_hash, lat::float8, lon::float8, {columns}
+        FROM {table}
+        WHERE address_hash > %s
+        ORDER BY address_hash
+        LIMIT %s;
+        """
+    ).format(table=table, columns=sql.SQL(", ").join(map(sql.Identifier, columns)))
+    update = sql.SQL(
+        """
+        UPDATE {table} AS lookup SET {assignments}
+        FROM (VALUES %s) AS changed (address_hash, {columns})
+        WHERE lookup.address_hash = changed.address_hash;
+        """
+    ).format(
+        table=table,
+        assignments=sql.SQL(", ").join(sql.SQL("{0} = changed.{0}").format(sql.Identifier(i)) for i in columns),
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+    template = "(%s" + ", %s::text" * len(columns) + ")"
+
+    counts = {"rows": 0, "changed": 0, **{column: 0 for column in columns}}
+    last_hash = ""
+    with postgres_engine.cursor() as cursor:
+        while True:
+            cursor.execute(select, (last_hash, chunk_size))
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            last_hash = rows[-1][0]
+
+            address_hash, lat, lon, *current = zip(*rows)
+            joined = spatial_join(np.array(lon, dtype=float), np.array(lat, dtype=float), indexes)
+
+            differs = {column: np.array(current[i], dtype=object) != joined[column] for i, column in enumerate(columns)}
+            changed_rows = np.flatnonzero(np.logical_or.reduce(list(differs.values())))
+            changed = [(address_hash[i], *(joined[column][i] for column in columns)) for i in changed_rows]
+            if changed:
+                execute_values(cursor, update.as_string(cursor), changed, template=template, page_size=10_000)
+            postgres_engine.commit()
+
+            counts["rows"] += len(rows)
+            counts["changed"] += len(changed)
+            for column in columns:
+                counts[column] += int(differs[column].sum())
+            logging.info(f"Re-assigned {counts['rows']} rows, {counts['changed']} changed")
+
+    return counts
+
+
+def count_county_mismatches(postgres_engine: PostgresConnection, schema_name: str = "propeiredb") -> int:
+    """
+    Sales whose PPR county disagrees with the county of their geocoded location, see the geo_county_mismatch view
+    """
+    with postgres_engine.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(schema_name, "geo_county_mismatch")))
+        return cursor.fetchone()[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""
+    @about: Persistent SQLite cache of the raw geocoder responses keyed by the normalized address, with the addresses
+    nothing was found for and the ones that failed kept for a shorter time so they are not looked up on every run
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from .address_normalization import normalize_address
+
+log = logging.getLogger(__name__)
+
+GEOCODE_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data/cache/geocode_cache.sqlite"
+)
+
+DAY = 60 * 60 * 24
+
+# Status of a cached lookup
+FOUND = "found"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+
+
+class GeocodeCache(object):
+    """
+    Responses of the geocoder by normalized address. A found response is kept for ttl seconds, an empty one for
+    not_found_ttl and a lookup that kept failing for failed_ttl, after which the address is looked up again.
+    One connection is shared by the geocoder threads behind a lock, the writes are small and WAL keeps readers
+    in other processes going
+    """
+
+    def __init__(
+        self,
+        path: str = GEOCODE_CACHE_PATH,
+        ttl: int = 365 * DAY,
+        not_found_ttl: int = 90 * DAY,
+        failed_ttl: int = 1 * DAY,
+    ):
+        """
+        Args:
+            path (str, optional): sqlite file. Defaults to GEOCODE_CACHE_PATH.
+            ttl (int, optional): seconds a found response is kept. Defaults to a year.
+            not_found_ttl (int, optional): seconds an empty response is kept. Defaults to 90 days.
+            failed_ttl (int, optional): seconds a failed lookup is skipped. Defaults to a day.
+        """
+        self.path = path
+        self.ttls = {FOUND: ttl, NOT_FOUND: not_found_ttl, FAILED: failed_ttl}
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                key TEXT PRIMARY KEY,
+                address TEXT NOT NULL,
+                status TEXT NOT NULL,
+                response TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, address: str, record_stats: bool = True) -> typing.Tuple[bool, typing.Optional[typing.List[typing.Dict[str, typing.Any]]]]:
+        """
+        Cached response of an address
+
+        Args:
+            address (str): address as sent to the geocoder
+            record_stats (bool, optional): count the lookup in stats. Defaults to True.
+
+        Returns:
+            typing.Tuple[bool, typing.Optional[typing.List[typing.Dict[str, typing.Any]]]]: whether it was cached
+                and the response, an empty list when nothing was found and None when the lookup failed
+        """
+        return self.get_many([address], record_stats).get(0, (False, None))
+
+    def get_many(
+        self, addresses: typing.Sequence[str], record_stats: bool = True
+    ) -> typing.Dict[int, typing.Tuple[bool, typing.Optional[typing.List[typing.Dict[str, typing.Any]]]]]:
+        """
+        Cached responses of many addresses in one query per thousand addresses
+
+        Args:
+            addresses (typing.Sequence[str]): addresses as sent to the geocoder
+            record_stats (bool, optional): count the lookups in stats. Defaults to True.
+
+        Returns:
+            typing.Dict[int, typing.Tuple]: position of every cached address to (True, response) as given by get
+        """
+        keys = [normalize_address(i) for i in addresses]
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 1000):
+                chunk = list(set(keys[start : start + 1000]))
+                rows = self._connection.execute(
+                    f"""
+                    SELECT key, status, response FROM geocode_cache
+                    WHERE key IN ({", ".join("?" * len(chunk))}) and expires_at > ?
+                    """,
+                    (*chunk, now),
+                ).fetchall()
+                found.update({key: (status, response) for key, status, response in rows})
+
+        results = {}
+        for i, key in enumerate(keys):
+            if key not in found:
+                continue
+            status, response = found[key]
+            if status == FOUND:
+                results[i] = (True, json.loads(response))
+            else:
+                results[i] = (True, [] if status == NOT_FOUND else None)
+
+        if not record_stats:
+            return results
+        negative = sum(1 for _, response in results.values() if not response)
+        with self._lock:
+            self.stats["hits"] += len(results) - negative
+            self.stats["negative_hits"] += negative
+            self.stats["misses"] += len(keys) - len(results)
+        return results
+
+    def _put(self, address: str, status: str, response: typing.Optional[str]):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT INTO geocode_cache (key, address, status, response, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    address = excluded.address,
+                    status = excluded.status,
+                    response = excluded.response,
+                    created_at = excluded.created_at,
+                    expires_at = excluded.expires_at
+                """,
+                (normalize_address(address), address, status, response, now, now + self.ttls[status]),
+            )
+
+    def set(self, address: str, response: typing.List[typing.Dict[str, typing.Any]]):
+        """
+        Stores the raw response of the geocoder, an empty response as not found
+        """
+        if len(response) == 0:
+            self._put(address, NOT_FOUND, None)
+        else:
+            self._put(address, FOUND, json.dumps(response))
+
+    def set_failed(self, address: str, error: Exception = None):
+        """
+        Skips an address that kept failing until failed_ttl has passed
+        """
+        self._put(address, FAILED, json.dumps({"error": str(error)}) if error is not None else None)
+
+    def purge_expired(self) -> int:
+        """
+        Deletes the expired entries
+
+        Returns:
+            int: entries deleted
+        """
+        with self._lock:
+            return self._connection.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+if __name__ == "__main__":
+    pass
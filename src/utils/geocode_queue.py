@@ -0,0 +1,214 @@
+"""
+    @about: Work queue of the addresses to geocode. The pipeline queues the addresses of every load that are not in
+    geo_encoding_lookup, and each geocoder claims batches with FOR UPDATE SKIP LOCKED under a lease so several can run
+    side by side, a batch whose geocoder died is claimed again once its lease runs out
+"""
+import logging
+import os
+import socket
+import typing
+
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extensions import connection as PostgresConnection
+from psycopg2.extras import execute_values
+
+log = logging.getLogger(__name__)
+
+QUEUE_COLUMNS = ["address_hash", "address", "county", "postal_code"]
+
+
+def worker_name() -> str:
+    """
+    Name a geocoder leases its batches under, host and pid
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_addresses(
+    pg_connection: PostgresConnection,
+    df: pd.DataFrame,
+    schema_name: str = "propeiredb",
+    table_name: str = "geocode_queue",
+) -> int:
+    """
+    Queues the addresses of a load that are neither geocoded nor queued already
+
+    Args:
+        pg_connection (PostgresConnection): connection to the database
+        df (pd.DataFrame): rows with address_hash, address, county and postal_code, ie. a processed PPR file
+
+    Returns:
+        int: addresses queued
+    """
+    rows = df[QUEUE_COLUMNS].drop_duplicates("address_hash")
+    rows = rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)
+    query = sql.SQL(
+        """
+        INSERT INTO {queue} (address_hash, address, county, postal_code)
+        SELECT v.address_hash, v.address, v.county, v.postal_code
+        FROM (VALUES %s) AS v (address_hash, address, county, postal_code)
+        WHERE NOT EXISTS (SELECT 1 FROM {lookup} AS lookup WHERE lookup.address_hash = v.address_hash)
+        ON CONFLICT (address_hash) DO NOTHING
+        RETURNING 1;
+        """
+    ).format(queue=sql.Identifier(schema_name, table_name), lookup=sql.Identifier(schema_name, "geo_encoding_lookup"))
+
+    with pg_connection.cursor() as cursor:
+        queued = len(execute_values(cursor, query.as_string(cursor), list(rows), page_size=10_000, fetch=True))
+    pg_connection.commit()
+
+    log.info(f"{queued} addresses queued for geocoding")
+    return queued
+
+
+def enqueue_missing_addresses(
+    pg_connection: PostgresConnection, schema_name: str = "propeiredb", table_name: str = "geocode_queue"
+) -> int:
+    """
+    Queues every address of the register missing from geo_encoding_lookup, one full anti-join for a queue that was
+    emptied or never filled
+
+    Returns:
+        int: addresses queued
+    """
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            sql.SQL(
+                """
+                INSERT INTO {queue} (address_hash, address, county, postal_code)
+                SELECT DISTINCT ON (address_hash) address_hash, address, county, postal_code
+                FROM {missing}
+                ORDER BY address_hash, sale_date
+                ON CONFLICT (address_hash) DO NOTHING;
+                """
+            ).format(
+                queue=sql.Identifier(schema_name, table_name),
+                missing=sql.Identifier(schema_name, "missing_geo_encoded_addresses"),
+            )
+        )
+        queued = cursor.rowcount
+    pg_connection.commit()
+
+    log.info(f"{queued} addresses queued for geocoding")
+    return queued
+
+
+def claim_addresses(
+    pg_connection: PostgresConnection,
+    batch_size: int = 100,
+    worker: str = None,
+    lease_seconds: int = 3600,
+    max_attempts: int = 3,
+    schema_name: str = "propeiredb",
+    table_name: str = "geocode_queue",
+) -> pd.DataFrame:
+    """
+    Leases a batch of the oldest queued addresses that no other geocoder holds. Rows locked by a concurrent claim
+    are skipped rather than waited on, and the lease is committed before returning so the other geocoders see it
+
+    Args:
+        pg_connection (PostgresConnection): connection to the database
+        batch_size (int, optional): addresses to claim. Defaults to 100.
+        worker (str, optional): name the lease is held under. Defaults to None, worker_name().
+        lease_seconds (int, optional): seconds before an unfinished batch can be claimed again. Defaults to 3600.
+        max_attempts (int, optional): claims of an address before it is left in the queue for good, the
+            addresses the geocoder never finds. Defaults to 3.
+
+    Returns:
+        pd.DataFrame: address_hash, address, county and postal_code of the claimed addresses
+    """
+    assert isinstance(batch_size, int), "Batch size must be an integer"
+    assert batch_size > 0, "Batch size must be greater than 0"
+    queue = sql.Identifier(schema_name, table_name)
+
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            sql.SQL(
+                """
+                UPDATE {queue} AS queue
+                SET leased_by = %(worker)s,
+                    leased_until = now() + make_interval(secs => %(lease_seconds)s),
+                    attempts = queue.attempts + 1
+                FROM (
+                    SELECT address_hash
+                    FROM {queue}
+                    WHERE attempts < %(max_attempts)s and (leased_until IS NULL or leased_until < now())
+                    ORDER BY enqueued_at
+                    LIMIT %(batch_size)s
+                    FOR UPDATE SKIP LOCKED
+                ) AS claimed
+                WHERE queue.address_hash = claimed.address_hash
+                RETURNING queue.address_hash, queue.address, queue.county, queue.postal_code;
+                """
+            ).format(queue=queue),
+            {
+                "worker": worker or worker_name(),
+                "lease_seconds": lease_seconds,
+                "max_attempts": max_attempts,
+                "batch_size": batch_size,
+            },
+        )
+        df = pd.DataFrame(cursor.fetchall(), columns=QUEUE_COLUMNS)
+    pg_connection.commit()
+
+    return df
+
+
+def complete_addresses(
+    pg_connection: PostgresConnection,
+    address_hashes: typing.Iterable[str],
+    worker: str = None,
+    schema_name: str = "propeiredb",
+    table_name: str = "geocode_queue",
+) -> int:
+    """
+    Removes geocoded addresses from the queue, only while the worker still holds their lease
+
+    Returns:
+        int: addresses removed
+    """
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            sql.SQL("DELETE FROM {} WHERE address_hash = ANY(%s) and leased_by = %s;").format(
+                sql.Identifier(schema_name, table_name)
+            ),
+            (list(address_hashes), worker or worker_name()),
+        )
+        completed = cursor.rowcount
+    pg_connection.commit()
+
+    return completed
+
+
+def release_addresses(
+    pg_connection: PostgresConnection,
+    address_hashes: typing.Iterable[str],
+    worker: str = None,
+    schema_name: str = "propeiredb",
+    table_name: str = "geocode_queue",
+) -> int:
+    """
+    Hands the leased addresses of a worker back to the queue straight away, for a geocoder stopping early
+
+    Returns:
+        int: addresses released
+    """
+    with pg_connection.cursor() as cursor:
+        cursor.execute(
+            sql.SQL(
+                """
+                UPDATE {} SET leased_by = NULL, leased_until = NULL
+                WHERE address_hash = ANY(%s) and leased_by = %s;
+                """
+            ).format(sql.Identifier(schema_name, table_name)),
+            (list(address_hashes), worker or worker_name()),
+        )
+        released = cursor.rowcount
+    pg_connection.commit()
+
+    return released
+
+
+if __name__ == "__main__":
+    pass
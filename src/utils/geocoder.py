@@ -0,0 +1,180 @@
+"""
+    @about: Geocodes addresses on a thread pool, held to the API quota by a token bucket and retried with jittered
+    backoff on quota and transient errors
+"""
+import logging
+import random
+import threading
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import googlemaps
+
+log = logging.getLogger(__name__)
+
+# Statuses of googlemaps.exceptions.ApiError worth retrying, the rest fail the same way every time
+RETRIABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+def is_retriable(error: Exception) -> bool:
+    """
+    Quota errors, 5xx responses the client gave up on and connection errors are retried
+    """
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status in RETRIABLE_STATUSES
+    return isinstance(error, (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout))
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket, rate tokens are added per second up to capacity and every request takes one
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        """
+        Args:
+            rate (float): requests per second
+            capacity (float, optional): burst allowed after an idle spell. Defaults to 1, requests evenly spaced
+                so no one second window goes over the rate.
+        """
+        assert rate > 0, "Rate must be greater than 0"
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until a token is free
+
+        Returns:
+            float: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ConcurrentGeocoder(object):
+    """
+    Runs a geocode function over many addresses from a thread pool. The token bucket keeps the requests
+    under the quota whatever the number of threads, and at most max_in_flight addresses are queued
+    so a large batch is not held in memory as futures
+    """
+
+    def __init__(
+        self,
+        encode: typing.Callable[[str], typing.Any],
+        queries_per_second: float = 50,
+        max_workers: int = 8,
+        max_in_flight: int = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        on_failure: typing.Callable[[str, Exception], None] = None,
+    ):
+        """
+        Args:
+            encode (typing.Callable[[str], typing.Any]): geocodes one address, raises ValueError when nothing is found
+            queries_per_second (float, optional): quota of the API. Defaults to 50.
+            max_workers (int, optional): threads waiting on the API. Defaults to 8.
+            max_in_flight (int, optional): addresses submitted but not done. Defaults to None, twice max_workers.
+            max_retries (int, optional): retries of a retriable error before giving up on an address. Defaults to 5.
+            backoff_base (float, optional): seconds of the first backoff, doubled on every retry. Defaults to 0.5.
+            backoff_max (float, optional): longest backoff in seconds. Defaults to 30.0.
+            on_failure (typing.Callable[[str, Exception], None], optional): called with an address given up on
+                and its last error. Defaults to None.
+        """
+        self.encode = encode
+        self.bucket = TokenBucket(queries_per_second)
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers * 2
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_failure = on_failure
+        self.stats = {"requests": 0, "retries": 0, "not_found": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat: str):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full jitter backoff, spreads the retries of the threads hitting the quota at the same moment
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def geocode(self, address: str) -> typing.Any:
+        """
+        Geocodes an address within the quota, retrying quota and transient errors
+
+        Args:
+            address (str): address to geocode
+
+        Returns:
+            typing.Any: result of encode, None when nothing was found or the address failed
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count("requests")
+            try:
+                return self.encode(address)
+            except ValueError:
+                self._count("not_found")
+                return None
+            except Exception as e:  # pylint: disable=broad-except
+                if not is_retriable(e) or attempt == self.max_retries:
+                    log.warning(f"could not geocode {address!r}: {e}")
+                    self._count("failed")
+                    if self.on_failure is not None:
+                        self.on_failure(address, e)
+                    return None
+                self._count("retries")
+                time.sleep(self.backoff(attempt))
+
+    def geocode_many(self, addresses: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+        """
+        Geocodes the addresses concurrently, results come back in the order they finish
+
+        Args:
+            addresses (typing.Iterable[str]): addresses to geocode
+
+        Yields:
+            typing.Tuple[int, typing.Any]: position of the address and its result, None when it was not found or failed
+        """
+
+        def run(i: int, address: str) -> typing.Tuple[int, typing.Any]:
+            return i, self.geocode(address)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="geocoder") as pool:
+            pending: typing.Set[Future] = set()
+            for i, address in enumerate(addresses):
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(run, i, address))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        log.info("geocoder: {requests} requests, {retries} retries, {not_found} not found, {failed} failed".format(**self.stats))
+
+
+if __name__ == "__main__":
+    pass
@@ -1,9 +1,23 @@
 """
     @about: Generates clean geojson files
 """
+import functools
+import hashlib
 import json
+import logging
+import math
 import os
-from typing import Dict
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+from shapely.geometry.base import BaseGeometry
+
+from .region_index import region_polygons
+
+log = logging.getLogger(__name__)
 
 
 # ----------------------------------------------------------------------
@@ -101,17 +115,302 @@ def cleanse_province_geojson(geofile: str) -> Dict:
     return province_geojson
 
 
+# ----------------------------------------------------------------------
+# Simplified artifacts for the choropleth maps
+# ----------------------------------------------------------------------
+def simplify_geojson(geojson: Dict, tolerance: float) -> Dict:
+    """
+    Simplifies the geometries of a cleansed geojson for drawing, parts smaller than a tolerance square are dropped,
+    boundaries are simplified preserving topology and the coordinates are quantized to the tolerance
+
+    Args:
+        geojson (Dict): cleansed geojson
+        tolerance (float): simplification tolerance in degrees
+
+    Returns:
+        Dict: geojson with only the id kept in the properties
+    """
+    decimals = int(math.ceil(-math.log10(tolerance))) + 1
+    geometries = [shapely.make_valid(shape(i["geometry"])) for i in geojson["features"]]
+
+    # Removes islands and rocks that would not show at this tolerance, always keeps the largest part
+    cleaned = []
+    for geometry in geometries:
+        parts = shapely.get_parts(geometry)
+        areas = shapely.area(parts)
+        keep = (areas >= tolerance**2) | (areas == areas.max())
+        cleaned.append(shapely.multipolygons(parts[keep]) if keep.sum() > 1 else parts[keep][0])
+
+    # Coverage simplification keeps shared borders between areas in line, needs shapely >= 2.1
+    if hasattr(shapely, "coverage_simplify"):
+        simplified = shapely.coverage_simplify(cleaned, tolerance)
+    else:
+        simplified = shapely.simplify(cleaned, tolerance, preserve_topology=True)
+
+    features = []
+    for feature, geometry in zip(geojson["features"], simplified):
+        geometry = shapely.transform(geometry, lambda coords: np.round(coords, decimals))
+        features.append(
+            {
+                "type": "Feature",
+                "id": feature["id"],
+                "properties": {"id": feature["properties"]["id"]},
+                "geometry": mapping(geometry),
+            }
+        )
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def build_geojson_artifacts(output_directory: str = None, levels: Dict[str, float] = None) -> Dict[str, int]:
+    """
+    Writes the simplified geojson of every map at every level of detail, artifacts are named {map}_{level}.json
+
+    Args:
+        output_directory (str, optional): folder to write to. Defaults to SIMPLIFIED_GEOJSON_DIRECTORY.
+        levels (Dict[str, float], optional): level name to tolerance. Defaults to GEOJSON_LEVELS.
+
+    Returns:
+        Dict[str, int]: file name to size in bytes
+    """
+    output_directory = output_directory or SIMPLIFIED_GEOJSON_DIRECTORY
+    levels = levels or GEOJSON_LEVELS
+    os.makedirs(output_directory, exist_ok=True)
+
+    sizes = {}
+    for name in GEOJSON_SOURCES:
+        geojson = full_geojson(name)
+        full_size = len(json.dumps(geojson, separators=(",", ":")))
+        for level, tolerance in levels.items():
+            file_name = f"{name}_{level}.json"
+            payload = json.dumps(simplify_geojson(geojson, tolerance), separators=(",", ":"))
+            with open(os.path.join(output_directory, file_name), "w", encoding="utf-8") as artifact:
+                artifact.write(payload)
+            sizes[file_name] = len(payload)
+            log.info(f"{file_name}: {full_size / 1024:.0f} KiB -> {len(payload) / 1024:.0f} KiB")
+
+    load_geojson_level.cache_clear()
+    return sizes
+
+
+def geojson_level_for_zoom(zoom: float, levels: Dict[str, float] = None) -> str:
+    """
+    Picks the coarsest level of detail whose tolerance is below a pixel at the given zoom,
+    GEOJSON_ZOOM_HEADROOM extra zoom levels are allowed for the user zooming in
+
+    Args:
+        zoom (float): mapbox zoom of the map
+        levels (Dict[str, float], optional): level name to tolerance. Defaults to GEOJSON_LEVELS.
+
+    Returns:
+        str: name of the level
+    """
+    levels = levels or GEOJSON_LEVELS
+    pixel_size = 360 / (256 * 2 ** (zoom + GEOJSON_ZOOM_HEADROOM))
+    ordered = sorted(levels.items(), key=lambda x: x[1], reverse=True)
+    for level, tolerance in ordered:
+        if tolerance <= pixel_size:
+            return level
+    return ordered[-1][0]
+
+
+@functools.lru_cache(maxsize=None)
+def load_geojson_level(name: str, level: str) -> Dict:
+    """
+    Loads a simplified geojson artifact, falls back to the full geojson if the artifact has not been built
+
+    Args:
+        name (str): dublin, county or province
+        level (str): level from GEOJSON_LEVELS
+
+    Returns:
+        Dict: geojson
+    """
+    file_path = os.path.join(SIMPLIFIED_GEOJSON_DIRECTORY, f"{name}_{level}.json")
+    if os.path.exists(file_path) is False:
+        log.warning(f"{file_path} not built, using the full geojson")
+        return full_geojson(name)
+
+    with open(file_path, encoding="utf-8") as artifact:
+        return json.load(artifact)
+
+
+# ----------------------------------------------------------------------
+# Compiled boundary geometries for the spatial joins
+# ----------------------------------------------------------------------
+def file_sha1(file_path: str) -> str:
+    """
+    Hex sha1 of a file, read in blocks of 1MB
+
+    Args:
+        file_path (str): file to hash
+
+    Returns:
+        str: sha1 of its content
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_atomically(file_path: str, content: bytes):
+    """
+    Writes a file aside and renames it over file_path so a process reading it never sees half of it
+    """
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(file_path), delete=False) as artifact:
+        artifact.write(content)
+    os.chmod(artifact.name, 0o644)
+    os.replace(artifact.name, file_path)
+
+
+def compile_boundary_geometries(name: str, output_directory: str = None) -> Dict[str, BaseGeometry]:
+    """
+    Cleanses a map once and writes the valid geometry of each feature to <name>.wkb, as the members of one
+    GeometryCollection in WKB, and a <name>.json sidecar with the feature ids and the size, mtime and hash of its
+    source so a changed geojson is compiled again
+
+    Args:
+        name (str): dublin, county or province
+        output_directory (str, optional): folder to write to. Defaults to COMPILED_GEOMETRY_DIRECTORY.
+
+    Returns:
+        Dict[str, BaseGeometry]: feature id to its geometry
+    """
+    output_directory = output_directory or COMPILED_GEOMETRY_DIRECTORY
+    _, file_path = GEOJSON_SOURCES[name]
+    stat = os.stat(file_path)
+    geometries = region_polygons(full_geojson(name))
+
+    wkb = shapely.to_wkb(shapely.GeometryCollection(list(geometries.values())))
+    sidecar = {
+        "version": COMPILED_GEOMETRY_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": file_sha1(file_path),
+        "wkb_sha1": hashlib.sha1(wkb).hexdigest(),
+        "names": list(geometries),
+    }
+    os.makedirs(output_directory, exist_ok=True)
+    # the sidecar goes last, a reader only takes a wkb file its sidecar vouches for
+    write_atomically(os.path.join(output_directory, f"{name}.wkb"), wkb)
+    write_atomically(os.path.join(output_directory, f"{name}.json"), json.dumps(sidecar).encode("utf-8"))
+
+    log.info(f"compiled {len(geometries)} {name} geometries to {output_directory}")
+    return geometries
+
+
+def read_compiled_geometries(name: str, output_directory: str = None) -> Optional[Dict[str, BaseGeometry]]:
+    """
+    Geometries of a compiled artifact, None when it is missing, from another version of the cleansing or its
+    source changed. A source only touched, ie. by a fresh checkout, is recognised by its hash
+
+    Args:
+        name (str): dublin, county or province
+        output_directory (str, optional): folder of the artifacts. Defaults to COMPILED_GEOMETRY_DIRECTORY.
+
+    Returns:
+        Optional[Dict[str, BaseGeometry]]: feature id to its geometry
+    """
+    output_directory = output_directory or COMPILED_GEOMETRY_DIRECTORY
+    _, file_path = GEOJSON_SOURCES[name]
+    try:
+        with open(os.path.join(output_directory, f"{name}.json"), encoding="utf-8") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        with open(os.path.join(output_directory, f"{name}.wkb"), "rb") as wkb_file:
+            wkb = wkb_file.read()
+    except (OSError, ValueError):
+        return None
+
+    if sidecar.get("version") != COMPILED_GEOMETRY_VERSION or sidecar.get("wkb_sha1") != hashlib.sha1(wkb).hexdigest():
+        return None
+    stat = os.stat(file_path)
+    if (sidecar["size"], sidecar["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        if sidecar["sha1"] != file_sha1(file_path):
+            return None
+
+    try:
+        collection = shapely.from_wkb(wkb)
+    except shapely.errors.GEOSException:
+        return None
+    return dict(zip(sidecar["names"], collection.geoms))
+
+
+@functools.lru_cache(maxsize=None)
+def boundary_geometries(name: str) -> Dict[str, BaseGeometry]:
+    """
+    Valid geometry of every feature of a map by its id, loaded on first use from the compiled artifact and
+    compiled from the geojson when the artifact is missing or stale
+
+    Args:
+        name (str): dublin, county or province
+
+    Returns:
+        Dict[str, BaseGeometry]: feature id to its geometry
+    """
+    geometries = read_compiled_geometries(name)
+    if geometries is not None:
+        return geometries
+
+    try:
+        return compile_boundary_geometries(name)
+    except OSError as e:
+        # a read only deployment still works, it only pays for the cleansing in every process
+        log.warning(f"could not write the compiled {name} geometries: {e}")
+        return region_polygons(full_geojson(name))
+
+
 # -----------------------------------------------------------------------------
 # Global Variables
 # -----------------------------------------------------------------------------
 base_directory = "/".join(list(os.path.dirname(os.path.abspath(__file__)).split("/")[0:-1]))
+root_directory = os.path.dirname(base_directory)
 dublin_geojson_path = os.path.join(base_directory, "assets/dublin_boundaries.json")
-province_geojson_path = os.path.join(base_directory, "assets/province_boundaries.json")
-county_geojson_path = os.path.join(base_directory, "assets/county_boundaries.json")
+province_geojson_path = os.path.join(root_directory, "data/GeoJSON/Province_Boundaries_Generalised_to_100m.geojson")
+county_geojson_path = os.path.join(
+    root_directory, "data/GeoJSON/County_Boundary_Generalised_100M__OSi_National_Statutory_Boundaries.geojson"
+)
+
+# Level of detail name to simplification tolerance in degrees
+GEOJSON_LEVELS = {"low": 0.01, "medium": 0.002, "high": 0.0005}
+GEOJSON_ZOOM_HEADROOM = 2
+SIMPLIFIED_GEOJSON_DIRECTORY = os.path.join(root_directory, "data/GeoJSON/simplified")
+
+# Compiled boundary geometries, bump the version when a cleansing function changes its output
+COMPILED_GEOMETRY_DIRECTORY = os.path.join(root_directory, "data/cache/geometry")
+COMPILED_GEOMETRY_VERSION = 2
+
+# Cleansing function and source file of each full geojson, parsed on first use by full_geojson
+GEOJSON_SOURCES = {
+    "dublin": (cleanse_dublin_geojson, dublin_geojson_path),
+    "county": (cleanse_county_geojson, county_geojson_path),
+    "province": (cleanse_province_geojson, province_geojson_path),
+}
+
+# Module attributes still served for the callers importing the full geojson by name
+GEOJSON_ATTRIBUTES = {"DUBLIN_GEOJSON": "dublin", "COUNTY_GEOJSON": "county", "PROVINCE_GEOJSON": "province"}
+
+
+@functools.lru_cache(maxsize=None)
+def full_geojson(name: str) -> Dict:
+    """
+    Parses and cleanses the full geojson of a map once per process
+
+    Args:
+        name (str): dublin, county or province
+
+    Returns:
+        Dict: geojson
+    """
+    cleanse, file_path = GEOJSON_SOURCES[name]
+    return cleanse(file_path)
+
 
-DUBLIN_GEOJSON = cleanse_dublin_geojson(dublin_geojson_path)
-PROVINCE_GEOJSON = cleanse_province_geojson(province_geojson_path)
-COUNTY_GEOJSON = cleanse_county_geojson(county_geojson_path)
+def __getattr__(name: str) -> Dict:
+    if name in GEOJSON_ATTRIBUTES:
+        return full_geojson(GEOJSON_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
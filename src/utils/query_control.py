@@ -0,0 +1,196 @@
+"""
+    @about: Runs the queries of a selection under a statement timeout, tagged with the browser session and selection in
+    application_name, and cancels the running queries of a session's older selections once it moves on to a new one
+"""
+import contextlib
+import contextvars
+import hashlib
+import logging
+import re
+import typing
+import uuid
+
+import flask
+from dash.exceptions import PreventUpdate
+from psycopg2.errors import QueryCanceled
+from redis import StrictRedis
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+log = logging.getLogger(__name__)
+
+# Cookie holding the session id, set on the first response to a browser
+SESSION_COOKIE = "propeiredb_session"
+SESSION_ID = re.compile(r"^[0-9a-f]{16}$")
+
+# application_name of the tagged queries is "propeiredb:<session>:<selection>:<query name>"
+APPLICATION_NAME = "propeiredb"
+LATEST_SELECTION_KEY = "propeiredb:session:{session}:selection"
+
+# Session of the work running outside of a request on behalf of one, ie. background callbacks
+_session = contextvars.ContextVar("query_session", default=None)
+
+
+class SelectionSuperseded(PreventUpdate):
+    """
+    A query of a selection the session has already moved on from, a PreventUpdate so the callback
+    running it ends without updating its outputs
+    """
+
+
+def new_session_id() -> str:
+    """
+    Random id of a browser session
+    """
+    return uuid.uuid4().hex[:16]
+
+
+def session_id() -> typing.Optional[str]:
+    """
+    Session of the request being served or set by use_session, None otherwise, ie. cache refreshes
+    and the cache warmer, whose queries are never cancelled
+    """
+    session = _session.get()
+    if session is None and flask.has_request_context():
+        session = flask.request.cookies.get(SESSION_COOKIE) or flask.g.get("session_id")
+    if session is None or not SESSION_ID.match(session):
+        return None
+    return session
+
+
+@contextlib.contextmanager
+def use_session(session: typing.Optional[str]) -> typing.Iterator[None]:
+    """
+    Runs the queries of the block on behalf of a session outside of its request
+    """
+    token = _session.set(session)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def selection_id(selection: typing.Tuple) -> str:
+    """
+    Short id of a selection as given by DataModel.selection
+    """
+    return hashlib.sha1(repr(selection).encode("utf-8")).hexdigest()[:12]
+
+
+class QueryControl(object):
+    """
+    Hands out connections for the queries of a selection. Each connection runs its transaction under
+    statement_timeout and application_name tags it with the session and selection, which is how the
+    queries of older selections are found in pg_stat_activity from any worker.
+
+    The latest selection of every session is kept in redis, a query of an older selection is not started
+    and a running one is cancelled with pg_cancel_backend, both raise SelectionSuperseded.
+    """
+
+    def __init__(self, db_engine: Engine, redis_connection: StrictRedis, statement_timeout: int = 30000, session_ttl: int = 3600):
+        """
+        Args:
+            db_engine (Engine): engine the queries run on
+            redis_connection (StrictRedis): redis holding the latest selection of each session
+            statement_timeout (int, optional): milliseconds a query may run, 0 for no limit. Defaults to 30000.
+            session_ttl (int, optional): seconds the latest selection of an idle session is kept. Defaults to 3600.
+        """
+        self.engine = db_engine
+        self.redis_connection = redis_connection
+        self.statement_timeout = statement_timeout
+        self.session_ttl = session_ttl
+
+    def _latest(self, session: str) -> typing.Optional[str]:
+        try:
+            latest = self.redis_connection.get(LATEST_SELECTION_KEY.format(session=session))
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not read the latest selection from redis: {e}")
+            return None
+        return latest.decode("utf-8") if latest is not None else None
+
+    def start_selection(self, selection: typing.Tuple) -> int:
+        """
+        Makes the selection the latest of the session of the request and cancels the queries still running
+        for its older selections
+
+        Args:
+            selection (typing.Tuple): as given by DataModel.selection
+
+        Returns:
+            int: queries cancelled
+        """
+        session = session_id()
+        if session is None:
+            return 0
+        selection = selection_id(selection)
+        try:
+            previous = self.redis_connection.getset(LATEST_SELECTION_KEY.format(session=session), selection)
+            self.redis_connection.expire(LATEST_SELECTION_KEY.format(session=session), self.session_ttl)
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not store the latest selection in redis: {e}")
+            return 0
+        if previous is None or previous.decode("utf-8") == selection:
+            return 0
+
+        with self.engine.connect() as conn:
+            cancelled = conn.execute(
+                text(
+                    """
+                    SELECT count(*) FILTER (WHERE pg_cancel_backend(pid))
+                    FROM pg_stat_activity
+                    WHERE application_name LIKE :session_tag
+                        and application_name NOT LIKE :selection_tag
+                        and state = 'active'
+                        and pid <> pg_backend_pid()
+                    """
+                ),
+                {
+                    "session_tag": f"{APPLICATION_NAME}:{session}:%",
+                    "selection_tag": f"{APPLICATION_NAME}:{session}:{selection}:%",
+                },
+            ).scalar()
+        if cancelled:
+            log.info(f"cancelled {cancelled} queries of session {session} superseded by selection {selection}")
+        return cancelled
+
+    @contextlib.contextmanager
+    def connect(self, selection: typing.Tuple, query_name: str) -> typing.Iterator[Connection]:
+        """
+        Connection for the queries of a selection, tagged and under the statement timeout until it is closed
+
+        Args:
+            selection (typing.Tuple): as given by DataModel.selection
+            query_name (str): name of the query for pg_stat_activity
+
+        Raises:
+            SelectionSuperseded: the session has moved on to another selection
+
+        Yields:
+            Connection: connection to run the queries on
+        """
+        session = session_id()
+        selection = selection_id(selection)
+        if session is not None and self._latest(session) not in (None, selection):
+            raise SelectionSuperseded(f"selection {selection} of session {session} is superseded")
+
+        tag = f"{APPLICATION_NAME}:{session or '-'}:{selection}:{query_name}"[:63]
+        with self.engine.connect() as conn:
+            # set_config with is_local only lasts for the transaction, the pooled connection is rolled back on close
+            conn.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true), set_config('application_name', :tag, true)"),
+                {"timeout": str(self.statement_timeout), "tag": tag},
+            )
+            try:
+                yield conn
+            except OperationalError as e:
+                if not isinstance(e.orig, QueryCanceled):
+                    raise
+                if session is not None and self._latest(session) not in (None, selection):
+                    raise SelectionSuperseded(f"{query_name} of session {session} cancelled by a newer selection") from e
+                log.warning(f"{query_name} cancelled after the statement timeout of {self.statement_timeout}ms")
+                raise
+
+
+if __name__ == "__main__":
+    pass
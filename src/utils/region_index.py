@@ -0,0 +1,161 @@
+"""
+    @about: Assigns points to the region containing them through an STRtree of prepared region geometries,
+    single points are looked up in the tree and whole arrays of lon/lat go through shapely.contains_xy
+"""
+import logging
+import time
+import typing
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+
+log = logging.getLogger(__name__)
+
+
+def region_polygons(geojson: typing.Dict[str, typing.Any]) -> typing.Dict[str, BaseGeometry]:
+    """
+    Polygon or MultiPolygon of every feature of a cleansed geojson by its id, with every part and hole kept
+
+    Args:
+        geojson (typing.Dict[str, typing.Any]): geojson with an id on every feature
+
+    Returns:
+        typing.Dict[str, BaseGeometry]: feature id to its geometry
+    """
+    polygons = {}
+    for feature in geojson["features"]:
+        geometry = shape(feature["geometry"])
+        if not geometry.is_valid:
+            geometry = shapely.make_valid(geometry)
+        polygons[feature["id"]] = geometry
+    return polygons
+
+
+class RegionIndex(object):
+    """
+    Index of the regions of a map. A point on a shared border or in an overlap goes to the region that comes
+    first in the mapping, the same answer as looping over the regions in order
+    """
+
+    def __init__(self, regions: typing.Dict[str, BaseGeometry]):
+        """
+        Args:
+            regions (typing.Dict[str, BaseGeometry]): region name to its polygon, ie. from generate_region_points
+        """
+        self.names = np.array(list(regions), dtype=object)
+        self.geometries = np.array(list(regions.values()), dtype=object)
+        shapely.prepare(self.geometries)
+        self.bounds = shapely.bounds(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def assign(self, lon: float, lat: float) -> typing.Optional[str]:
+        """
+        Region containing a point
+
+        Args:
+            lon (float): longitude
+            lat (float): latitude
+
+        Returns:
+            typing.Optional[str]: name of the region, None when the point is in none of them
+        """
+        matches = self.tree.query(shapely.Point(lon, lat), predicate="within")
+        if len(matches) == 0:
+            return None
+        return self.names[matches.min()]
+
+    def assign_many(self, lon: typing.Sequence[float], lat: typing.Sequence[float]) -> np.ndarray:
+        """
+        Regions containing each point, every region only tests the points inside its bounding box
+
+        Args:
+            lon (typing.Sequence[float]): longitudes
+            lat (typing.Sequence[float]): latitudes
+
+        Returns:
+            np.ndarray: object array of region names, None for the points in no region
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        assigned = np.full(len(lon), -1, dtype=np.int64)
+
+        for i, (geometry, (min_lon, min_lat, max_lon, max_lat)) in enumerate(zip(self.geometries, self.bounds)):
+            candidates = np.flatnonzero(
+                (assigned == -1) & (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+            )
+            if len(candidates) == 0:
+                continue
+            inside = shapely.contains_xy(geometry, lon[candidates], lat[candidates])
+            assigned[candidates[inside]] = i
+
+        regions = np.full(len(lon), None, dtype=object)
+        found = assigned >= 0
+        regions[found] = self.names[assigned[found]]
+        return regions
+
+
+def benchmark_region_assignment(
+    regions: typing.Dict[str, BaseGeometry], points: int = 1_000_000, loop_sample: int = 20_000, seed: int = 0
+) -> typing.Dict[str, float]:
+    """
+    Times the region assignment of uniform random points over the bounds of the regions, the point by point
+    polygon loop of assign_region is timed on a sample and scaled up as it takes minutes over a million points
+
+    Args:
+        regions (typing.Dict[str, BaseGeometry]): region name to its polygon
+        points (int, optional): points to assign. Defaults to 1_000_000.
+        loop_sample (int, optional): points timed for the loops over single points. Defaults to 20_000.
+        seed (int, optional): seed of the points. Defaults to 0.
+
+    Returns:
+        typing.Dict[str, float]: seconds per million points of each path
+    """
+    from utils.geo_encode_data import assign_region  # pylint: disable=import-outside-toplevel
+
+    start = time.perf_counter()
+    index = RegionIndex(regions)
+    build = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = shapely.total_bounds(index.geometries)
+    lon = rng.uniform(min_lon, max_lon, points)
+    lat = rng.uniform(min_lat, max_lat, points)
+    sample = min(loop_sample, points)
+
+    start = time.perf_counter()
+    looped = [assign_region(x, y, regions) for x, y in zip(lon[:sample], lat[:sample])]
+    loop = (time.perf_counter() - start) * 1_000_000 / sample
+
+    start = time.perf_counter()
+    queried = [index.assign(x, y) for x, y in zip(lon[:sample], lat[:sample])]
+    tree = (time.perf_counter() - start) * 1_000_000 / sample
+
+    start = time.perf_counter()
+    assigned = index.assign_many(lon, lat)
+    vectorized = (time.perf_counter() - start) * 1_000_000 / points
+
+    assert list(assigned[:sample]) == looped == queried, "region assignments differ between the paths"
+    results = {
+        "regions": len(index),
+        "points": points,
+        "assigned": int(np.count_nonzero(assigned != None)),  # noqa: E711
+        "build_s": build,
+        "loop_s_per_million": loop,
+        "strtree_s_per_million": tree,
+        "contains_xy_s_per_million": vectorized,
+    }
+    log.info(
+        "{regions} regions, {assigned:,} of {points:,} points assigned, index built in {build_s:.3f}s. "
+        "Seconds per million points: polygon loop {loop_s_per_million:.1f}, STRtree {strtree_s_per_million:.1f}, "
+        "contains_xy {contains_xy_s_per_million:.2f}".format(**results)
+    )
+    return results
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,74 @@
+"""
+    @about: Spatial join of geocoded coordinates against the Dublin region, county and province boundaries,
+    the columns of geo_encoding_lookup each boundary set fills
+"""
+import functools
+import logging
+import typing
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+
+from .geojson_map_cleanse import boundary_geometries
+from .region_index import RegionIndex
+
+log = logging.getLogger(__name__)
+
+# Column of geo_encoding_lookup to the geojson of the boundaries assigned into it
+SPATIAL_JOIN_COLUMNS = {"region": "dublin", "geo_county": "county", "geo_province": "province"}
+
+
+@functools.lru_cache(maxsize=None)
+def boundary_index(name: str) -> RegionIndex:
+    """
+    Index of the boundaries of a map, built once per process from the compiled geometries
+
+    Args:
+        name (str): dublin, county or province
+
+    Returns:
+        RegionIndex: index of the boundaries
+    """
+    return RegionIndex(boundary_geometries(name))
+
+
+def boundary_indexes(region: typing.Dict[str, BaseGeometry] = None) -> typing.Dict[str, RegionIndex]:
+    """
+    Index of every spatial join column
+
+    Args:
+        region (typing.Dict[str, BaseGeometry], optional): Dublin regions to use instead of the Dublin geojson.
+            Defaults to None.
+
+    Returns:
+        typing.Dict[str, RegionIndex]: column to the index assigning it
+    """
+    indexes = {column: boundary_index(name) for column, name in SPATIAL_JOIN_COLUMNS.items()}
+    if region is not None:
+        indexes["region"] = RegionIndex(region)
+    return indexes
+
+
+def spatial_join(
+    lon: typing.Sequence[float], lat: typing.Sequence[float], indexes: typing.Dict[str, RegionIndex] = None
+) -> typing.Dict[str, np.ndarray]:
+    """
+    Dublin region, county and province of each point in one vectorized pass per boundary set
+
+    Args:
+        lon (typing.Sequence[float]): longitudes
+        lat (typing.Sequence[float]): latitudes
+        indexes (typing.Dict[str, RegionIndex], optional): as given by boundary_indexes. Defaults to None, every
+            boundary set from the geojson files.
+
+    Returns:
+        typing.Dict[str, np.ndarray]: column to the area of each point, None outside of every boundary
+    """
+    indexes = indexes if indexes is not None else boundary_indexes()
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    return {column: index.assign_many(lon, lat) for column, index in indexes.items()}
+
+
+if __name__ == "__main__":
+    pass
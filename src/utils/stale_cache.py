@@ -0,0 +1,142 @@
+"""
+    @about: Stale while revalidate memoize on top of the flask-caching Cache, an expired value is served straight away
+    and refreshed in a background thread instead of blocking the callback that finds it
+"""
+import functools
+import logging
+import os
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_caching import Cache
+
+log = logging.getLogger(__name__)
+
+
+class StaleWhileRevalidate(object):
+    """
+    Drop in for Cache.memoize. A value is fresh for timeout seconds, after that it is served for max_stale
+    seconds more while one worker recomputes it in the background; past max_stale the caller computes it
+    inline as a plain memoize would. A max_stale of 0 falls back to the plain memoize.
+
+    Needs a backend with get_stale and set_stale, ie. utils.tiered_cache.TieredRedisCache.
+    """
+
+    def __init__(self, cache: Cache, max_stale: int, refresh_workers: int = 2, refresh_timeout: int = 120):
+        self.cache = cache
+        self.max_stale = max_stale
+        self.refresh_workers = refresh_workers
+        self.refresh_timeout = refresh_timeout
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Refresh threads of this process, created again after a fork as threads do not survive it
+        """
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.refresh_workers, thread_name_prefix="cache-refresh")
+                    self._executor_pid = pid
+        return self._executor
+
+    def _compute(self, backend, f: typing.Callable, key: str, timeout: int, args: typing.Tuple, kwargs: typing.Dict):
+        value = f(*args, **kwargs)
+        if value is not None:
+            try:
+                backend.set_stale(key, value, timeout=timeout, max_stale=self.max_stale)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("could not cache %s", key)
+        return value
+
+    def _refresh(self, backend, f: typing.Callable, key: str, timeout: int, args: typing.Tuple, kwargs: typing.Dict):
+        # memoized calls inside the refresh compute stale values inline, a refresh never builds on stale data
+        self._local.refreshing = True
+        try:
+            self._compute(backend, f, key, timeout, args, kwargs)
+            log.debug(f"refreshed {key}")
+        except Exception:  # pylint: disable=broad-except
+            log.exception("could not refresh %s", key)
+        finally:
+            self._local.refreshing = False
+            backend.release_refresh(key)
+
+    def _schedule_refresh(self, backend, f: typing.Callable, key: str, timeout: int, args: typing.Tuple, kwargs: typing.Dict):
+        if not backend.claim_refresh(key, self.refresh_timeout):
+            return
+        try:
+            self.executor().submit(self._refresh, backend, f, key, timeout, args, kwargs)
+        except RuntimeError:
+            # the interpreter is shutting down
+            backend.release_refresh(key)
+
+    def memoize(self, timeout: int = None, make_name: typing.Callable = None) -> typing.Callable:
+        """
+        Same arguments as Cache.memoize, the decorated function keeps uncached, make_cache_key and
+        delete_memoized so it can be used like a memoized one, peek returns the cached value of a call
+        or None without computing it
+        """
+
+        def decorator(f: typing.Callable) -> typing.Callable:
+            memoized = self.cache.memoize(timeout=timeout, make_name=make_name)(f)
+
+            def peek(*args, **kwargs):
+                # cached value of the call, fresh or stale, or None without computing it
+                backend = self.cache.cache
+                try:
+                    key = memoized.make_cache_key(f, *args, **kwargs)
+                    if not hasattr(backend, "get_stale") or self.max_stale <= 0:
+                        return backend.get(key)
+                    value, fresh = backend.get_stale(key)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Exception possibly due to cache backend.")
+                    return None
+                if value is not None and not fresh:
+                    self._schedule_refresh(backend, f, key, timeout, args, kwargs)
+                return value
+
+            memoized.peek = peek
+            if self.max_stale <= 0:
+                return memoized
+
+            # make_cache_key keeps a version id per function for cache_timeout seconds, every key of the function
+            # changes once it expires so it has to outlive the stale entries
+            memoized.cache_timeout = timeout + self.max_stale
+
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                backend = self.cache.cache
+                if not hasattr(backend, "get_stale"):
+                    return memoized(*args, **kwargs)
+
+                try:
+                    key = memoized.make_cache_key(f, *args, **kwargs)
+                    value, fresh = backend.get_stale(key)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Exception possibly due to cache backend.")
+                    return f(*args, **kwargs)
+
+                if value is None or (not fresh and getattr(self._local, "refreshing", False)):
+                    return self._compute(backend, f, key, timeout, args, kwargs)
+
+                if not fresh:
+                    self._schedule_refresh(backend, f, key, timeout, args, kwargs)
+                return value
+
+            decorated_function.uncached = f
+            decorated_function.cache_timeout = timeout
+            decorated_function.make_cache_key = memoized.make_cache_key
+            decorated_function.delete_memoized = memoized.delete_memoized
+            decorated_function.peek = peek
+            return decorated_function
+
+        return decorator
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,525 @@
+"""
+    @about: Two tier cache backend, a byte budgeted in process LRU in front of redis kept consistent across the
+    gunicorn workers through redis pub/sub invalidation
+"""
+import logging
+import os
+import threading
+import time
+import typing
+import uuid
+from collections import OrderedDict
+
+from flask_caching.backends.rediscache import RedisCache
+
+from utils.cache_serializer import CompactSerializer
+
+log = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "propeiredb:cache:invalidate"
+
+# Message key that drops every local entry
+CLEAR_ALL = "*"
+
+# Suffixes of the freshness marker and the refresh lock of an entry written by set_stale
+FRESH_SUFFIX = ":fresh"
+REFRESH_SUFFIX = ":refreshing"
+
+# Local key and seconds a stale value is held in process while its refresh runs
+STALE_SUFFIX = ":stale"
+STALE_LOCAL_TTL = 5
+
+# Keys whose last invalidation is remembered, a read that started before older ones is not held locally
+INVALIDATION_HISTORY = 10_000
+
+
+class LocalLRU(object):
+    """
+    Least recently used cache of deserialized values, bounded by the serialized size of its entries
+    and expiring each entry with the ttl it was given
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Tuple[bool, typing.Any]:
+        """
+        Looks up a key, expired entries are dropped on read
+
+        Returns:
+            typing.Tuple[bool, typing.Any]: whether the key was found and its value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: typing.Any, size: int, ttl: float = None) -> bool:
+        """
+        Stores a value, evicting the least recently used entries until it fits the byte budget
+
+        Args:
+            key (str): cache key
+            value (typing.Any): deserialized value
+            size (int): serialized size of the value in bytes
+            ttl (float, optional): seconds the entry lives. Defaults to None, no expiry.
+
+        Returns:
+            bool: False if the entry is too large to be held locally
+        """
+        with self._lock:
+            self._pop(key)
+            if size > self.max_entry_bytes or (ttl is not None and ttl <= 0):
+                return False
+
+            while self._entries and self.bytes + size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+class TieredRedisCache(RedisCache):
+    """
+    flask-caching redis backend with a LocalLRU in front of it, set as CACHE_TYPE 'utils.tiered_cache.TieredRedisCache'.
+
+    Values read from or written to redis are held in process until their redis ttl or local_ttl runs out.
+    Every write and delete is published on the invalidation channel, the other processes drop their local
+    copy of the key and read the new value from redis on the next get.
+
+    Values are stored with the CompactSerializer, entries over max_entry_bytes once serialized are skipped.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        password=None,
+        db=0,
+        default_timeout=300,
+        key_prefix=None,
+        local_max_bytes: int = 64 * 1024 * 1024,
+        local_max_entry_bytes: int = None,
+        local_ttl: float = 300,
+        invalidation_channel: str = INVALIDATION_CHANNEL,
+        compression: str = "zlib",
+        max_entry_bytes: int = 8 * 1024 * 1024,
+        **kwargs,
+    ):
+        super().__init__(
+            host=host,
+            port=port,
+            password=password,
+            db=db,
+            default_timeout=default_timeout,
+            key_prefix=key_prefix,
+            **kwargs,
+        )
+        self.serializer = CompactSerializer(codec=compression)
+        self.max_entry_bytes = max_entry_bytes
+        self.local = LocalLRU(local_max_bytes, local_max_entry_bytes)
+        self.local_ttl = local_ttl
+        self.invalidation_channel = invalidation_channel
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "stale_hits": 0}
+        self._counter_lock = threading.Lock()
+        self._listener_pid = None
+        self._origin = None
+        # invalidation counter, generation of the last invalidation of each recent key and of the last clear
+        self._generation = 0
+        self._key_generations = OrderedDict()
+        self._clear_generation = 0
+        self._invalidation_lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            local_max_bytes=int(config.get("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024)),
+            local_max_entry_bytes=config.get("CACHE_LOCAL_MAX_ENTRY_BYTES"),
+            local_ttl=float(config.get("CACHE_LOCAL_TTL", 300)),
+            invalidation_channel=config.get("CACHE_INVALIDATION_CHANNEL", INVALIDATION_CHANNEL),
+            compression=config.get("CACHE_COMPRESSION", "zlib"),
+            max_entry_bytes=int(config.get("CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)),
+        )
+        return super().factory(app, config, args, kwargs)
+
+    # ----------------------------------------------------------------------------------------------------
+    # Invalidation
+    # ----------------------------------------------------------------------------------------------------
+    def _ensure_listener(self):
+        """
+        Starts the invalidation listener once per process, after a fork the child gets its own listener,
+        origin id and an empty local tier
+        """
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+
+        with self._counter_lock:
+            if self._listener_pid == pid:
+                return
+            if self._listener_pid is not None:
+                self.local = LocalLRU(self.local.max_bytes, self.local.max_entry_bytes)
+            self._origin = uuid.uuid4().hex
+            self._listener_pid = pid
+            threading.Thread(target=self._listen, name="cache-invalidation", daemon=True).start()
+
+    def _listen(self):
+        while True:
+            pubsub = self._read_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.invalidation_channel)
+                for message in pubsub.listen():
+                    self._on_message(message)
+            except Exception as e:  # pylint: disable=broad-except
+                # messages may have been missed while disconnected
+                log.warning(f"cache invalidation listener lost its connection, clearing the local tier: {e}")
+                self._invalidate(CLEAR_ALL)
+                time.sleep(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:  # pylint: disable=broad-except
+                    pass
+
+    def _on_message(self, message: typing.Dict):
+        if message.get("type") != "message":
+            return
+
+        data = message["data"]
+        data = data.decode() if isinstance(data, bytes) else data
+        origin, _, key = data.partition("|")
+        if origin == self._origin:
+            return
+        self._invalidate(key)
+
+    def _invalidate(self, key: str):
+        """
+        Drops the local copies of a key, or of every key for CLEAR_ALL, and records the invalidation so a read of
+        the key from redis that was already under way does not put the old value back
+        """
+        with self._invalidation_lock:
+            self._generation += 1
+            if key == CLEAR_ALL:
+                self._clear_generation = self._generation
+                self.local.clear()
+                return
+
+            self._key_generations[key] = self._generation
+            self._key_generations.move_to_end(key)
+            while len(self._key_generations) > INVALIDATION_HISTORY:
+                # a forgotten key counts as invalidated for the reads started before it
+                _, forgotten = self._key_generations.popitem(last=False)
+                self._clear_generation = max(self._clear_generation, forgotten)
+            self.local.delete(key)
+            self.local.delete(key + STALE_SUFFIX)
+
+    def _hold_locally(
+        self, key: str, generation: int, local_key: str, value: typing.Any, size: int, ttl: float = None
+    ) -> bool:
+        """
+        Holds a value read from redis in the local tier unless key was invalidated since generation, when the
+        read started
+
+        Returns:
+            bool: whether the value is held locally
+        """
+        with self._invalidation_lock:
+            if max(self._clear_generation, self._key_generations.get(key, 0)) > generation:
+                return False
+            return self.local.set(local_key, value, size, ttl)
+
+    def _publish(self, *keys: str):
+        self._ensure_listener()
+        try:
+            for key in keys:
+                self._write_client.publish(self.invalidation_channel, f"{self._origin}|{key}")
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning(f"could not publish cache invalidation: {e}")
+
+    # ----------------------------------------------------------------------------------------------------
+    # Local tier
+    # ----------------------------------------------------------------------------------------------------
+    def _count(self, counter: str, n: int = 1):
+        with self._counter_lock:
+            self.counters[counter] += n
+
+    def _oversized(self, key: str, dump: bytes) -> bool:
+        """
+        Entries over max_entry_bytes are not cached, the caller computes the value again on the next call
+        """
+        if len(dump) <= self.max_entry_bytes:
+            return False
+        log.warning(f"not caching {key}: {len(dump) / 1024:.0f} KiB is over the {self.max_entry_bytes / 1024:.0f} KiB entry limit")
+        return True
+
+    def _local_ttl(self, timeout: float) -> float:
+        if timeout is None or timeout < 0:
+            return self.local_ttl
+        return min(timeout, self.local_ttl)
+
+    def _fetch(self, keys: typing.List[str]) -> typing.List[typing.Any]:
+        """
+        Reads keys missing from the local tier with their remaining ttl in a single round trip and holds the hits locally
+        """
+        generation = self._generation
+        pipe = self._read_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(self.key_prefix + key)
+            pipe.pttl(self.key_prefix + key)
+        results = pipe.execute()
+
+        values = []
+        for key, raw, pttl in zip(keys, results[::2], results[1::2]):
+            if raw is None:
+                self._count("misses")
+                values.append(None)
+                continue
+
+            self._count("redis_hits")
+            value = self.serializer.loads(raw)
+            ttl = self._local_ttl(pttl / 1000 if pttl and pttl > 0 else None)
+            self._hold_locally(key, generation, key, value, len(raw), ttl)
+            values.append(value)
+        return values
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """
+        Per tier hit counters of this process and the size of its local tier
+        """
+        with self._counter_lock:
+            counters = dict(self.counters)
+
+        lookups = counters["local_hits"] + counters["redis_hits"] + counters["misses"]
+        counters.update(
+            {
+                "pid": os.getpid(),
+                "lookups": lookups,
+                "local_hit_rate": counters["local_hits"] / lookups if lookups else 0.0,
+                "redis_hit_rate": counters["redis_hits"] / lookups if lookups else 0.0,
+                "hit_rate": (counters["local_hits"] + counters["redis_hits"]) / lookups if lookups else 0.0,
+                "local_entries": len(self.local),
+                "local_bytes": self.local.bytes,
+                "local_max_bytes": self.local.max_bytes,
+            }
+        )
+        return counters
+
+    # ----------------------------------------------------------------------------------------------------
+    # Cache interface
+    # ----------------------------------------------------------------------------------------------------
+    def get(self, key: str) -> typing.Any:
+        self._ensure_listener()
+        found, value = self.local.get(key)
+        if found:
+            self._count("local_hits")
+            return value
+        return self._fetch([key])[0]
+
+    def get_many(self, *keys: str) -> typing.List[typing.Any]:
+        self._ensure_listener()
+        values, missing = {}, []
+        for key in keys:
+            found, value = self.local.get(key)
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+
+        self._count("local_hits", len(values))
+        if missing:
+            values.update(zip(missing, self._fetch(missing)))
+        return [values[key] for key in keys]
+
+    def has(self, key: str) -> bool:
+        found, _ = self.local.get(key)
+        return found or super().has(key)
+
+    def set(self, key: str, value: typing.Any, timeout: typing.Optional[int] = None) -> typing.Any:
+        timeout = self._normalize_timeout(timeout)
+        dump = self.serializer.dumps(value)
+        if self._oversized(key, dump):
+            return False
+
+        if timeout == -1:
+            result = self._write_client.set(name=self.key_prefix + key, value=dump)
+        else:
+            result = self._write_client.setex(name=self.key_prefix + key, value=dump, time=timeout)
+
+        self._publish(key)
+        self.local.set(key, value, len(dump), self._local_ttl(timeout))
+        return result
+
+    def set_many(self, mapping: typing.Dict[str, typing.Any], timeout: typing.Optional[int] = None) -> typing.List[typing.Any]:
+        timeout = self._normalize_timeout(timeout)
+        dumps = {key: self.serializer.dumps(value) for key, value in mapping.items()}
+        dumps = {key: dump for key, dump in dumps.items() if not self._oversized(key, dump)}
+        pipe = self._write_client.pipeline(transaction=False)
+        for key, dump in dumps.items():
+            if timeout == -1:
+                pipe.set(name=self.key_prefix + key, value=dump)
+            else:
+                pipe.setex(name=self.key_prefix + key, value=dump, time=timeout)
+        results = pipe.execute()
+
+        self._publish(*dumps)
+        for key, dump in dumps.items():
+            self.local.set(key, mapping[key], len(dump), self._local_ttl(timeout))
+        return [k for k, was_set in zip(dumps.keys(), results) if was_set]
+
+    def add(self, key: str, value: typing.Any, timeout: typing.Optional[int] = None) -> typing.Any:
+        timeout = self._normalize_timeout(timeout)
+        dump = self.serializer.dumps(value)
+        if self._oversized(key, dump):
+            return False
+
+        created = self._write_client.setnx(name=self.key_prefix + key, value=dump)
+        if created and timeout != -1:
+            self._write_client.expire(name=self.key_prefix + key, time=timeout)
+
+        if created:
+            self._publish(key)
+            self.local.set(key, value, len(dump), self._local_ttl(timeout))
+        return created
+
+    def delete(self, key: str) -> bool:
+        self.local.delete(key)
+        result = super().delete(key)
+        self._publish(key)
+        return result
+
+    def delete_many(self, *keys: str) -> typing.List[typing.Any]:
+        for key in keys:
+            self.local.delete(key)
+        result = super().delete_many(*keys)
+        self._publish(*keys)
+        return result
+
+    def clear(self) -> bool:
+        self.local.clear()
+        result = super().clear()
+        self._publish(CLEAR_ALL)
+        return result
+
+    def inc(self, key: str, delta: int = 1) -> typing.Any:
+        self.local.delete(key)
+        result = super().inc(key, delta)
+        self._publish(key)
+        return result
+
+    def dec(self, key: str, delta: int = 1) -> typing.Any:
+        self.local.delete(key)
+        result = super().dec(key, delta)
+        self._publish(key)
+        return result
+
+    # ----------------------------------------------------------------------------------------------------
+    # Stale while revalidate
+    # ----------------------------------------------------------------------------------------------------
+    def get_stale(self, key: str) -> typing.Tuple[typing.Any, bool]:
+        """
+        Value of a key written by set_stale and whether it is still fresh, stale values are held locally
+        for STALE_LOCAL_TTL seconds while the refresh runs
+
+        Returns:
+            typing.Tuple[typing.Any, bool]: value or None once past its maximum staleness, fresh or not
+        """
+        self._ensure_listener()
+        found, value = self.local.get(key)
+        if found:
+            self._count("local_hits")
+            return value, True
+
+        found, value = self.local.get(key + STALE_SUFFIX)
+        if found:
+            self._count("local_hits")
+            self._count("stale_hits")
+            return value, False
+
+        generation = self._generation
+        pipe = self._read_client.pipeline(transaction=False)
+        pipe.get(self.key_prefix + key)
+        pipe.pttl(self.key_prefix + key + FRESH_SUFFIX)
+        raw, fresh_pttl = pipe.execute()
+
+        if raw is None:
+            self._count("misses")
+            return None, False
+
+        self._count("redis_hits")
+        value = self.serializer.loads(raw)
+        # pttl is -2 once the marker expired and -1 for entries without a timeout
+        fresh = fresh_pttl is not None and fresh_pttl != -2
+        if fresh:
+            ttl = self._local_ttl(fresh_pttl / 1000 if fresh_pttl > 0 else None)
+            self._hold_locally(key, generation, key, value, len(raw), ttl)
+        else:
+            self._count("stale_hits")
+            self._hold_locally(key, generation, key + STALE_SUFFIX, value, len(raw), STALE_LOCAL_TTL)
+        return value, fresh
+
+    def set_stale(self, key: str, value: typing.Any, timeout: typing.Optional[int] = None, max_stale: int = 0) -> bool:
+        """
+        Writes a value that is fresh for timeout seconds and kept for max_stale seconds more to be served while it is refreshed
+        """
+        timeout = self._normalize_timeout(timeout)
+        dump = self.serializer.dumps(value)
+        if self._oversized(key, dump):
+            return False
+
+        pipe = self._write_client.pipeline(transaction=False)
+        if timeout == -1:
+            pipe.set(name=self.key_prefix + key, value=dump)
+            pipe.set(name=self.key_prefix + key + FRESH_SUFFIX, value=1)
+        else:
+            pipe.setex(name=self.key_prefix + key, value=dump, time=timeout + max_stale)
+            pipe.setex(name=self.key_prefix + key + FRESH_SUFFIX, value=1, time=timeout)
+        result = pipe.execute()[0]
+
+        self._publish(key)
+        self.local.delete(key + STALE_SUFFIX)
+        self.local.set(key, value, len(dump), self._local_ttl(timeout))
+        return bool(result)
+
+    def claim_refresh(self, key: str, ttl: int) -> bool:
+        """
+        Takes the refresh lock of a key across the workers, the lock expires after ttl seconds
+        """
+        return bool(self._write_client.set(self.key_prefix + key + REFRESH_SUFFIX, 1, nx=True, ex=ttl))
+
+    def release_refresh(self, key: str):
+        self._write_client.delete(self.key_prefix + key + REFRESH_SUFFIX)
+
+
+if __name__ == "__main__":
+    pass
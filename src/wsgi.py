@@ -3,8 +3,21 @@
 """
 import os
 
-from callbacks import application
+from callbacks import application, area_options
 from server_config import server
+from utils.geojson_map_cleanse import GEOJSON_LEVELS, GEOJSON_SOURCES, load_geojson_level
+
+
+def preload_shared_state():
+    """
+    Loads the area options and the map geojson up front, called by gunicorn in the master with preload_app
+    so the workers share them copy on write instead of each loading them on first use
+    """
+    area_options.areas()
+    for name in GEOJSON_SOURCES:
+        for level in GEOJSON_LEVELS:
+            load_geojson_level(name, level)
+
 
 if __name__ == "__main__":
     application
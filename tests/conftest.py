@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# the app runs from src with flat imports, ie. import server_config
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# server_config reads these at import, the connections are only opened on first use so nothing listens on them
+os.environ.setdefault("POSTGRES_DSN", "postgresql://propeiredb@127.0.0.1:1/propeiredb")
+os.environ.setdefault("REDIS_DSN", "redis://127.0.0.1:1/0")
+os.environ.setdefault("BACKGROUND_CACHE_DIR", tempfile.mkdtemp(prefix="propeiredb-background-test-"))
@@ -0,0 +1,227 @@
+import os
+import time
+
+import plotly.graph_objects as go
+import pytest
+
+# layout.py reads its assets relative to src, the directory the app runs from
+_cwd = os.getcwd()
+os.chdir(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+try:
+    import callbacks
+    from layout import PROGRESS_HIDDEN, PROGRESS_SHOWN, PROGRESS_STEPS
+    from server_config import application
+finally:
+    os.chdir(_cwd)
+
+CACHE = callbacks.selection_inputs("Dublin Clustering", "All", None, "2010-01-01", "2024-01-01")
+VIOLIN = "Violin Chart - Price"
+
+
+class StubFigureCache(object):
+    """
+    Stands in for a memoized figure function, peek answers from figures and a call draws the figure
+    """
+
+    def __init__(self, figures=None, delay=0.0):
+        self.figures = figures or {}
+        self.delay = delay
+        self.calls = []
+
+    def peek(self, *args):
+        return self.figures.get(args)
+
+    def __call__(self, *args):
+        self.calls.append(args)
+        # long enough for the polls to see the progress of the job
+        time.sleep(self.delay)
+        return go.Figure(go.Violin(y=[1, 2, 3], name="drawn"))
+
+
+class StubDataModel(object):
+    def selection_plan(self):
+        return None
+
+
+@pytest.fixture
+def figures(monkeypatch):
+    stubs = {"map": StubFigureCache(delay=0.5), "chart": StubFigureCache()}
+    monkeypatch.setattr(callbacks, "map_figure", stubs["map"])
+    monkeypatch.setattr(callbacks, "chart_figure", stubs["chart"])
+    monkeypatch.setattr(callbacks, "selection_models", lambda cache: (StubDataModel(), None))
+    return stubs
+
+
+def component(component_id, prop, value=None):
+    return {"id": component_id, "property": prop, "value": value}
+
+
+def callback_outputs(key):
+    """
+    Outputs of a callback_map key, a single output or the outputs of a multi output callback
+    """
+    if not key.startswith(".."):
+        component_id, prop = key.split(".", 1)
+        return {"id": component_id, "property": prop}
+    return [dict(zip(("id", "property"), i.split(".", 1))) for i in key[2:-2].split("...")]
+
+
+def background_callback(job_id):
+    """
+    callback_map key of the background callback drawing the graph of a job store
+    """
+    (key,) = [k for k, v in application.callback_map.items() if v["inputs"] == [{"id": job_id, "property": "data"}]]
+    return key
+
+
+def dependency(client, job_id):
+    """
+    Spec of the background callback of a job store as the dash renderer gets it
+    """
+    (spec,) = [i for i in client.get("/_dash-dependencies").get_json() if i["inputs"][0]["id"] == job_id]
+    return spec
+
+
+def update(client, output, inputs, state=()):
+    body = {
+        "output": output,
+        "outputs": callback_outputs(output),
+        "inputs": list(inputs),
+        "state": list(state),
+        "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+    }
+    response = client.post("/_dash-update-component", json=body)
+    assert response.status_code == 200
+    return body, response.get_json()
+
+
+def run_background(client, output, job_id, job, state=(), timeout=30):
+    """
+    Starts a background callback and polls it until it answers as the dash renderer does
+
+    Returns:
+        tuple: response of the job and the progress reported while polling
+    """
+    body, started = update(client, output, [component(job_id, "data", job)], state)
+    assert {"cacheKey", "job"} <= set(started)
+
+    progress = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.post(
+            f"/_dash-update-component?cacheKey={started['cacheKey']}&job={started['job']}", json=body
+        )
+        if response.status_code == 200:
+            payload = response.get_json()
+            if "progress" in payload:
+                progress.append(payload["progress"])
+            if "response" in payload:
+                return payload["response"], progress
+        time.sleep(0.05)
+    raise TimeoutError(f"background callback of {job_id} did not finish")
+
+
+# Hand-off of the heavy graphs
+MAP_OUTPUT = "..mapbox.figure...map-state.data...mapbox-job.data.."
+
+
+def map_inputs(region="Dublin Clustering"):
+    return [
+        component("cached-inputs", "children", CACHE),
+        component("region-dropdown", "value", region),
+        component("mapbox", "relayoutData"),
+    ]
+
+
+def test_cached_map_is_answered_inline(figures):
+    figures["map"].figures[(CACHE, "Dublin Clustering", callbacks.DEFAULT_MAP_ZOOM, None)] = go.Figure()
+
+    _, payload = update(application.server.test_client(), MAP_OUTPUT, map_inputs(), [component("map-state", "data")])
+
+    assert "figure" in payload["response"]["mapbox"]
+    assert "mapbox-job" not in payload["response"]
+    assert figures["map"].calls == []
+
+
+def test_map_cache_miss_writes_a_job(figures):
+    _, payload = update(application.server.test_client(), MAP_OUTPUT, map_inputs(), [component("map-state", "data")])
+
+    assert "mapbox" not in payload["response"]
+    job = payload["response"]["mapbox-job"]["data"]
+    assert {k: job[k] for k in ("cache", "region", "zoom", "bounds")} == {
+        "cache": CACHE,
+        "region": "Dublin Clustering",
+        "zoom": callbacks.DEFAULT_MAP_ZOOM,
+        "bounds": None,
+    }
+    assert figures["map"].calls == []
+
+
+CHARTS = [
+    ("series-chart", "chart-dropdown", "series-checkbox"),
+    ("left-chart", "left-chart-dropdown", "left-checkbox"),
+    ("right-chart", "right-chart-dropdown", "right-checkbox"),
+]
+
+
+@pytest.mark.parametrize("graph_id, dropdown_id, checkbox_id", CHARTS)
+def test_heavy_chart_hand_off(figures, graph_id, dropdown_id, checkbox_id):
+    output = f"..{graph_id}.figure...{graph_id}-state.data...{graph_id}-job.data.."
+    inputs = [
+        component(dropdown_id, "value", VIOLIN),
+        component(checkbox_id, "value", "area"),
+        component("cached-inputs", "children", CACHE),
+    ]
+    state = [component(f"{graph_id}-state", "data")]
+    client = application.server.test_client()
+
+    _, payload = update(client, output, inputs, state)
+    job = payload["response"][f"{graph_id}-job"]["data"]
+    assert (job["graph"], job["chart"], job["agg"], job["cache"]) == (graph_id, VIOLIN, "area", CACHE)
+    assert graph_id not in payload["response"]
+
+    figures["chart"].figures[(VIOLIN, "area", CACHE)] = go.Figure(go.Violin(y=[1], name="cached"))
+    _, payload = update(client, output, inputs, state)
+    assert payload["response"][graph_id]["figure"]["data"][0]["name"] == "cached"
+    assert f"{graph_id}-job" not in payload["response"]
+    assert figures["chart"].calls == []
+
+
+# Background callbacks
+def test_draw_map(figures):
+    job = {"cache": CACHE, "region": "Dublin Clustering", "zoom": 15, "bounds": [-6.3, 53.3, -6.2, 53.4]}
+
+    response, progress = run_background(
+        application.server.test_client(), background_callback("mapbox-job"), "mapbox-job", job
+    )
+
+    assert response["mapbox"]["figure"]["data"][0]["name"] == "drawn"
+    assert {"mapbox-progress.value": 2, "mapbox-progress.label": "Drawing the map"} in progress
+    assert progress[-1] == {"mapbox-progress.value": PROGRESS_STEPS, "mapbox-progress.label": ""}
+
+
+@pytest.mark.parametrize("graph_id", [i[0] for i in CHARTS])
+def test_draw_chart(figures, graph_id):
+    job = {"graph": graph_id, "chart": VIOLIN, "agg": "area", "cache": CACHE, "session": None}
+    state = [component(f"{graph_id}-state", "data")]
+
+    response, _ = run_background(
+        application.server.test_client(), background_callback(f"{graph_id}-job"), f"{graph_id}-job", job, state
+    )
+
+    assert response[graph_id]["figure"]["data"][0]["name"] == "drawn"
+    drawn = go.Figure(go.Violin(y=[1, 2, 3], name="drawn"))
+    assert response[f"{graph_id}-state"]["data"] == callbacks.GraphModel.figure_signature(drawn)
+
+
+@pytest.mark.parametrize("graph_id", ["mapbox"] + [i[0] for i in CHARTS])
+def test_progress_bars(graph_id):
+    client = application.server.test_client()
+    spec = dependency(client, f"{graph_id}-job")
+
+    assert "long" in spec
+    assert spec["running"] == {
+        "running": {f"{graph_id}-progress.style": PROGRESS_SHOWN},
+        "runningOff": {f"{graph_id}-progress.style": PROGRESS_HIDDEN},
+    }
+    assert f'"id":"{graph_id}-progress"' in client.get("/_dash-layout").get_data(as_text=True)
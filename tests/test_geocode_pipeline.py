@@ -0,0 +1,119 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from utils import geo_encode_data
+from utils.geo_encode_data import GeoEncodedAddress, encode_and_upload_missing_addresses
+
+
+class ThreadBoundConnection(object):
+    """
+    Stands in for a psycopg2 connection that fails when used from a second thread, the statements of the pipeline
+    are stubbed and only mark the connection as used
+    """
+
+    def __init__(self):
+        self.thread = None
+        self.uses = 0
+
+    def use(self):
+        thread = threading.get_ident()
+        if self.thread is None:
+            self.thread = thread
+        assert self.thread == thread, "connection used from two threads"
+        self.uses += 1
+
+    def __enter__(self):
+        self.use()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.use()
+
+
+class StubQueue(object):
+    """
+    Geocode queue of the stubbed claim, complete and release statements
+    """
+
+    def __init__(self, size):
+        self.queued = [f"hash-{i}" for i in range(size)]
+        self.completed, self.released = [], []
+
+    def claim(self, pg_connection, batch_size, *args):
+        pg_connection.use()
+        claimed, self.queued = self.queued[:batch_size], self.queued[batch_size:]
+        return pd.DataFrame({"address_hash": claimed, "address": claimed, "county": None, "postal_code": None})
+
+    def complete(self, pg_connection, address_hashes, *args):
+        pg_connection.use()
+        self.completed.extend(address_hashes)
+
+    def release(self, pg_connection, address_hashes, *args):
+        pg_connection.use()
+        self.released.extend(address_hashes)
+
+
+class StubUpsert(object):
+    rows = []
+
+    def __init__(self, pg_connection):
+        pg_connection.use()
+        self.pg_connection = pg_connection
+
+    def upsert_dataframe(self, df, **kwargs):
+        self.pg_connection.use()
+        StubUpsert.rows.extend(df["address_hash"])
+
+
+def encode(df, *args):
+    return [GeoEncodedAddress(i, i, 53.35, -6.26, address_hash=i) for i in df["address"]]
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    stub = StubQueue(1050)
+    StubUpsert.rows = []
+    monkeypatch.setattr(geo_encode_data, "claim_addresses", stub.claim)
+    monkeypatch.setattr(geo_encode_data, "complete_addresses", stub.complete)
+    monkeypatch.setattr(geo_encode_data, "release_addresses", stub.release)
+    monkeypatch.setattr(geo_encode_data, "PandaSqlPlus", StubUpsert)
+    monkeypatch.setattr(geo_encode_data, "get_encoded_addresses", encode)
+    return stub
+
+
+def test_claims_run_on_their_own_connection(queue):
+    connection, claim_connection = ThreadBoundConnection(), ThreadBoundConnection()
+
+    uploaded = encode_and_upload_missing_addresses(
+        connection, None, batch_size=1000, page_size=100, flush_size=30, claim_connection=claim_connection
+    )
+
+    assert len(uploaded) == 1000 and len(queue.queued) == 50
+    assert sorted(StubUpsert.rows) == sorted(queue.completed) == sorted(uploaded["address_hash"])
+    assert connection.thread == threading.get_ident()
+    assert claim_connection.thread not in (None, connection.thread)
+
+
+def test_failure_releases_from_the_connection_of_the_uploads(queue, monkeypatch):
+    connection, claim_connection = ThreadBoundConnection(), ThreadBoundConnection()
+    pages = []
+
+    def failing_encode(df, *args):
+        pages.append(df)
+        if len(pages) == 3:
+            raise RuntimeError("geocoder down")
+        return encode(df)
+
+    monkeypatch.setattr(geo_encode_data, "get_encoded_addresses", failing_encode)
+    with pytest.raises(RuntimeError):
+        encode_and_upload_missing_addresses(
+            connection, None, batch_size=1000, page_size=100, flush_size=50, claim_connection=claim_connection
+        )
+
+    # the two pages geocoded are uploaded and every other claimed address goes back to the queue
+    claimed = 1050 - len(queue.queued)
+    assert len(queue.completed) == 200
+    assert sorted(queue.completed + queue.released) == sorted(f"hash-{i}" for i in range(claimed))
+    assert connection.thread == threading.get_ident()
@@ -0,0 +1,164 @@
+import threading
+
+import googlemaps
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from utils.geo_encode_data import encode_address, get_encoded_addresses
+from utils.geocode_cache import GeocodeCache
+from utils.geocoder import ConcurrentGeocoder
+
+DUBLIN_8 = [
+    {"formatted_address": "1 James's Street, Dublin 8, Ireland", "geometry": {"location": {"lat": 53.343, "lng": -6.29}}}
+]
+REGION = {"D08": box(-6.32, 53.33, -6.26, 53.35)}
+
+
+class StubClient(object):
+    """
+    Stands in for googlemaps.Client, answers every address with the outcomes scripted for it in turn, an exception
+    is raised and anything else returned, the last outcome repeats
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def geocode(self, address):
+        with self._lock:
+            attempt = sum(1 for i in self.calls if i == address)
+            self.calls.append(address)
+        script = self.outcomes.get(address, [[]])
+        outcome = script[min(attempt, len(script) - 1)]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """
+    Backoffs the geocoders of a test would have slept for, without sleeping
+    """
+    waits = []
+    backoff = ConcurrentGeocoder.backoff
+
+    def recorded_backoff(self, attempt):
+        waits.append(backoff(self, attempt))
+        return 0
+
+    monkeypatch.setattr(ConcurrentGeocoder, "backoff", recorded_backoff)
+    return waits
+
+
+def quota_error():
+    return googlemaps.exceptions.ApiError("OVER_QUERY_LIMIT")
+
+
+def make_geocoder(client, **kwargs):
+    return ConcurrentGeocoder(lambda address: encode_address(address, client), queries_per_second=1000, **kwargs)
+
+
+def sales(*addresses):
+    return pd.DataFrame({"address": list(addresses), "address_hash": [f"hash-{i}" for i in range(len(addresses))]})
+
+
+# Retries
+def test_quota_errors_are_retried_with_backoff(no_backoff):
+    client = StubClient({"a": [quota_error(), googlemaps.exceptions.Timeout(), DUBLIN_8]})
+    encoder = make_geocoder(client, backoff_base=0.5, backoff_max=30.0)
+
+    result = encoder.geocode("a")
+
+    assert result.lat == 53.343 and result.lon == -6.29
+    assert client.calls == ["a", "a", "a"]
+    assert encoder.stats == {"requests": 3, "retries": 2, "not_found": 0, "failed": 0}
+    # full jitter, the first wait is at most backoff_base and the second twice that
+    assert len(no_backoff) == 2
+    assert 0 <= no_backoff[0] <= 0.5 and 0 <= no_backoff[1] <= 1.0
+
+
+def test_backoff_is_capped(no_backoff):
+    encoder = make_geocoder(StubClient({}), backoff_base=0.5, backoff_max=2.0)
+
+    for attempt in range(20):
+        encoder.backoff(attempt)
+    assert all(0 <= i <= 2.0 for i in no_backoff)
+
+
+def test_gives_up_after_max_retries():
+    failures = []
+    client = StubClient({"a": [quota_error()]})
+    encoder = make_geocoder(client, max_retries=3, on_failure=lambda address, e: failures.append(address))
+
+    assert encoder.geocode("a") is None
+    assert len(client.calls) == 4
+    assert encoder.stats == {"requests": 4, "retries": 3, "not_found": 0, "failed": 1}
+    assert failures == ["a"]
+
+
+def test_errors_that_are_not_retriable_fail_straight_away():
+    client = StubClient({"a": [googlemaps.exceptions.ApiError("REQUEST_DENIED"), DUBLIN_8]})
+    encoder = make_geocoder(client)
+
+    assert encoder.geocode("a") is None
+    assert client.calls == ["a"]
+    assert encoder.stats["failed"] == 1 and encoder.stats["retries"] == 0
+
+
+# Not found
+def test_not_found_is_not_retried():
+    client = StubClient({"nowhere": [[]]})
+    encoder = make_geocoder(client)
+
+    assert encoder.geocode("nowhere") is None
+    assert client.calls == ["nowhere"]
+    assert encoder.stats == {"requests": 1, "retries": 0, "not_found": 1, "failed": 0}
+
+
+def test_not_found_addresses_are_left_out():
+    client = StubClient({"1 James's Street, Dublin 8, Ireland": [DUBLIN_8]})
+
+    encoded = get_encoded_addresses(sales("1 James's Street, Dublin 8", "Nowhere Lane"), client, REGION, max_workers=2)
+
+    assert [(i.address_hash, i.region) for i in encoded] == [("hash-0", "D08")]
+    assert sorted(client.calls) == ["1 James's Street, Dublin 8, Ireland", "Nowhere Lane, Ireland"]
+
+
+# Cache
+def test_cache_answers_the_addresses_it_holds(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.sqlite"))
+    client = StubClient({"1 James's Street, Dublin 8, Ireland": [DUBLIN_8]})
+    df = sales("1 James's Street, Dublin 8", "Nowhere Lane")
+
+    first = get_encoded_addresses(df, client, REGION, max_workers=2, cache=cache)
+    assert len(client.calls) == 2
+    assert cache.stats == {"hits": 0, "negative_hits": 0, "misses": 2}
+
+    # the found and the not found address are both answered by the cache
+    second = get_encoded_addresses(df, client, REGION, max_workers=2, cache=cache)
+    assert len(client.calls) == 2
+    assert cache.stats == {"hits": 1, "negative_hits": 1, "misses": 2}
+    assert second == first
+
+    # only the new address goes to the client
+    df = sales("1 James's Street, Dublin 8", "2 James's Street, Dublin 8")
+    get_encoded_addresses(df, client, REGION, cache=cache)
+    assert client.calls[2:] == ["2 James's Street, Dublin 8, Ireland"]
+    cache.close()
+
+
+def test_failed_addresses_are_skipped_until_they_expire(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode_cache.sqlite"), failed_ttl=0)
+    client = StubClient({"Flaky Road, Ireland": [googlemaps.exceptions.ApiError("REQUEST_DENIED"), DUBLIN_8]})
+
+    assert get_encoded_addresses(sales("Flaky Road"), client, REGION, cache=cache) == []
+    assert cache.get("Flaky Road, Ireland", record_stats=False) == (False, None)
+
+    # with a failed_ttl of 0 the failure has already expired and the address is tried again
+    encoded = get_encoded_addresses(sales("Flaky Road"), client, REGION, cache=cache)
+    assert [i.region for i in encoded] == ["D08"]
+    assert client.calls == ["Flaky Road, Ireland", "Flaky Road, Ireland"]
+    cache.close()
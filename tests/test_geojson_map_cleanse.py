@@ -0,0 +1,34 @@
+import json
+
+from utils import geojson_map_cleanse
+from utils.region_index import region_polygons
+
+
+def test_compiled_geometries_round_trip(tmp_path):
+    compiled = geojson_map_cleanse.compile_boundary_geometries("province", str(tmp_path))
+
+    assert {i.name for i in tmp_path.iterdir()} == {"province.wkb", "province.json"}
+    loaded = geojson_map_cleanse.read_compiled_geometries("province", str(tmp_path))
+    assert list(loaded) == list(compiled)
+    assert all(loaded[name].equals(geometry) for name, geometry in compiled.items())
+    assert list(loaded) == list(region_polygons(geojson_map_cleanse.full_geojson("province")))
+
+
+def test_stale_or_mismatched_artifacts_are_ignored(tmp_path):
+    geojson_map_cleanse.compile_boundary_geometries("province", str(tmp_path))
+    sidecar_path = tmp_path / "province.json"
+    sidecar = json.loads(sidecar_path.read_text())
+
+    sidecar_path.write_text(json.dumps({**sidecar, "version": sidecar["version"] - 1}))
+    assert geojson_map_cleanse.read_compiled_geometries("province", str(tmp_path)) is None
+
+    sidecar_path.write_text(json.dumps({**sidecar, "size": -1, "sha1": "0" * 40}))
+    assert geojson_map_cleanse.read_compiled_geometries("province", str(tmp_path)) is None
+
+    sidecar_path.write_text(json.dumps(sidecar))
+    (tmp_path / "province.wkb").write_bytes(b"not wkb")
+    assert geojson_map_cleanse.read_compiled_geometries("province", str(tmp_path)) is None
+
+
+def test_missing_artifacts(tmp_path):
+    assert geojson_map_cleanse.read_compiled_geometries("county", str(tmp_path)) is None
@@ -0,0 +1,103 @@
+import pandas as pd
+import plotly.express as px
+
+from models.graph_model import RAW_POINTS_ZOOM, GraphModel, bounds_contain, points_bounds, view_bounds
+
+DATA = pd.DataFrame(
+    {
+        "period": ["2020-Q1", "2020-Q2", "2020-Q1", "2020-Q2"],
+        "year": [2020, 2020, 2020, 2020],
+        "county": ["Dublin", "Dublin", "Cork", "Cork"],
+        "total_value": [10.0, 20.0, 30.0, 40.0],
+        "avg_price": [1.0, 2.0, 3.0, 4.0],
+    }
+)
+
+
+def test_signature_matches_for_new_data():
+    first = px.line(DATA, x="period", y="total_value", color="county")
+    second = px.line(DATA.assign(total_value=DATA["total_value"] * 2), x="period", y="total_value", color="county")
+
+    assert GraphModel.figure_signature(first) == GraphModel.figure_signature(second)
+
+
+def test_signature_changes_with_the_metric():
+    total = px.line(DATA, x="period", y="total_value", color="county", labels={"total_value": "Total Value"})
+    average = px.line(DATA, x="period", y="avg_price", color="county", labels={"avg_price": "Average Price"})
+
+    assert GraphModel.figure_signature(total) != GraphModel.figure_signature(average)
+
+
+def test_signature_changes_with_the_grouping():
+    by_period = px.bar(DATA, x="period", y="avg_price", color="county")
+    by_year = px.bar(DATA, x="year", y="avg_price", color="county")
+
+    assert GraphModel.figure_signature(by_period) != GraphModel.figure_signature(by_year)
+
+
+# Raw points of the scatter map
+class StubDataModel(object):
+    def __init__(self):
+        self.bounds = []
+        self.grid_sizes = []
+
+    def pull_points_in_bounds(self, bounds):
+        self.bounds.append(bounds)
+        return pd.DataFrame({"lat": [53.34], "lon": [-6.27], "price": [300000.0], "period": ["2020-Q1"]})
+
+    def pull_data_query(self):
+        raise AssertionError("the whole selection was pulled")
+
+    def pull_clustered_points(self, grid_size, by_period=False):
+        self.grid_sizes.append(grid_size)
+        return pd.DataFrame({"lat": [53.34], "lon": [-6.27], "num_of_sales": [3], "total_value": [9e5], "avg_price": [3e5]})
+
+
+def test_view_bounds_from_the_corners():
+    relayout = {
+        "mapbox.center": {"lon": -6.26, "lat": 53.35},
+        "mapbox.zoom": 15,
+        "mapbox._derived": {"coordinates": [[-6.28, 53.36], [-6.24, 53.36], [-6.24, 53.34], [-6.28, 53.34]]},
+    }
+
+    assert view_bounds(relayout, 15) == [-6.28, 53.34, -6.24, 53.36]
+
+
+def test_view_bounds_from_the_centre():
+    min_lon, min_lat, max_lon, max_lat = view_bounds({"mapbox.center": {"lon": -6.26, "lat": 53.35}}, 14)
+
+    assert min_lon < -6.26 < max_lon and min_lat < 53.35 < max_lat
+    assert view_bounds({"mapbox.center": {"lon": -6.26, "lat": 53.35}}, 15)[0] > min_lon
+    assert view_bounds(None, 14) is None and view_bounds({"autosize": True}, 14) is None
+
+
+def test_points_bounds_cover_small_pans():
+    view = [-6.28, 53.34, -6.24, 53.36]
+    bounds = points_bounds(view, 14)
+
+    assert bounds_contain(bounds, view)
+    assert points_bounds([-6.279, 53.341, -6.239, 53.361], 14) == bounds
+    assert not bounds_contain(bounds, [-6.18, 53.34, -6.14, 53.36])
+
+
+def test_raw_points_are_pulled_for_the_bounds_only():
+    graph_model = GraphModel()
+    data_model = StubDataModel()
+    graph_model.import_data_model(data_model)
+    bounds = [-6.3, 53.3, -6.2, 53.4]
+
+    fig = graph_model.scatter_map(zoom=RAW_POINTS_ZOOM, bounds=bounds)
+
+    assert data_model.bounds == [bounds]
+    assert fig.layout.mapbox.center.lon == -6.25 and round(fig.layout.mapbox.center.lat, 6) == 53.35
+
+
+def test_raw_zoom_without_bounds_stays_clustered():
+    graph_model = GraphModel()
+    data_model = StubDataModel()
+    graph_model.import_data_model(data_model)
+
+    fig = graph_model.scatter_map(zoom=RAW_POINTS_ZOOM + 1)
+
+    assert data_model.bounds == [] and len(data_model.grid_sizes) == 1
+    assert list(fig.data[0].lat) == [53.34]
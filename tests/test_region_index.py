@@ -0,0 +1,65 @@
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+
+from utils.geo_encode_data import assign_region
+from utils.region_index import RegionIndex
+from utils.geojson_map_cleanse import boundary_geometries
+
+# west and east touch along lon 1, overlap covers the top of both and comes after them, island has a hole
+REGIONS = {
+    "west": box(0, 0, 1, 1),
+    "east": box(1, 0, 2, 1),
+    "overlap": box(0, 0.5, 2, 2),
+    "island": MultiPolygon(
+        [
+            Polygon([(3, 0), (5, 0), (5, 2), (3, 2)], holes=[[(3.5, 0.5), (4.5, 0.5), (4.5, 1.5), (3.5, 1.5)]]),
+            box(6, 0, 7, 1),
+        ]
+    ),
+}
+POINTS = [
+    ((0.5, 0.25), "west"),
+    ((1.5, 0.25), "east"),
+    # inside both, the region that comes first wins
+    ((0.5, 0.75), "west"),
+    ((1.5, 0.75), "east"),
+    ((1.0, 1.5), "overlap"),
+    # on the border of west and east only, a boundary is in neither
+    ((1.0, 0.25), None),
+    ((3.25, 1.0), "island"),
+    ((6.5, 0.5), "island"),
+    ((4.0, 1.0), None),
+    ((-1.0, -1.0), None),
+]
+
+
+def test_assign():
+    index = RegionIndex(REGIONS)
+
+    assert [index.assign(lon, lat) for (lon, lat), _ in POINTS] == [region for _, region in POINTS]
+
+
+def test_assign_many():
+    index = RegionIndex(REGIONS)
+    lon, lat = zip(*(point for point, _ in POINTS))
+
+    assert list(index.assign_many(lon, lat)) == [region for _, region in POINTS]
+
+
+def test_assign_many_of_no_points():
+    assert len(RegionIndex(REGIONS).assign_many([], [])) == 0
+
+
+def test_paths_agree_with_the_polygon_loop_on_the_counties():
+    regions = boundary_geometries("county")
+    index = RegionIndex(regions)
+    rng = np.random.default_rng(0)
+    min_lon, min_lat, max_lon, max_lat = shapely.total_bounds(index.geometries)
+    lon = rng.uniform(min_lon, max_lon, 500)
+    lat = rng.uniform(min_lat, max_lat, 500)
+
+    looped = [assign_region(x, y, regions) for x, y in zip(lon, lat)]
+    assert [index.assign(x, y) for x, y in zip(lon, lat)] == looped
+    assert list(index.assign_many(lon, lat)) == looped
+    assert any(i is None for i in looped) and len({i for i in looped if i is not None}) > 10
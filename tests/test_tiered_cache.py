@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from utils import tiered_cache
+from utils.tiered_cache import CLEAR_ALL, FRESH_SUFFIX, STALE_SUFFIX, TieredRedisCache
+
+
+class StubPipeline(object):
+    """
+    Redis pipeline answering from a dict, on_execute runs between the read and the reply as an invalidation
+    arriving on the listener thread mid-fetch would
+    """
+
+    def __init__(self, store, on_execute):
+        self.store = store
+        self.on_execute = on_execute
+        self.commands = []
+
+    def get(self, name):
+        self.commands.append(self.store.get(name))
+
+    def pttl(self, name):
+        self.commands.append(60_000 if name in self.store else -2)
+
+    def execute(self):
+        results = self.commands
+        self.on_execute()
+        return results
+
+
+class StubRedis(object):
+    def __init__(self):
+        self.store = {}
+        self.on_execute = lambda: None
+
+    def pipeline(self, transaction=False):
+        return StubPipeline(self.store, self.on_execute)
+
+
+@pytest.fixture
+def cache():
+    backend = TieredRedisCache(key_prefix="test:")
+    backend._read_client = StubRedis()
+    # no listener thread, the test delivers the messages
+    backend._listener_pid = os.getpid()
+    backend._origin = "this-process"
+    return backend
+
+
+def store(cache, key, value, fresh=False):
+    cache._read_client.store["test:" + key] = cache.serializer.dumps(value)
+    if fresh:
+        cache._read_client.store["test:" + key + FRESH_SUFFIX] = b"1"
+
+
+def invalidation(key, origin="other-process"):
+    return {"type": "message", "data": f"{origin}|{key}".encode()}
+
+
+def test_fetched_values_are_held_locally(cache):
+    store(cache, "a", "old")
+
+    assert cache.get("a") == "old"
+    assert cache.local.get("a") == (True, "old")
+
+
+def test_invalidation_mid_fetch_is_not_undone(cache):
+    store(cache, "a", "old")
+
+    def invalidate():
+        # another process wrote the key after the GET was answered
+        store(cache, "a", "new")
+        cache._on_message(invalidation("a"))
+
+    cache._read_client.on_execute = invalidate
+    assert cache.get("a") == "old"
+    assert cache.local.get("a") == (False, None)
+
+    cache._read_client.on_execute = lambda: None
+    assert cache.get("a") == "new"
+    assert cache.local.get("a") == (True, "new")
+
+
+def test_invalidation_of_another_key_mid_fetch(cache):
+    store(cache, "a", "old")
+    cache._read_client.on_execute = lambda: cache._on_message(invalidation("b"))
+
+    assert cache.get_many("a") == ["old"]
+    assert cache.local.get("a") == (True, "old")
+
+
+def test_clear_mid_fetch(cache):
+    store(cache, "a", "old")
+    cache._read_client.on_execute = lambda: cache._on_message(invalidation(CLEAR_ALL))
+
+    assert cache.get("a") == "old"
+    assert len(cache.local) == 0
+
+
+def test_own_invalidations_are_ignored(cache):
+    store(cache, "a", "old")
+    cache._read_client.on_execute = lambda: cache._on_message(invalidation("a", origin="this-process"))
+
+    cache.get("a")
+    assert cache.local.get("a") == (True, "old")
+
+
+@pytest.mark.parametrize("fresh, local_key", [(True, "a"), (False, "a" + STALE_SUFFIX)])
+def test_invalidation_mid_get_stale(cache, fresh, local_key):
+    store(cache, "a", "old", fresh=fresh)
+    cache._read_client.on_execute = lambda: cache._on_message(invalidation("a"))
+
+    assert cache.get_stale("a") == ("old", fresh)
+    assert cache.local.get(local_key) == (False, None)
+
+
+def test_forgotten_invalidations_count_for_older_reads(cache, monkeypatch):
+    monkeypatch.setattr(tiered_cache, "INVALIDATION_HISTORY", 2)
+    store(cache, "a", "old")
+
+    def invalidate_many():
+        for key in ("a", "b", "c"):
+            cache._on_message(invalidation(key))
+
+    cache._read_client.on_execute = invalidate_many
+    cache.get("a")
+    assert cache.local.get("a") == (False, None)
+    assert list(cache._key_generations) == ["b", "c"]